@@ -3,14 +3,12 @@ import requests
 import os
 import sys
 import threading
+import time
 import logging
-import albumentations as A
 import nest_asyncio
 nest_asyncio.apply()
 from flask import Flask, jsonify, make_response, request, Response
 from PIL import Image
-from tempfile import NamedTemporaryFile
-from transformers import DonutProcessor, VisionEncoderDecoderModel, AutoProcessor
 from io import BytesIO
 from io import StringIO
 
@@ -27,27 +25,160 @@ logging.basicConfig(
 # Classifier code:
 ## Our own modules ##
 import importlib.util
+from concurrent.futures import ThreadPoolExecutor
 spec = importlib.util.spec_from_file_location("classifiermodule", "/content/Sci2XML/app/backend/classifier.py")
 classifier = importlib.util.module_from_spec(spec)
 sys.modules["classifiermodule"] = classifier
 spec.loader.exec_module(classifier)
 
+def lazy_import(name):
+    """
+    Imports a module lazily: the module is only executed when one of its attributes is first used. The model modules
+     import torch, transformers, torchvision and albumentations, which take seconds to import, so an instance where
+     a model is disabled, or not used yet, doesn't pay for them.
+
+    Paramaters:
+    name: The full name of the module.
+
+    Returns:
+    The module, which is executed on first use.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
 # Models:
-import backend.models.classifiermodel as classifier_ML
-import backend.models.chartparser as charter
-import backend.models.formulaparser as formula
-import backend.models.figureparser as figure
+classifier_ML = lazy_import("backend.models.classifiermodel")
+charter = lazy_import("backend.models.chartparser")
+formula = lazy_import("backend.models.formulaparser")
+figure = lazy_import("backend.models.figureparser")
 import backend.models.tableparser as table
+import backend.diskcache as diskcache
+import backend.grobidclient as grobidclient
+import backend.metrics as metrics
+import backend.chunking as chunking
+import backend.modelregistry as modelregistry
+import backend.modelworkers as modelworkers
+
+# The runtime of the figure classifier: 'torch', or 'onnx' for ONNX Runtime. Can be set with classifier_backend in the .env file.
+CLASSIFIER_BACKEND = grobidclient.get_envdict().get("classifier_backend", "torch")
+
+# The natural language (NL) descriptions by Moondream2 are either a short caption or a detailed description.
+#  The mode can be set with nl_mode in the .env file, and for each request. Short captions are much faster in bulk ingestion.
+NL_MODES = ["short", "detailed"]
+
+# The most tokens Moondream2 may generate for the NL of each kind of element, in each mode. Can be changed for each request with max_tokens.
+NL_TOKEN_BUDGETS = {
+    "figure": {"short": 64, "detailed": 768},
+    "chart": {"short": 64, "detailed": 512},
+    "formula": {"short": 48, "detailed": 256},
+}
+
+# The instructions given to Moondream2 for each kind of element, in each mode.
+NL_PROMPTS = {
+    "figure": {"short": "Caption this figure in one sentence.", "detailed": "Describe and explain this figure with you own words."},
+    "chart": {"short": "Caption this chart in one sentence.", "detailed": "Describe this chart deeply. Caption it."},
+    "formula": {"short": "Describe in one sentence what this formula expresses.", "detailed": "Describe how the variables in this formula interacts with eachother."},
+}
+
+def load_classifier():
+    """
+    Loads the DenseNet169 figure classifier with the runtime set in CLASSIFIER_BACKEND.
+
+    Returns:
+    The classifier, which is used with classifier_ML.call_ml().
+    """
+    if CLASSIFIER_BACKEND == "onnx":
+        if registry.is_quantized("classifier"):
+            logging.warning(f"[APIcode.py] The ONNX classifier is not quantized, quantize only applies to the torch classifier.")
+        return classifier_ML.load_ml_onnx()
+    return classifier_ML.load_ml_inference(quantize=registry.is_quantized("classifier"))
+
+def load_moondream():
+    """
+    Loads Moondream2. The figure parser returns None if loading failed, which is raised here, so that the
+     model registry tries to load it again on the next use.
+
+    Returns:
+    (model, tokenizer): The Moondream2 model and tokenizer.
+    """
+    model, tokenizer = figure.load()
+    if model is None:
+        raise RuntimeError("Moondream2 could not be loaded.")
+    # Images asked about several times are only encoded once. The size of the cache can be set with moondream_cache_mb in the .env file, 0 turns it off.
+    figure.encoded_image_cache.max_bytes = int(grobidclient.get_envdict().get("moondream_cache_mb", 512)) * 1024 * 1024
+    return model, tokenizer
+
+def unload_moondream():
+    """
+    Releases the images encoded by Moondream2, which are kept in the cache of the figure parser module.
+    """
+    figure.encoded_image_cache.clear()
 
-print("\n#---------------------- ## Loading models ## -----------------------#\n")
-logging.info(f"[APIcode.py] Loading models.")
+def unload_unichart():
+    """
+    Releases the UniChart model and processor kept in the globals of the chart parser module.
+    """
+    charter.unichart_model, charter.unichart_processor = None, None
+
+def unload_sumen():
+    """
+    Releases the Sumen model and processor kept in the globals of the formula parser module.
+    """
+    formula.sumen_model, formula.sumen_processor = None, None
+
+# The models are registered by name, and loaded the first time they are needed, see backend/modelregistry.py.
+#  Which models are enabled is set with models in the .env file, e.g. models=sumen for an instance that only parses formulas.
+registry = modelregistry.registry
+# The functions of the model modules are wrapped in lambdas, so that registering a model doesn't import its module.
+#  The models set with quantize in the .env file are loaded with their Linear layers quantized to int8.
+if not modelworkers.WORKERS_ENABLED:
+    registry.register("classifier", load_classifier, warmup=lambda model: classifier_ML.warmup(model))
+    registry.register("unichart", lambda: charter.load_unichart(quantize=registry.is_quantized("unichart")), unload_unichart, warmup=lambda model: charter.warmup())
+    registry.register("sumen", lambda: formula.load_sumen(quantize=registry.is_quantized("sumen")), unload_sumen, warmup=lambda model: formula.warmup())
+    registry.register("moondream", load_moondream, unload_moondream, warmup=lambda model: figure.warmup(model[0]))
+else:
+    # Each model runs in its own worker process, with its own cores and threads, see backend/modelworkers.py.
+    #  Starting the worker loads and warms up the model, and unloading the model stops the worker.
+    #  The model modules are replaced by proxies, which call the functions of the modules in the workers.
+    worker_settings = {
+        "classifier": {"runtime": CLASSIFIER_BACKEND, "quantize": registry.is_quantized("classifier")},
+        "unichart": {"quantize": registry.is_quantized("unichart")},
+        "sumen": {"quantize": registry.is_quantized("sumen")},
+        "moondream": {"cache_mb": int(grobidclient.get_envdict().get("moondream_cache_mb", 512))},
+    }
+    worker_plan = modelworkers.plan_workers([name for name in modelworkers.MODEL_MODULES if registry.enabled is None or name in registry.enabled])
+    workers = {}
+    for name in modelworkers.MODEL_MODULES:
+        threads, cpus = worker_plan.get(name, (1, None))
+        workers[name] = modelworkers.ModelWorker(name, threads, cpus, worker_settings[name])
+        registry.register(name, workers[name].start, workers[name].stop)
+    classifier_ML = modelworkers.ModuleProxy(workers["classifier"], modelworkers.MODEL_MODULES["classifier"])
+    charter = modelworkers.ModuleProxy(workers["unichart"], modelworkers.MODEL_MODULES["unichart"])
+    formula = modelworkers.ModuleProxy(workers["sumen"], modelworkers.MODEL_MODULES["sumen"])
+    figure = modelworkers.ModuleProxy(workers["moondream"], modelworkers.MODEL_MODULES["moondream"])
+    logging.info(f"[APIcode.py] Running the models in worker processes: {worker_plan}.")
+
+lazy_models = False # Set when the models are only loaded when they are first used, see /ready.
 try:
-    # Loading the various parsing models by calling the load function in their module.
-    ML = classifier_ML.load_ml()
-    charter.load_unichart()
-    formula.load_sumen()
-    figure_parser_model, figure_parser_tokenizer = figure.load()
-    logging.info(f"[APIcode.py] Finished loading models.")
+    envdict = grobidclient.get_envdict()
+    lazy_models = envdict.get("lazy_models", "False") == "True"
+    if not lazy_models:
+        # Load the enabled models now and warm them up, so that the first requests don't have to wait for them.
+        print("\n#---------------------- ## Loading models ## -----------------------#\n")
+        logging.info(f"[APIcode.py] Loading models.")
+        models_start = time.time()
+        registry.preload()
+        logging.info(f"[APIcode.py] Finished loading models in {time.time() - models_start:.1f} seconds.")
+    else:
+        logging.info(f"[APIcode.py] Models will be loaded when they are first used.")
+    registry.start_idle_unloader()
 except Exception as e:
     logging.error(f"[APIcode.py] An error occurred while loading the models: {e}", exc_info=True)
 
@@ -67,10 +198,108 @@ def API(portnr):
   def hello():
       return "I am alive!"
 
+  @app.route("/metrics")
+  def get_metrics():
+      """
+      Endpoint for monitoring. Returns the counters and timings collected by the API, e.g. the GROBID latency,
+       the number of retries when GROBID was busy and the cache hits.
+
+      Paramaters:
+      None
+
+      Returns:
+      JSON with the counters, the timings (count, mean, p50, p95, p99 and max in seconds), the state of each GROBID server
+       and the state of each model.
+      """
+      snapshot = metrics.snapshot()
+      snapshot["grobid_servers"] = grobidclient.get_pool().status()
+      snapshot["models"] = registry.status()
+      return jsonify(snapshot)
+
+  @app.route("/ready")
+  def ready():
+      """
+      Endpoint for readiness checks, e.g. by a load balancer or run_pipeline.py. Unlike "/", which answers as soon as
+       the API runs, this only reports ready when the models loaded at startup are warmed up and a GROBID server is alive.
+       With lazy_models no model is loaded at startup, so the instance can take requests as soon as GROBID is alive,
+       but the first request for each model has to load it. The status is then 'lazy' instead of 'ready', so that a
+       cold instance is not mistaken for a warm one.
+
+      Paramaters:
+      None
+
+      Returns:
+      JSON with the overall state ('ready', 'lazy' or 'not_ready') and the state of each model, including its warm-up time.
+       Status 200 if ready or lazy, otherwise 503.
+      """
+      pool = grobidclient.get_pool()
+      if pool.health_thread is None:
+        # A single GROBID server isn't checked in the background, so check it now
+        pool.check_health()
+      grobid_servers = pool.status()
+      grobid_ready = any(server["healthy"] for server in grobid_servers.values())
+      models_ready = registry.is_ready()
+
+      if not (models_ready and grobid_ready):
+        status = "not_ready"
+      elif lazy_models:
+        status = "lazy"
+      else:
+        status = "ready"
+
+      body = {"ready": models_ready and grobid_ready, "status": status, "models_ready": models_ready, "grobid_ready": grobid_ready,
+              "lazy_models": lazy_models, "models": registry.status(), "grobid_servers": grobid_servers}
+      return jsonify(body), 200 if body["ready"] else 503
+
+  def disabled_models_response(*names):
+      """
+      Checks that the models an endpoint needs are enabled on this instance.
+
+      Paramaters:
+      names: The names of the models in the model registry.
+
+      Returns:
+      A 503 JSON response naming the disabled models, or None if they are all enabled.
+      """
+      disabled = [name for name in names if not registry.is_enabled(name)]
+      if disabled:
+        logging.warning(f"[APIcode.py] Request needs models which are not enabled on this instance: {', '.join(disabled)}.")
+        return jsonify({"error": f"Models not enabled on this instance: {', '.join(disabled)}"}), 503
+      return None
+
+  def nl_settings(element_type):
+      """
+      Gets the NL mode and the token budget of Moondream2 for the current request. Both can be sent with the request,
+      as 'nl_mode' ('short' or 'detailed') and 'max_tokens'. Otherwise the mode set with nl_mode in the .env file is
+      used, with the token budget of the element type in that mode.
+
+      Paramaters:
+      element_type (str): 'figure', 'chart' or 'formula'.
+
+      Returns:
+      nl_mode (str): The NL mode.
+      max_tokens (int): The token budget.
+      """
+      nl_mode = get_envdict().get("nl_mode", "detailed")
+      if 'nl_mode' in request.files:
+        nl_mode = request.files['nl_mode'].read().decode("utf-8").strip()
+      if nl_mode not in NL_MODES:
+        logging.warning(f"[APIcode.py] Unknown NL mode '{nl_mode}', using detailed.")
+        nl_mode = "detailed"
+
+      max_tokens = NL_TOKEN_BUDGETS[element_type][nl_mode]
+      try:
+        if 'max_tokens' in request.files:
+          max_tokens = max(1, int(request.files['max_tokens'].read().decode("utf-8")))
+      except Exception as e:
+        logging.error(f"[APIcode.py] An error occurred while reading max_tokens of the request: {e}", exc_info=True)
+      return nl_mode, max_tokens
+
   @app.route('/parse_formula', methods=['POST'])
   def handle_formula():
       """
-      Endpoint for parsing formulas. It accepts an image file in POST body.
+      Endpoint for parsing formulas. It accepts an image file in POST body, and optionally GROBID's raw text of the formula,
+      which is used to predict how many tokens the LaTeX needs, and the NL mode and token budget, see nl_settings().
 
       Paramaters:
       None
@@ -80,6 +309,11 @@ def API(portnr):
       """
       print("\n")
       logging.info(f"[APIcode.py] parse_formula - You have reached endpoint for formula.")
+
+      # Make sure the models are enabled on this instance:
+      disabled_response = disabled_models_response("sumen")
+      if disabled_response is not None:
+          return disabled_response
       
       # Make sure an image is present:
       if 'image' not in request.files:
@@ -87,20 +321,27 @@ def API(portnr):
 
       file = request.files['image']
 
+      # The raw text is optional, older clients only send the image:
+      string_data_text = ""
+      if 'text' in request.files:
+        string_data_text = request.files['text'].read().decode("utf-8")
+
+      nl_mode, max_tokens = nl_settings("formula")
+
       # Process image:
       try:
-        processedFormulaLaTex, processedFormulaNL = process_formula(file)
+        processedFormulaLaTex, processedFormulaNL = process_formula(file, string_data_text, nl_mode, max_tokens)
         logging.info(f"[APIcode.py] Successfully processed formula.")
       except Exception as e:
         logging.error(f"[APIcode.py] An error occurred while processing formula: {e}", exc_info=True)
 
       # Return parsed content
-      return jsonify({'element_type':"formula", 'formula': processedFormulaLaTex, "NL": processedFormulaNL, "preferred": processedFormulaLaTex})
+      return jsonify({'element_type':"formula", 'formula': processedFormulaLaTex, "NL": processedFormulaNL, "preferred": processedFormulaLaTex, "nl_mode": nl_mode, "nl_max_tokens": max_tokens})
 
   @app.route('/parse_chart', methods=['POST'])
   def handle_chart():
       """
-      Endpoint for parsing charts. It accepts an image file in POST body.
+      Endpoint for parsing charts. It accepts an image file in POST body, and optionally the NL mode and token budget, see nl_settings().
 
       Paramaters:
       None
@@ -111,6 +352,11 @@ def API(portnr):
       print("\n")
       logging.info(f"[APIcode.py] parse_chart - You have reached endpoint for chart.")
 
+      # Make sure the models are enabled on this instance:
+      disabled_response = disabled_models_response("unichart", "moondream")
+      if disabled_response is not None:
+          return disabled_response
+
       # Make sure an image is present:
       if 'image' not in request.files:
           return jsonify({"error": "No file uploaded"}), 400
@@ -130,19 +376,22 @@ def API(portnr):
       except Exception as e:
         logging.error(f"[APIcode.py] An error occurred while fetching string value from bytestream: {e}", exc_info=True)
 
+      nl_mode, max_tokens = nl_settings("chart")
+
       # Process image:
+      chart_timings = {}
       try:
-        processedChartCSV, processedChartNL = process_chart(file, string_data_prompt)
+        processedChartCSV, processedChartNL = process_chart(file, string_data_prompt, chart_timings, nl_mode, max_tokens)
         logging.info(f"[APIcode.py] Successfully processed chart.")
       except Exception as e:
         logging.error(f"[APIcode.py] An error occurred while processing chart: {e}", exc_info=True)
 
-      return jsonify({'element_type':"chart", 'NL': processedChartNL, "csv": processedChartCSV, "preferred": processedChartNL})
+      return jsonify({'element_type':"chart", 'NL': processedChartNL, "csv": processedChartCSV, "preferred": processedChartNL, "timings": chart_timings, "nl_mode": nl_mode, "nl_max_tokens": max_tokens})
 
   @app.route('/parse_figure', methods=['POST'])
   def handle_figure():
       """
-      Endpoint for parsing figures. It accepts an image file in POST body.
+      Endpoint for parsing figures. It accepts an image file in POST body, and optionally the NL mode and token budget, see nl_settings().
 
       Paramaters:
       None
@@ -153,6 +402,11 @@ def API(portnr):
       print("\n")
       logging.info(f"[APIcode.py] parse_figure - You have reached endpoint for figure.")
 
+      # Make sure the models are enabled on this instance:
+      disabled_response = disabled_models_response("moondream")
+      if disabled_response is not None:
+          return disabled_response
+
       # Make sure an image is present:
       if 'image' not in request.files:
           return jsonify({"error": "No file uploaded"}), 400
@@ -172,14 +426,16 @@ def API(portnr):
       except Exception as e:
         logging.error(f"[APIcode.py] An error occurred while fetching string value from bytestream: {e}", exc_info=True)
 
+      nl_mode, max_tokens = nl_settings("figure")
+
       # Process image:
       try:
-        processed_figure_NL = process_figures(file, string_data_prompt)
+        processed_figure_NL = process_figures(file, string_data_prompt, nl_mode, max_tokens)
         logging.info(f"[APIcode.py] Successfully processed figure.")
       except Exception as e:
         logging.error(f"[APIcode.py] An error occurred while processing figure: {e}", exc_info=True)
 
-      return jsonify({'element_type':"figure", 'NL': processed_figure_NL, "preferred": processed_figure_NL})
+      return jsonify({'element_type':"figure", 'NL': processed_figure_NL, "preferred": processed_figure_NL, "nl_mode": nl_mode, "nl_max_tokens": max_tokens})
 
   @app.route('/parse_table', methods=['POST'])
   def handle_table():
@@ -217,12 +473,15 @@ def API(portnr):
           headers={"Content-Disposition": "attachment; filename=updated_grobid.xml"}
       )
 
-  def process_formula(file):
+  def process_formula(file, text="", nl_mode="detailed", max_tokens=None):
       """
       Processes the formula. More specifically redirects to the OCR model.
 
       Paramaters:
       file: The file/image to be processed.
+      text: GROBID's raw text of the formula. Used with the size of the image to predict the token budget of the OCR model.
+      nl_mode: 'short' or 'detailed' NL.
+      max_tokens: The most tokens of the NL.
 
       Returns:
       latex_code: The generated LaTeX code.
@@ -237,7 +496,11 @@ def API(portnr):
 
       # Send to sumen:
       try:
-        latex_code = formula.run_sumen_ocr(image)
+        with registry.use("sumen"):
+          # Short formulas get a smaller token budget than long ones, unless turned off with formula_length_budget in the .env file
+          #  The budget is predicted by run_sumen_ocr itself, so a model worker gets the image only once
+          length_budget = get_envdict().get("formula_length_budget", "True") == "True"
+          latex_code = formula.run_sumen_ocr(image, decoding_policy=registry.decoding_policy("sumen"), length_budget=length_budget, text=text)
         logging.info(f"[APIcode.py] Successfully called sumen.")
       except Exception as e:
         logging.error(f"[APIcode.py] An error occurred while calling sumen: {e}", exc_info=True)
@@ -253,8 +516,9 @@ def API(portnr):
         envdict = get_envdict()
         if (envdict["nl_formula"] == "True"):
           logging.info(f"[APIcode.py] Environment variable nl_formula is true, will be generating NL content.")
-          prompt = "Describe how the variables in this formula interacts with eachother."
-          NL_data = figure_parser_model.query(image, prompt)["answer"]
+          prompt = NL_PROMPTS["formula"][nl_mode]
+          with registry.use("moondream") as (figure_parser_model, figure_parser_tokenizer):
+            NL_data = figure.query(figure_parser_model, image, prompt, max_tokens=max_tokens)["answer"]
           logging.info(f"[APIcode.py] Successfully called moondream and generated NL.")
         
         else:
@@ -267,36 +531,59 @@ def API(portnr):
       
       return latex_code, NL_data
 
-  def process_chart(file, prompt_context):
+  def process_chart(file, prompt_context, timings=None, nl_mode="detailed", max_tokens=None):
       """
       Processes the chart. More specifically redirects to the chart model for extracting tabledata, and call moondream(figureparser) to generate summary.
+      The two models are independent, so they run at the same time, unless turned off with chart_concurrency in the .env file.
+      The request then takes as long as the slower of them, instead of the sum.
 
       Paramaters:
       file: The file/image to be processed.
       prompt_context: A string with the figure description. Can be used to give context to the prompt for the VLM.
+      timings: Optional dict, which gets the time each model took and the total time, in seconds.
+      nl_mode: 'short' caption or 'detailed' summary.
+      max_tokens: The most tokens of the summary.
 
       Returns:
       summary: The generated summary.
       table_data: The generated table data.
       """
       logging.info(f"[APIcode.py] process_chart - processing chart...")
+      start = time.time()
+      if timings is None:
+        timings = {}
       
       # Ensure proper file
       if file.filename == '':
           return jsonify({"error": "No selected file"}), 400
       image = Image.open(BytesIO(file.read())).convert('RGB')
 
-      # Send to UniChart to get parsed tabledata:
-      try:
-        table_data = charter.generate_unichart_response(image, "<extract_data_table><s_answer>")
-        structured_table_data = charter.parse_table_data(table_data)
-        logging.info(f"[APIcode.py] Successfully called UniChart.")
-      except Exception as e:
-        logging.error(f"[APIcode.py] An error occurred while calling UniChart: {e}", exc_info=True)
+      # When both models run at the same time on CPU, each gets half of the cores. Workers have their own cores already.
+      #  The cores are those the process may run on, like in modelworkers.plan_workers(), since in a container with a
+      #  CPU limit os.cpu_count() is the number of cores of the host.
+      concurrent = get_envdict().get("chart_concurrency", "True") == "True"
+      cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 2)
+      threads = max(1, cores // 2) if concurrent and not modelworkers.WORKERS_ENABLED else None
 
-      # Send to Moondream to get summary of chart:
-      try:
-        query = f"Describe this chart deeply. Caption it."
+      def extract_table_data():
+        # Send to UniChart to get parsed tabledata:
+        model_start = time.time()
+        try:
+          with registry.use("unichart"), modelregistry.intra_op_threads(threads):
+            table_data = charter.generate_unichart_response(image, "<extract_data_table><s_answer>", decoding_policy=registry.decoding_policy("unichart"))
+          structured_table_data = charter.parse_table_data(table_data)
+          logging.info(f"[APIcode.py] Successfully called UniChart.")
+        except Exception as e:
+          logging.error(f"[APIcode.py] An error occurred while calling UniChart: {e}", exc_info=True)
+          structured_table_data = []
+        timings["unichart"] = round(time.time() - model_start, 3)
+        metrics.observe("chart_unichart", time.time() - model_start)
+        return structured_table_data
+
+      def summarize():
+        # Send to Moondream to get summary of chart:
+        model_start = time.time()
+        query = NL_PROMPTS["chart"][nl_mode]
         query_with_context = f"{query} Here is the figure description for context: {prompt_context}"
         
         if (0 < len(prompt_context) < 700): # If the extracted prompt-context is of acceptable length then pass it to model:
@@ -306,22 +593,44 @@ def API(portnr):
           prompt = query
 
         logging.info(f"[APIcode.py] Prompt for moonchart used for describing chart: {prompt}.")
-        summary = figure_parser_model.query(image, prompt)["answer"]
-        logging.info(f"[APIcode.py] Successfully called moondream.")
-      
+        try:
+          with registry.use("moondream") as (figure_parser_model, figure_parser_tokenizer), modelregistry.intra_op_threads(threads):
+            summary = figure.query(figure_parser_model, image, prompt, max_tokens=max_tokens)["answer"]
+          logging.info(f"[APIcode.py] Successfully called moondream.")
+        finally:
+          timings["moondream"] = round(time.time() - model_start, 3)
+          metrics.observe("chart_moondream", time.time() - model_start)
+        return summary
+
+      # The threads don't need the request context, as jsonify() is only called here
+      if concurrent:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+          table_future = executor.submit(extract_table_data)
+          summary_future = executor.submit(summarize)
+        structured_table_data = table_future.result()
+      else:
+        structured_table_data = extract_table_data()
+        summary_future = None
+
+      try:
+        summary = summary_future.result() if summary_future is not None else summarize()
       except Exception as e:
         
         return jsonify({"error": f"Model query failed: {str(e)}"}), 500
       
+      timings["total"] = round(time.time() - start, 3)
+      logging.info(f"[APIcode.py] Processed chart in {timings['total']} seconds (UniChart {timings.get('unichart')}, Moondream {timings.get('moondream')}).")
       return structured_table_data, summary
 
-  def process_figures(file, prompt_context):
+  def process_figures(file, prompt_context, nl_mode="detailed", max_tokens=None):
       """
       Processes the figure. More specifically redirects to the VLM model.
 
       Paramaters:
       image: The file/image to be processed.
       prompt_context: A string with the figure description. Can be used to give context to the prompt for the VLM.
+      nl_mode: 'short' caption or 'detailed' description.
+      max_tokens: The most tokens of the description.
 
       Returns:
       NL_data: The generated NL data.
@@ -341,11 +650,12 @@ def API(portnr):
         return jsonify({"error": f"Invalid image file: {str(e)}"}), 400
 
       try:
-        if (0 < len(prompt_context) < 700): # If the extracted prompt-context is of acceptable length then pass it to model:
-          answer = figure_parser_model.query(image, f"Describe and explain this figure with you own words. Here is the figure description for context: '{prompt_context}'")["answer"]
-        
-        else: # If extracted prompt-context is of length 0 or very long then simply do not give the model additional context:
-          answer = figure_parser_model.query(image, f"Describe this image deeply. Caption it.")["answer"]
+        with registry.use("moondream") as (figure_parser_model, figure_parser_tokenizer):
+          if (0 < len(prompt_context) < 700): # If the extracted prompt-context is of acceptable length then pass it to model:
+            answer = figure.query(figure_parser_model, image, f"{NL_PROMPTS['figure'][nl_mode]} Here is the figure description for context: '{prompt_context}'", max_tokens=max_tokens)["answer"]
+          
+          else: # If extracted prompt-context is of length 0 or very long then simply do not give the model additional context:
+            answer = figure.query(figure_parser_model, image, NL_PROMPTS["figure"][nl_mode], max_tokens=max_tokens)["answer"]
       
       except Exception as e:
         
@@ -361,46 +671,32 @@ def API(portnr):
         - 'grobid_xml': A GROBID XML file in which the tables will be replaced.
 
         Process:
-        1. Save the uploaded files temporarily.
-        2. Extract tables from the PDF file (using pdfplumber) and get the XML content directly.
-        3. Remove existing table figures from the GROBID XML and get the position of the first removed table.
-        4. Insert the pdfplumber XML content into the GROBID XML at that position (or append if no tables are found).
-        5. Remove empty lines and return the updated GROBID XML as a downloadable file.
+        1. Read the uploaded PDF file and GROBID XML content.
+        2. Extract tables from the PDF file (using the selected table backend, pdfplumber by default) and get the XML content directly.
+           The extracted tables are cached on disk, keyed by the SHA-256 hash of the PDF and the extraction parameters,
+           so reruns, retries and duplicate PDFs in a batch don't parse the same PDF again.
+        3. In a single pass over the GROBID XML: remove existing table figures, insert the pdfplumber XML content
+           at the position of the first removed table (or before </TEI> if no tables are found) and remove empty lines.
+        4. Return the updated GROBID XML as a downloadable file.
         
         Returns:
             Response: A Flask Response object with the updated GROBID XML, served as an XML file.
         """
         logging.info(f"[APIcode.py] process_table - Processing table...")
         
-        # Save the PDF file temporarily
-        with NamedTemporaryFile(delete=False, suffix=".pdf") as temp_pdf:
-            pdf_file.save(temp_pdf)
-            pdf_path = temp_pdf.name
-
-        # Save the GROBID XML file temporarily
-        with NamedTemporaryFile(delete=False, suffix=".xml") as temp_grobid:
-            grobid_xml_file.save(temp_grobid)
-            grobid_path = temp_grobid.name
-        
-        # Read the content of the GROBID XML file
-        with open(grobid_path, "r", encoding="utf-8") as file:
-            grobid_content = file.read()
-        # File is automatically closed after exiting the 'with' block
-        
-        # Remove existing table figures from the GROBID XML and get the insert position
-        grobid_updated, insert_position = table.remove_tables_from_grobid_xml(grobid_path)
-        
-        # Extract tables from the PDF and obtain the XML content and table count
-        pdfplumber_xml, table_count = table.extract_tables_from_pdf(pdf_path)
-        
-        # Insert the pdfplumber XML content into the GROBID XML content
-        final_grobid_xml = table.insert_pdfplumber_content(grobid_updated, pdfplumber_xml, insert_position)
-        # Remove any empty lines from the final XML
-        final_grobid_xml = table.remove_empty_lines(final_grobid_xml)
+        # Read the content of the PDF file and the GROBID XML file directly from the upload
+        pdf_bytes = pdf_file.read()
+        grobid_content = grobid_xml_file.read().decode("utf-8")
+
+        # Table extraction backend. Either what the user selected at launch, or default pdfplumber.
+        envdict = get_envdict()
+        backend = envdict.get("table_backend", table.DEFAULT_TABLE_BACKEND)
+
+        # Extract tables from the PDF (or get them from the cache) and obtain the XML content and table count
+        pdfplumber_xml, table_count = table.extract_tables_from_pdf_cached(pdf_bytes, table_cache, backend=backend)
         
-        # Remove the temporary files
-        os.remove(pdf_path)
-        os.remove(grobid_path)
+        # Remove existing table figures from the GROBID XML, insert the pdfplumber XML content and remove empty lines
+        final_grobid_xml, removed_tables = table.splice_tables_into_grobid_xml(grobid_content, pdfplumber_xml)
         
         data = final_grobid_xml
         return data
@@ -436,6 +732,11 @@ def API(portnr):
       print("\n")
       logging.info(f"[APIcode.py] call_classifier - You have reached endpoint for classifier ML.")
 
+      # Make sure the model is enabled on this instance:
+      disabled_response = disabled_models_response("classifier")
+      if disabled_response is not None:
+          return disabled_response
+
       # Make sure an image is present:
       if 'image' not in request.files:
           return jsonify({"error": "No file uploaded"}), 400
@@ -445,7 +746,8 @@ def API(portnr):
 
       # Process image:
       try:
-        response = classifier_ML.call_ml(ML, image)
+        with registry.use("classifier") as ML:
+          response = classifier_ML.call_ml(ML, image)
         logging.info(f"[APIcode.py] Successfully classified image.")
       except Exception as e:
         logging.error(f"[APIcode.py] An error occurred while classifying image: {e}", exc_info=True)
@@ -482,62 +784,83 @@ def API(portnr):
 
       ## Calling GROBID ##
       logging.info(f"[APIcode.py] process - Calling GROBID.")
-      grobid_url="http://172.28.0.12:8070/api/processFulltextDocument"
-      files = {'input': byte_data_PDF}
-      params = {
-                    "consolidateHeader": 1,
-                    "consolidateCitations": 1,
-                    "consolidateFunders": 1,
-                    "includeRawAffiliations": 1,
-                    "includeRawCitations": 1,
-                    "segmentSentences": 1,
-                    "teiCoordinates": ["ref", "s", "biblStruct", "persName", "figure", "formula", "head", "note", "title", "affiliation"]
-                }
-      # Call GROBID server:
+      # The GROBID cache can be bypassed by sending the form field grobid_cache=False:
+      use_grobid_cache = request.form.get("grobid_cache", "True") != "False"
+      # The GROBID processing profile can be chosen with the form field grobid_profile, e.g. grobid_profile=fast:
+      grobid_profile = request.form.get("grobid_profile", grobidclient.DEFAULT_GROBID_PROFILE)
+      if grobid_profile not in grobidclient.GROBID_PROFILES:
+          return jsonify({"error": f"Unknown grobid_profile, choose one of: {', '.join(grobidclient.GROBID_PROFILES)}"}), 400
+
+      # Very large PDFs can be split into chunks of pages by sending the form field chunk_pages, e.g. chunk_pages=50:
       try:
-        response = requests.post(grobid_url, files=files, data=params)  # Use 'data' for form-data
-        response.raise_for_status()  # Raise exception if status is not 200
-        string_data_XML = response.text
-        logging.info(f"[APIcode.py] Successfully called GROBID server.")
-        # Check if coordinates are missing in the response
-        if 'coords' not in response.text:
-            logging.warning("[APIcode.py] No coordinates found in PDF file. Please check GROBID settings.")
-      except Exception as e:
-        logging.error(f"[APIcode.py] An error occurred while calling GROBID server: {e}", exc_info=True)
+        chunk_pages = int(request.form.get("chunk_pages", chunking.CHUNK_PAGES))
+        if chunk_pages < 0:
+          raise ValueError("chunk_pages is negative")
+      except ValueError:
+        return jsonify({"error": "chunk_pages must be a whole number of pages, or 0 to turn chunking off"}), 400
+      chunked = False
+      if chunk_pages:
+        try:
+          chunked = chunking.get_page_count(byte_data_PDF) > chunk_pages
+        except Exception as e:
+          logging.error(f"[APIcode.py] An error occurred while counting the pages of the PDF, processing it without chunks: {e}", exc_info=True)
 
-      ## Table Parser ##
-      logging.info(f"[APIcode.py] process - Initiating table parser.")
-      # Run the xml and pdf through the tableparser before processing further. Could also be done after the processing of the other elements instead.
-      # Ready the files:
-      files = {"grobid_xml": ("xml_file.xml", string_data_XML, "application/json"), "pdf": ("pdf_file.pdf", byte_data_PDF)}
+      if chunked:
+        # GROBID and the table parser process the chunks at the same time:
+        logging.info(f"[APIcode.py] process - Calling GROBID and table parser on chunks of {chunk_pages} pages.")
+        try:
+          string_data_XML = chunking.process_pdf_in_chunks(byte_data_PDF, chunk_pages=chunk_pages, use_grobid_cache=use_grobid_cache, grobid_profile=grobid_profile,
+                                                           table_backend=get_envdict().get("table_backend", table.DEFAULT_TABLE_BACKEND))
+        except Exception as e:
+          logging.error(f"[APIcode.py] An error occurred while processing the chunks: {e}", exc_info=True)
+          return jsonify({"error": "GROBID could not process the PDF file"}), 502
 
-      try:
-        # Send to API endpoint for processing of tables
+      else:
+        # Call GROBID server (or get the response from the GROBID cache):
         try:
-            envdict = get_envdict()
-            if ("port" not in envdict): # If key doesnt exist, create it with default value '8000':
-                with open("/content/.env", "a") as f:
-                    f.write("port=8000\n")
-                # File is automatically closed after exiting the 'with' block
-            envdict = get_envdict()
-            port = envdict["port"] # Either what the user selected at launch, or default 8000
-            api_url = f"http://172.28.0.12:{port}/" # The URL for the local API.
-            logging.info(f"[APIcode.py] Set URL for api to: {api_url}")
+          string_data_XML = grobidclient.process_fulltext_document(byte_data_PDF, use_cache=use_grobid_cache, profile=grobid_profile)
+          logging.info(f"[APIcode.py] Successfully called GROBID server.")
+          # Check if coordinates are missing in the response
+          if 'coords' not in string_data_XML:
+              logging.warning("[APIcode.py] No coordinates found in PDF file. Please check GROBID settings.")
         except Exception as e:
-            api_url = "http://172.28.0.12:8000/" # The URL for the local API.
-            logging.error(f"[APIcode.py] An error occurred while setting the port and URL for api: {e}", exc_info=True)
+          logging.error(f"[APIcode.py] An error occurred while calling GROBID server: {e}", exc_info=True)
+          return jsonify({"error": "GROBID could not process the PDF file"}), 502
+
+        ## Table Parser ##
+        logging.info(f"[APIcode.py] process - Initiating table parser.")
+        # Run the xml and pdf through the tableparser before processing further. Could also be done after the processing of the other elements instead.
+        # Ready the files:
+        files = {"grobid_xml": ("xml_file.xml", string_data_XML, "application/json"), "pdf": ("pdf_file.pdf", byte_data_PDF)}
+
+        try:
+          # Send to API endpoint for processing of tables
+          try:
+              envdict = get_envdict()
+              if ("port" not in envdict): # If key doesnt exist, create it with default value '8000':
+                  with open("/content/.env", "a") as f:
+                      f.write("port=8000\n")
+                  # File is automatically closed after exiting the 'with' block
+              envdict = get_envdict()
+              port = envdict["port"] # Either what the user selected at launch, or default 8000
+              api_url = f"http://172.28.0.12:{port}/" # The URL for the local API.
+              logging.info(f"[APIcode.py] Set URL for api to: {api_url}")
+          except Exception as e:
+              api_url = "http://172.28.0.12:8000/" # The URL for the local API.
+              logging.error(f"[APIcode.py] An error occurred while setting the port and URL for api: {e}", exc_info=True)
         
-        response = requests.post(f"{api_url}parse_table", files=files)
-        string_data_XML = response.text
-        logging.info(f'[APIcode.py] Response from table parser: {response}')
-      except requests.exceptions.RequestException as e:
-        logging.error(f"An error occurred while communication with the table parser: {e}", exc_info=True)
+          response = requests.post(f"{api_url}parse_table", files=files)
+          string_data_XML = response.text
+          logging.info(f'[APIcode.py] Response from table parser: {response}')
+        except requests.exceptions.RequestException as e:
+          logging.error(f"An error occurred while communication with the table parser: {e}", exc_info=True)
 
       ##  Starting classifier ##
       logging.info(f"[APIcode.py] process - Initiating Classifier.")
       try:
         # Open the XML file and extract all figures and formulas, as well as getting each page of the PDF as an image.
-        images, figures, formulas = classifier.open_XML(string_data_XML, byte_data_PDF, frontend=False)
+        # For chunked PDFs, only one chunk of pages is converted to images at a time:
+        images, figures, formulas = classifier.open_XML(string_data_XML, byte_data_PDF, frontend=False, page_block=chunk_pages if chunked else None)
         logging.info(f'[APIcode.py] Successfully opened XML file.')
       except requests.exceptions.RequestException as e:
         logging.error(f"An error occurred while opening the XML file: {e}", exc_info=True)
@@ -581,10 +904,18 @@ def API(portnr):
     for env in envlist:
         if (env == ""):
             continue
-        # Map correct value to key:
-        envdict[env.split("=")[0]] = env.split("=")[1]
+        # Map correct value to key. Only the first '=' separates them, as values like 'sumen=adaptive,unichart=beam' contain '=' too:
+        envdict[env.split("=", 1)[0]] = env.split("=", 1)[1]
 
     return envdict
 
+  # Cache for the tables extracted from the PDFs. Its size can be set with table_cache_mb in the .env file.
+  try:
+    envdict = get_envdict()
+    table_cache = diskcache.DiskCache("/content/cache/tables", max_mb=int(envdict.get("table_cache_mb", 256)))
+  except Exception as e:
+    table_cache = diskcache.DiskCache("/content/cache/tables")
+    logging.error(f"[APIcode.py] An error occurred while setting the size of the table cache: {e}", exc_info=True)
+
   port = portnr # default 8000
   threading.Thread(target=app.run, kwargs={'host':'0.0.0.0','port':port}).start()
\ No newline at end of file
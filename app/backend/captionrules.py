@@ -0,0 +1,84 @@
+import re
+import sys
+import logging
+
+import backend.metrics as metrics
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s: %(message)s',
+    force=True,
+    handlers=[
+        logging.FileHandler("app.log"),  # Log to a file named 'app.log'
+        logging.StreamHandler(sys.stdout)  # Also log to console
+    ]
+)
+
+# Keyword rules over the caption of a figure, for each class of the figure classifier (classifiermodel.CLASS_NAMES).
+#  Only the first sentence of the caption is used, since it normally names what the figure is. The later sentences
+#  often mention other things, e.g. 'The bars show...' under a line plot.
+CAPTION_RULES = {
+    "table": [r"^table\s*[ivx\d]+\b"],
+    "pie_chart": [r"\bpie[- ]?charts?\b"],
+    "bar_chart": [r"\bbar[- ]?(charts?|graphs?|plots?)\b", r"\bhistograms?\b"],
+    "graph": [r"\b(line|scatter)[- ]?plots?\b", r"\bas a function of\b", r"\bversus\b", r"\bvs\b", r"\bcurves?\b"],
+    "flow_chart": [r"\bflow[- ]?(charts?|diagrams?)\b", r"\bworkflows?\b", r"\bpipelines?\b", r"\barchitectures?\b"],
+    "just_image": [r"\bphoto(graph)?s?\b"],
+}
+
+def match_caption(caption, head="", figure_type=""):
+    """
+    Classifies a figure from its caption, without looking at the image. Only captions which match the rules of exactly
+    one class are classified, e.g. 'Bar chart of the accuracy...' or 'Table 3: ...'. Captions which match none, or the
+    rules of several classes ('Accuracy versus depth of each architecture'), are left to the figure classifier.
+
+    Parameters:
+    caption (str): The text of the <figDesc> tag of the figure.
+    head (str): The text of the <head> tag of the figure, e.g. 'Figure 3' or 'Table 2'.
+    figure_type (str): The type attribute of the <figure> tag. GROBID sets it to 'table' for tables.
+
+    Returns:
+    (str): The class, as named by the figure classifier. None if the caption is ambiguous.
+    """
+    if figure_type == "table":
+        return "table"
+
+    head = (head or "").strip().lower()
+    first_sentence = re.split(r"(?<=\.)\s+(?=[A-Z])", (caption or "").strip(), maxsplit=1)[0].lower()
+
+    matches = set()
+    for figure_class, patterns in CAPTION_RULES.items():
+        for text in ([first_sentence, head] if figure_class == "table" else [first_sentence]):
+            if any(re.search(pattern, text) for pattern in patterns):
+                matches.add(figure_class)
+    if len(matches) != 1:
+        return None
+    return matches.pop()
+
+def caption_class(caption, head, figure_type, element_nr):
+    """
+    Classifies a figure with match_caption(), and counts and logs the result. The counters are 'caption_fast_path',
+    'caption_fast_path_<class>' and 'caption_ambiguous'.
+
+    Parameters:
+    caption (str): The text of the <figDesc> tag of the figure.
+    head (str): The text of the <head> tag of the figure.
+    figure_type (str): The type attribute of the <figure> tag.
+    element_nr (int): The number of the element, for the log.
+
+    Returns:
+    (str): The class, as named by the figure classifier. None if the figure has to be sent to the figure classifier.
+    """
+    try:
+        figure_class = match_caption(caption, head, figure_type)
+    except Exception as e:
+        logging.error(f"[captionrules.py] An error occurred while matching the caption of figure {element_nr}: {e}", exc_info=True)
+        return None
+
+    if figure_class is None:
+        metrics.increment("caption_ambiguous")
+        return None
+    metrics.increment("caption_fast_path")
+    metrics.increment(f"caption_fast_path_{figure_class}")
+    logging.info(f"[captionrules.py] Figure {element_nr} classified as '{figure_class}' from its caption.")
+    return figure_class
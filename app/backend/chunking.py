@@ -0,0 +1,346 @@
+import io
+import os
+import re
+import sys
+import time
+import logging
+import threading
+import collections
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from tempfile import NamedTemporaryFile
+from bs4 import BeautifulSoup # For parsing XML and HTML documents
+from pypdf import PdfReader, PdfWriter
+
+import backend.grobidclient as grobidclient
+import backend.metrics as metrics
+import backend.models.tableparser as table
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s: %(message)s',
+    force=True,
+    handlers=[
+        logging.FileHandler("app.log"),  # Log to a file named 'app.log'
+        logging.StreamHandler(sys.stdout)  # Also log to console
+    ]
+)
+
+envdict = grobidclient.get_envdict()
+
+# PDFs with more pages than this are split into chunks of this many pages. 0 turns chunking off.
+#  Can be set with chunk_pages in the .env file.
+CHUNK_PAGES = int(envdict.get("chunk_pages", 0))
+
+# Maximum number of chunks processed at the same time. Can be set with chunk_workers in the .env file.
+CHUNK_WORKERS = int(envdict.get("chunk_workers", 4))
+
+# The xml:ids GROBID numbers per document, which have to be renumbered when the chunks are merged:
+#  figures (fig_0), tables (tab_0), formulas (formula_0), footnotes (foot_0) and references (b0).
+ID_PATTERN = re.compile(r'^(fig_|tab_|formula_|foot_|b)(\d+)$')
+
+# The worker processes which extract the tables of the chunks. Started at the first chunked PDF and kept for the
+#  following ones, see get_table_executor().
+table_executor = None
+table_executor_lock = threading.Lock()
+
+def get_page_count(pdf_bytes):
+    """
+    Gets the number of pages in a PDF.
+
+    Parameters:
+    pdf_bytes (bytes): The content of the PDF file.
+
+    Returns:
+    (int): The number of pages.
+    """
+    return len(PdfReader(io.BytesIO(pdf_bytes)).pages)
+
+def split_pdf(pdf_bytes, chunk_pages):
+    """
+    Splits a PDF into chunks of consecutive pages. The chunks are made one at a time when they are needed, so that
+    only the chunks being processed exist at once, not a copy of the whole PDF.
+
+    Parameters:
+    pdf_bytes (bytes): The content of the PDF file.
+    chunk_pages (int): The number of pages in each chunk. The last chunk may have fewer pages.
+
+    Returns:
+    (generator[dict]): For each chunk, the first and last page (counted from 1) and the content of the chunk as a PDF.
+    """
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    for first_index in range(0, len(reader.pages), chunk_pages):
+        last_index = min(first_index + chunk_pages, len(reader.pages))
+        writer = PdfWriter()
+        for index in range(first_index, last_index):
+            writer.add_page(reader.pages[index])
+        output = io.BytesIO()
+        writer.write(output)
+        yield {"first_page": first_index + 1, "last_page": last_index, "pdf": output.getvalue()}
+
+def extract_chunk_tables(chunk_pdf, first_page, backend, max_margin):
+    """
+    Extracts the tables from a chunk, with page numbers counted from the start of the whole PDF.
+    Runs in a worker process, as the table backends are CPU bound.
+
+    Parameters:
+    chunk_pdf (bytes): The content of the chunk as a PDF.
+    first_page (int): The page number of the first page of the chunk in the whole PDF.
+    backend (str): Name of the table extraction backend in TABLE_BACKENDS.
+    max_margin (int): Maximum margin for capturing text context near the table.
+
+    Returns:
+    (list[dict]): The tables returned by the table backend.
+    """
+    # Save the chunk temporarily, as the backends read the PDF from a path
+    with NamedTemporaryFile(delete=False, suffix=".pdf") as temp_pdf:
+        temp_pdf.write(chunk_pdf)
+        pdf_path = temp_pdf.name
+
+    try:
+        tables = table.TABLE_BACKENDS[backend](pdf_path, max_margin)
+    finally:
+        # Remove the temporary file
+        os.remove(pdf_path)
+
+    for extracted_table in tables:
+        extracted_table["page"] += first_page - 1
+    return tables
+
+def shift_coords(coords, page_offset):
+    """
+    Adds an offset to the page numbers in a GROBID coords attribute, e.g. '1,72.0,80.5,200.1,12.0;2,72.0,...'.
+
+    Parameters:
+    coords (str): The coords attribute.
+    page_offset (int): The number of pages before the chunk.
+
+    Returns:
+    (str): The coords attribute with the page numbers of the whole PDF.
+    """
+    shifted = []
+    for box in coords.split(";"):
+        parts = box.split(",")
+        if parts[0].strip().isdigit():
+            parts[0] = str(int(parts[0]) + page_offset)
+        shifted.append(",".join(parts))
+    return ";".join(shifted)
+
+def renumber_chunk(soup, page_offset, counters):
+    """
+    Makes the page numbers and the xml:ids of a chunk unique in the merged document. The page numbers in the coords
+    and the facsimile are shifted by the number of pages before the chunk, and the numbered xml:ids, and the references
+    to them, continue from where the previous chunks stopped.
+
+    Parameters:
+    soup (BeautifulSoup): The GROBID XML of the chunk. Changed in place.
+    page_offset (int): The number of pages before the chunk.
+    counters (dict): For each xml:id prefix, the first free number. Updated with the numbers used by this chunk.
+
+    Returns:
+    None
+    """
+    mapping = {}
+    used = {}
+    for element in soup.find_all(attrs={"xml:id": True}):
+        match = ID_PATTERN.match(element["xml:id"])
+        if match is None:
+            continue
+        prefix, number = match.group(1), int(match.group(2))
+        new_id = f"{prefix}{counters.get(prefix, 0) + number}"
+        mapping[element["xml:id"]] = new_id
+        element["xml:id"] = new_id
+        used[prefix] = max(used.get(prefix, 0), number + 1)
+
+    for prefix, count in used.items():
+        counters[prefix] = counters.get(prefix, 0) + count
+
+    # References like <ref type="figure" target="#fig_0"> point to the renumbered ids:
+    for element in soup.find_all(attrs={"target": True}):
+        element["target"] = " ".join(
+            "#" + mapping.get(target[1:], target[1:]) if target.startswith("#") else target
+            for target in element["target"].split()
+        )
+
+    if page_offset:
+        for element in soup.find_all(attrs={"coords": True}):
+            element["coords"] = shift_coords(element["coords"], page_offset)
+        for surface in soup.find_all("surface"):
+            if str(surface.get("n", "")).isdigit():
+                surface["n"] = str(int(surface["n"]) + page_offset)
+
+def merge_tei(chunk_results):
+    """
+    Merges the GROBID XML of the chunks into one document. The header comes from the first chunk. The bodies,
+    the back matter, the references and the page sizes of all chunks are joined in page order.
+    GROBID sees the first page of every chunk as a title page, so the abstract it finds in the header of a later
+    chunk is moved into the body, in order not to lose that text.
+
+    Parameters:
+    chunk_results (list[tuple]): For each chunk in page order, a tuple (xml, first_page).
+
+    Returns:
+    (str): The merged GROBID XML.
+    """
+    counters = {}
+    soups = []
+    for xml, first_page in chunk_results:
+        soup = BeautifulSoup(xml, "xml")
+        renumber_chunk(soup, first_page - 1, counters)
+        soups.append(soup)
+
+    merged = soups[0]
+    text = merged.find("text")
+    body = merged.find("body")
+    back = merged.find("back")
+    list_bibl = back.find("listBibl") if back is not None else None
+    facsimile = merged.find("facsimile")
+
+    for soup in soups[1:]:
+        # The body of the chunk, after the text GROBID put in the abstract of its header:
+        chunk_body = soup.find("body")
+        chunk_abstract = soup.find("abstract")
+        if body is None and text is not None:
+            body = merged.new_tag("body")
+            text.insert(0, body)
+        if body is not None:
+            for part in (chunk_abstract, chunk_body):
+                if part is not None:
+                    for child in list(part.children):
+                        body.append(child.extract())
+
+        # The references of the chunk are added to the list of references, and the rest of its back matter after it:
+        chunk_back = soup.find("back")
+        if chunk_back is not None:
+            chunk_list_bibl = chunk_back.find("listBibl")
+            if chunk_list_bibl is not None and list_bibl is not None:
+                for bibl in list(chunk_list_bibl.find_all("biblStruct", recursive=False)):
+                    list_bibl.append(bibl.extract())
+                # Remove the now empty <div type="references">
+                (chunk_list_bibl.find_parent("div") or chunk_list_bibl).extract()
+            if back is None and text is not None:
+                back = merged.new_tag("back")
+                text.append(back)
+                list_bibl = None
+            if back is not None:
+                for child in list(chunk_back.children):
+                    back.append(child.extract())
+                if list_bibl is None:
+                    list_bibl = back.find("listBibl")
+
+        # The page sizes of the chunk:
+        chunk_facsimile = soup.find("facsimile")
+        if chunk_facsimile is not None and facsimile is not None:
+            for surface in list(chunk_facsimile.find_all("surface", recursive=False)):
+                facsimile.append(surface.extract())
+
+    return str(merged)
+
+def get_table_executor():
+    """
+    Gets the pool of worker processes which extract the tables of the chunks, and starts it the first time.
+    The processes are spawned rather than forked, as the API forking itself while its GROBID health checks,
+    model worker threads and torch thread pools are running could leave locks held in the children.
+
+    Parameters:
+    None
+
+    Returns:
+    (ProcessPoolExecutor): The pool, with one process per chunk worker, up to the number of cores.
+    """
+    global table_executor
+    with table_executor_lock:
+        if table_executor is None:
+            processes = max(1, min(CHUNK_WORKERS, os.cpu_count() or 1))
+            table_executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"))
+            logging.info(f"[chunking.py] Started {processes} worker processes for the table parser.")
+        return table_executor
+
+def reset_table_executor(broken):
+    """
+    Drops a pool of worker processes which broke (e.g. a process was killed), so that the next chunked PDF starts a new one.
+
+    Parameters:
+    broken (ProcessPoolExecutor): The pool which broke.
+
+    Returns:
+    None
+    """
+    global table_executor
+    with table_executor_lock:
+        if table_executor is broken:
+            table_executor = None
+    broken.shutdown(wait=False)
+
+def process_pdf_in_chunks(pdf_bytes, chunk_pages=None, workers=CHUNK_WORKERS, use_grobid_cache=True, grobid_profile=None, table_backend=table.DEFAULT_TABLE_BACKEND, max_margin=50):
+    """
+    Runs GROBID and the table parser on a large PDF in chunks of pages. The chunks are sent to GROBID at the same
+    time, balanced between the GROBID servers by the GROBID client, and the tables of the chunks are extracted in
+    parallel worker processes, which are kept for the following PDFs. No chunk is bigger than chunk_pages, so long PDFs don't hit the GROBID timeout,
+    and the merged result is the same kind of XML as for an unsplit PDF: renumbered xml:ids, page numbers of the whole
+    PDF and the pdfplumber tables spliced in.
+
+    Parameters:
+    pdf_bytes (bytes): The content of the PDF file.
+    chunk_pages (int): The number of pages in each chunk. Defaults to CHUNK_PAGES, or 50 if chunking is turned off.
+    workers (int): Maximum number of chunks processed at the same time.
+    use_grobid_cache (bool): Set to False to always call GROBID, even if the response for a chunk is cached.
+    grobid_profile (str): The GROBID processing profile, e.g. 'fast' or 'full'.
+    table_backend (str): Name of the table extraction backend in TABLE_BACKENDS.
+    max_margin (int): Maximum margin for capturing text context near the table.
+
+    Returns:
+    (str): The merged GROBID XML with the tables from the table parser.
+
+    Raises:
+    requests.exceptions.RequestException: If GROBID could not process one of the chunks.
+    """
+    start = time.perf_counter()
+    chunk_pages = chunk_pages or CHUNK_PAGES or 50
+    workers = max(1, workers)
+    executor = get_table_executor()
+
+    # GROBID requests wait on the network, so threads are enough. The table backends need a CPU each, and run in the
+    #  long-lived worker processes. At most 'workers' chunks are in progress at once, and the next chunk is only
+    #  made when one of them is done, so the memory stays bounded however long the PDF is.
+    chunk_results = []
+    tables = []
+    in_progress = collections.deque()
+
+    def finish_oldest():
+        chunk, grobid_future, table_future = in_progress.popleft()
+        chunk_results.append((grobid_future.result(), chunk["first_page"]))
+        logging.info(f"[chunking.py] GROBID processed pages {chunk['first_page']}-{chunk['last_page']}.")
+        try:
+            tables.extend(table_future.result())
+        except BrokenProcessPool:
+            reset_table_executor(executor)
+            raise
+        except Exception as e:
+            logging.error(f"[chunking.py] An error occurred while extracting tables from pages {chunk['first_page']}-{chunk['last_page']}: {e}", exc_info=True)
+
+    with ThreadPoolExecutor(max_workers=workers) as grobid_executor:
+        try:
+            for chunk in split_pdf(pdf_bytes, chunk_pages):
+                if len(in_progress) >= workers:
+                    finish_oldest()
+                grobid_future = grobid_executor.submit(grobidclient.process_fulltext_document, chunk["pdf"], use_cache=use_grobid_cache, profile=grobid_profile)
+                table_future = executor.submit(extract_chunk_tables, chunk["pdf"], chunk["first_page"], table_backend, max_margin)
+                # Only the page numbers are kept, the futures hold the content of the chunk until it is processed
+                in_progress.append(({"first_page": chunk["first_page"], "last_page": chunk["last_page"]}, grobid_future, table_future))
+            while in_progress:
+                finish_oldest()
+        finally:
+            # If a chunk failed, the chunks still waiting are not needed
+            for chunk, grobid_future, table_future in in_progress:
+                grobid_future.cancel()
+                table_future.cancel()
+
+    merged_xml = merge_tei(chunk_results)
+    final_xml, removed_tables = table.splice_tables_into_grobid_xml(merged_xml, table.tables_to_xml(tables))
+
+    metrics.increment("chunked_documents")
+    metrics.observe("chunked_grobid_and_tables", time.perf_counter() - start)
+    logging.info(f"[chunking.py] Processed {len(chunk_results)} chunks with {workers} workers in {time.perf_counter() - start:.1f} seconds. Found {len(tables)} tables.")
+    return final_xml
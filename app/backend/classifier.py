@@ -3,13 +3,14 @@ import requests
 import io
 import re
 import os
-import streamlit as st
 import logging
 import sys
 import logging
 from bs4 import BeautifulSoup # For parsing XML and HTML documents
 from PIL import Image, ImageDraw
-from pdf2image import convert_from_path, convert_from_bytes # Module which turns each page of a PDF into an image.
+import backend.cropfilter as cropfilter # Skips blank, tiny and degenerate crops before they are sent to a model.
+import backend.captionrules as captionrules # Classifies figures with obvious captions without the figure classifier.
+from pdf2image import convert_from_path, convert_from_bytes, pdfinfo_from_bytes # Module which turns each page of a PDF into an image.
 from pdf2image.exceptions import ( # Built-in exception handlers. 
     PDFInfoNotInstalledError,
     PDFPageCountError,
@@ -52,8 +53,8 @@ def get_envdict():
     for env in envlist:
         if (env == ""):
             continue
-        # Map correct value to key:
-        envdict[env.split("=")[0]] = env.split("=")[1]
+        # Map correct value to key. Only the first '=' separates them, as values like 'sumen=adaptive,unichart=beam' contain '=' too:
+        envdict[env.split("=", 1)[0]] = env.split("=", 1)[1]
     return envdict
 
 try:
@@ -73,7 +74,39 @@ except Exception as e:
     logging.error(f"[classifier.py] An error occurred while setting the port and URL for api: {e}", exc_info=True)
 
 
-def open_XML(xml_file, pdf_file, frontend):
+class PageImages:
+    """
+    The pages of a PDF as images, indexed like the list returned by convert_from_bytes(). The pages are converted
+    a block at a time when they are first used, and only the current block is kept, so that a PDF with hundreds of
+    pages never has an image of every page in memory at once. Figures and formulas are processed in page order,
+    so each block is normally converted only once for the figures and once for the formulas.
+    """
+
+    def __init__(self, pdf_bytes, block_pages):
+        self.pdf_bytes = pdf_bytes
+        self.block_pages = block_pages
+        self.page_count = pdfinfo_from_bytes(pdf_bytes)["Pages"]
+        self.first_index = 0
+        self.block = []
+
+    def __len__(self):
+        return self.page_count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.page_count
+        if not 0 <= index < self.page_count:
+            raise IndexError("page index out of range")
+
+        if not self.first_index <= index < self.first_index + len(self.block):
+            self.first_index = index - index % self.block_pages
+            last_page = min(self.first_index + self.block_pages, self.page_count)
+            self.block = [] # Free the previous block before converting the next one
+            self.block = convert_from_bytes(self.pdf_bytes, first_page=self.first_index + 1, last_page=last_page)
+            logging.info(f"[classifier.py] Converted pages {self.first_index + 1}-{last_page} of the PDF file to images.")
+        return self.block[index - self.first_index]
+
+def open_XML(xml_file, pdf_file, frontend, page_block=None):
     """
     Opens the XML file and converts it to a python dict, and extracts all formulas and figures. Also turns each page of the PDF into an image.
 
@@ -81,6 +114,7 @@ def open_XML(xml_file, pdf_file, frontend):
     xml_file: The XML file as stringio object.
     pdf_file: The PDF file as bytes object.
     frontend (bool): Tag stating if frontend is used or not. 
+    page_block (int): If set, the pages are converted to images this many pages at a time when they are needed, instead of all at once. Used for very large PDFs.
 
     Returns:
     images: The pages as images from the PDF file.
@@ -95,6 +129,7 @@ def open_XML(xml_file, pdf_file, frontend):
         global Bs_data
         
         if (frontend):
+            import streamlit as st # Only imported with the frontend, as importing streamlit is slow
             pdf_file = pdf_file.getvalue()
             st.session_state.Bs_data = BeautifulSoup(xml_file, "xml") # Store XML string data in session state variable which the frontend can access later.
             Bs_data = st.session_state.Bs_data 
@@ -114,8 +149,12 @@ def open_XML(xml_file, pdf_file, frontend):
 
     # Converting the pages in the PDF file to images.
     try:
-        images = convert_from_bytes(pdf_file)
-        logging.info(f"[classifier.py] Converted the pages in the PDF file to images. Found {len(images)} pages/images.")
+        if page_block:
+            images = PageImages(pdf_file, page_block)
+            logging.info(f"[classifier.py] The pages in the PDF file will be converted to images {page_block} pages at a time. Found {len(images)} pages.")
+        else:
+            images = convert_from_bytes(pdf_file)
+            logging.info(f"[classifier.py] Converted the pages in the PDF file to images. Found {len(images)} pages/images.")
     except Exception as e:
         images = []
         logging.error(f"[classifier.py] An error occurred while converting the pages in the PDF file to images: {e}", exc_info=True)
@@ -141,6 +180,7 @@ def add_to_XML(type, name, new_content, frontend):
     try:
         # Find parent tag:
         if (frontend): # Search in session state variable.
+            import streamlit as st # Only imported with the frontend, as importing streamlit is slow
             parent_tag = st.session_state.Bs_data.find(type, {"xml:id": name})
         
         else: # Search in global variable.
@@ -192,6 +232,11 @@ def add_to_XML(type, name, new_content, frontend):
                         text_without_tag = [] # Make sure it doesnt try to replace the newly inserted tag with another later.
                         break
             new_tag.string = new_content["NL"] # Set content of new tag to be the value of object key.        
+            # Record how the natural language was generated, so that a short caption can be told apart from a detailed description:
+            if ("nl_mode" in new_content):
+                new_tag["mode"] = str(new_content["nl_mode"])
+            if ("nl_max_tokens" in new_content):
+                new_tag["max_tokens"] = str(new_content["nl_max_tokens"])
             logging.info(f"[classifier.py] Successfully added new llmgenerated content to parent_tag.")
     except Exception as e:
         logging.error(f"[classifier.py] An error occurred while trying to add new llmgenerated content to parent_tag: {e}", exc_info=True)
@@ -227,6 +272,7 @@ def get_XML(frontend):
    """
    logging.info("[classifier.py] Starting function get_XML()")
    if (frontend):
+      import streamlit as st # Only imported with the frontend, as importing streamlit is slow
       return st.session_state.Bs_data
    
    else:
@@ -252,7 +298,7 @@ def save_XML(path_to_XML):
     except Exception as e:
         logging.error(f"[classifier.py] An error occurred while trying to save XML file: {e}", exc_info=True)
 
-def classify(XML_type, image, element_nr, pagenr, regex, pdf_element_nr, frontend, prompt_context=""):
+def classify(XML_type, image, element_nr, pagenr, regex, pdf_element_nr, frontend, prompt_context="", caption_class=None):
     """
     Classifies a given element as either a formula, chart, figure or other. Based on what the element is classified as 
     it gets redirected to the correct API endpoint for processing. When it gets a response it calls on add_to_XML() to 
@@ -268,6 +314,7 @@ def classify(XML_type, image, element_nr, pagenr, regex, pdf_element_nr, fronten
     pdf_element_nr: the correct number for the figure, as it is in the PDF. Might not exist because GROBID finds un-numbered figures/formulas sometimes.
     frontend (bool): Tag stating if frontend is used or not. 
     prompt_context: A string with the figure description. Can be used to give context to the prompt for the VLM.
+    caption_class: The class of the figure if it was found from its caption (see captionrules.py). Then the figure classifier is not called.
 
     Returns:
     None
@@ -324,9 +371,10 @@ def classify(XML_type, image, element_nr, pagenr, regex, pdf_element_nr, fronten
             except Exception as e:
                 logging.error(f"[classifier.py] An error occurred while trying create a bytes object of image of element: {e}", exc_info=True)
           
-            # Send image of formula to API endpoint where it should be processed by a formula parser:
+            # Send image of formula to API endpoint where it should be processed by a formula parser.
+            #  The raw text from GROBID is sent along, so that the API can predict how long the LaTeX will be:
             try:
-                API_response = requests.post(api_url+"parse_formula", files={'image': img_byte_arr})
+                API_response = requests.post(api_url+"parse_formula", files={'image': img_byte_arr, 'text': regex})
                 
                 # Check that the response is positive:
                 if (API_response.status_code != 200):
@@ -351,32 +399,38 @@ def classify(XML_type, image, element_nr, pagenr, regex, pdf_element_nr, fronten
 
     # Classifying figures:
     else:
-        # Send to classifier model first:
-        logging.info(f"[classifier.py] Classifies figure nr:{element_nr}.")
+        if (caption_class is not None):
+            # The caption already tells what the figure is, so the figure classifier is skipped:
+            logging.info(f"[classifier.py] Figure nr:{element_nr} was classified from its caption: {caption_class}.")
+            figure_class = caption_class
 
-        # Create a bytes object of the image of the element:
-        try:
-            img_byte_arr = io.BytesIO()
-            image.save(img_byte_arr, format='PNG')
-            img_byte_arr = img_byte_arr.getvalue()
-            logging.info(f"[classifier.py] Successfully converted image of element to bytes object.")
-        except Exception as e:
-            logging.error(f"[classifier.py] An error occurred while trying create a bytes object of image of element: {e}", exc_info=True)
+        else:
+            # Send to classifier model first:
+            logging.info(f"[classifier.py] Classifies figure nr:{element_nr}.")
 
-        # Sending image of element to API endpoint for classification:
-        try:
-            files = {"image": ("image1.png", img_byte_arr)}
-            response = requests.post(api_url+"call_classifier", files=files)
+            # Create a bytes object of the image of the element:
+            try:
+                img_byte_arr = io.BytesIO()
+                image.save(img_byte_arr, format='PNG')
+                img_byte_arr = img_byte_arr.getvalue()
+                logging.info(f"[classifier.py] Successfully converted image of element to bytes object.")
+            except Exception as e:
+                logging.error(f"[classifier.py] An error occurred while trying create a bytes object of image of element: {e}", exc_info=True)
+
+            # Sending image of element to API endpoint for classification:
+            try:
+                files = {"image": ("image1.png", img_byte_arr)}
+                response = requests.post(api_url+"call_classifier", files=files)
             
-            # Check that the response is positive:
-            if (response.status_code != 200):
-                logging.error(f"[classifier.py] Something went wrong in the API: {response.content}")
-                return # Error in API, a proper response is not received.
-            response = response.json()
-            figure_class = response["classifier_response"]
-            logging.info(f"[classifier.py] Received response from API classifier: {figure_class}. Sending it over to the correct API endpoint.")
-        except Exception as e:
-            logging.error(f"[classifier.py] An error occurred while calling API endpoint for classification: {e}", exc_info=True)
+                # Check that the response is positive:
+                if (response.status_code != 200):
+                    logging.error(f"[classifier.py] Something went wrong in the API: {response.content}")
+                    return # Error in API, a proper response is not received.
+                response = response.json()
+                figure_class = response["classifier_response"]
+                logging.info(f"[classifier.py] Received response from API classifier: {figure_class}. Sending it over to the correct API endpoint.")
+            except Exception as e:
+                logging.error(f"[classifier.py] An error occurred while calling API endpoint for classification: {e}", exc_info=True)
 
         # After classification the element is sent to the correct endpoint for further processing.
     
@@ -537,6 +591,10 @@ def process_figures(figures, images, frontend):
     """
     logging.info("[classifier.py] Starting function process_figures()")
 
+    crop_filter = get_envdict().get("crop_filter", "True") == "True" # Turn off with crop_filter=False in the .env file.
+    # The caption rules are off until their agreement with the figure classifier has been measured, see
+    #  evaluation/classifier/Code/captionAgreementReport.py. Turn on with caption_rules=True in the .env file.
+    caption_rules = get_envdict().get("caption_rules", "False") == "True"
     figure_nr = 0 # The number which GROBID gave this figure. Will be used when putting processed content back into the figure tag.
     # Iterate through all figures:
     for figure in figures:
@@ -623,10 +681,22 @@ def process_figures(figures, images, frontend):
         # Use the coords to crop image.
         img_figure = imgside.crop((x*const,y*const,(x+x2)*const,(y+y2)*const))
 
+        # Skip crops which are empty, too small, too thin or without any content, before any model sees them.
+        if crop_filter and cropfilter.should_skip(img_figure, "figure", figure_nr):
+            figure_nr+=1
+            continue
+
+        # Classifying the figure from its caption and head, if they make it obvious (e.g. 'Bar chart of...' or 'Table 3').
+        #  Only for crops which passed the crop filter, so that the counters of the caption rules cover the classified figures:
+        caption_class = None
+        if caption_rules:
+            head = figure.find("head")
+            caption_class = captionrules.caption_class(prompt_context, head.text if head is not None else "", figure.get("type", ""), figure_nr)
+
         logging.info(f"[classifier.py] Cropped element : {figure_nr}. Sending it to classifier...")
 
         # Sending to classification:
-        classify("figure", img_figure, figure_nr, int(coords.split(",")[0]), None, correct_figure_nr, frontend, prompt_context)
+        classify("figure", img_figure, figure_nr, int(coords.split(",")[0]), None, correct_figure_nr, frontend, prompt_context, caption_class)
 
         figure_nr+=1
 
@@ -645,6 +715,7 @@ def process_formulas(formulas, images, mode, frontend):
     """
     logging.info("[classifier.py] Starting function process_formulas()")
 
+    crop_filter = get_envdict().get("crop_filter", "True") == "True" # Turn off with crop_filter=False in the .env file.
     formula_nr = 0 # The number which GROBID gave this formula. Will be used when putting processed content back into the formula tag.
     for formula in formulas:
 
@@ -716,6 +787,11 @@ def process_formulas(formulas, images, mode, frontend):
         # Use the coords to crop image.
         img_formula = imgside.crop((x*const,y*const,(x+x2)*const,(y+y2)*const))
 
+        # Skip crops which are empty, too small, too thin or without any content, before any model sees them.
+        if crop_filter and cropfilter.should_skip(img_formula, "formula", formula_nr):
+            formula_nr+=1
+            continue
+
         logging.info(f"[classifier.py] Cropped element : {formula_nr}. Sending it to classifier...")
 
         ## Sending to classification:
@@ -0,0 +1,92 @@
+import sys
+import logging
+import numpy as np
+
+import backend.metrics as metrics
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s: %(message)s',
+    force=True,
+    handlers=[
+        logging.FileHandler("app.log"),  # Log to a file named 'app.log'
+        logging.StreamHandler(sys.stdout)  # Also log to console
+    ]
+)
+
+# The limits for the crops of each kind of element, in pixels of the page images (PDF coordinates scaled by 2.775).
+#  Formulas can be a single small variable or a long line, figures are larger and never that thin.
+THRESHOLDS = {
+    "formula": {
+        "min_side": 6,  # The smallest width or height
+        "min_area": 150,  # The smallest width times height
+        "max_aspect": 100,  # The largest ratio between the longer and the shorter side
+        "min_std": 2.0,  # The smallest standard deviation of the gray levels, below it the crop is a flat color
+        "min_ink": 0.002,  # The smallest share of pixels which differ from the background
+    },
+    "figure": {
+        "min_side": 16,
+        "min_area": 2500,
+        "max_aspect": 20,
+        "min_std": 2.0,
+        "min_ink": 0.001,
+    },
+}
+
+# A pixel is ink if its gray level differs this much from the background, the median gray level of the crop.
+INK_CONTRAST = 40
+
+def skip_reason(image, element_type):
+    """
+    Checks if a crop is degenerate, so that it can be skipped before it is encoded and sent to a model. Crops from bad
+    GROBID coordinates are often empty, a few pixels high, or only background. All checks are vectorized over the pixels.
+
+    Parameters:
+    image (PIL.Image): The crop of the element.
+    element_type (str): 'formula' or 'figure'.
+
+    Returns:
+    (str): The reason to skip the crop: 'empty', 'tiny', 'sliver', 'blank' or 'no_ink'. None if the crop should be processed.
+    """
+    limits = THRESHOLDS[element_type]
+    width, height = image.size
+    if width < 1 or height < 1:
+        return "empty"
+    if min(width, height) < limits["min_side"] or width * height < limits["min_area"]:
+        return "tiny"
+    if max(width, height) / min(width, height) > limits["max_aspect"]:
+        return "sliver"
+
+    gray = np.asarray(image.convert("L"), dtype=np.int16)
+    if gray.std() < limits["min_std"]:
+        return "blank"
+    ink = np.mean(np.abs(gray - np.median(gray)) > INK_CONTRAST)
+    if ink < limits["min_ink"]:
+        return "no_ink"
+    return None
+
+def should_skip(image, element_type, element_nr):
+    """
+    Checks a crop with skip_reason(), and counts and logs the skipped crops. The counters are 'crops_skipped' and
+    'crops_skipped_<element type>_<reason>'.
+
+    Parameters:
+    image (PIL.Image): The crop of the element.
+    element_type (str): 'formula' or 'figure'.
+    element_nr (int): The number of the element, for the log.
+
+    Returns:
+    (bool): True if the crop should be skipped.
+    """
+    try:
+        reason = skip_reason(image, element_type)
+    except Exception as e:
+        logging.error(f"[cropfilter.py] An error occurred while checking the crop of {element_type} {element_nr}: {e}", exc_info=True)
+        return False
+
+    if reason is None:
+        return False
+    metrics.increment("crops_skipped")
+    metrics.increment(f"crops_skipped_{element_type}_{reason}")
+    logging.info(f"[cropfilter.py] Skipping {element_type} {element_nr}, the crop is {reason} ({image.size[0]}x{image.size[1]} pixels).")
+    return True
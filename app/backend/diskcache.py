@@ -0,0 +1,162 @@
+import os
+import json
+import hashlib
+import threading
+import logging
+import sys
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s: %(message)s',
+    force=True,
+    handlers=[
+        logging.FileHandler("app.log"),  # Log to a file named 'app.log'
+        logging.StreamHandler(sys.stdout)  # Also log to console
+    ]
+)
+
+def hash_bytes(data):
+    """
+    Creates the SHA-256 hash of a bytes object, e.g. the content of a PDF file.
+
+    Parameters:
+    data (bytes): The data to be hashed.
+
+    Returns:
+    (str): The hexadecimal SHA-256 hash.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+class DiskCache:
+    """
+    A simple cache which stores JSON values as files in a folder, so that the cached results survive restarts.
+    When the total size of the folder grows above the size limit, the least recently used entries are removed.
+    """
+
+    def __init__(self, directory, max_mb=256):
+        """
+        Creates the cache folder if it doesn't exist.
+
+        Parameters:
+        directory (str): The folder where the cache entries are stored.
+        max_mb (int): The maximum total size of the cache in megabytes.
+        """
+        self.directory = directory
+        self.max_bytes = max_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(*parts):
+        """
+        Creates a cache key from the given parts, e.g. the hash of a PDF file and the parameters used to process it.
+
+        Parameters:
+        *parts: JSON serializable values which together identify a cache entry.
+
+        Returns:
+        (str): The cache key.
+        """
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        """
+        Gets a value from the cache.
+
+        Parameters:
+        key (str): The cache key.
+
+        Returns:
+        The cached value, or None if the key is not in the cache.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+            # File is automatically closed after exiting the 'with' block
+
+            # Update the modification time, which is used to find the least recently used entries:
+            os.utime(path)
+            self.hits += 1
+            logging.info(f"[diskcache.py] Cache hit in {self.directory}.")
+            return value
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as e:
+            self.misses += 1
+            logging.error(f"[diskcache.py] An error occurred while reading cache entry {path}: {e}", exc_info=True)
+            return None
+
+    def set(self, key, value):
+        """
+        Stores a value in the cache, and removes the least recently used entries if the cache is too big.
+
+        Parameters:
+        key (str): The cache key.
+        value: A JSON serializable value.
+
+        Returns:
+        None
+        """
+        path = self._path(key)
+        try:
+            # Write to a temporary file first, so that other processes never read a half written entry:
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(value, f)
+            # File is automatically closed after exiting the 'with' block
+            os.replace(temp_path, path)
+        except Exception as e:
+            logging.error(f"[diskcache.py] An error occurred while writing cache entry {path}: {e}", exc_info=True)
+            return
+
+        with self.lock:
+            self._evict()
+
+    def _evict(self):
+        """
+        Removes the least recently used entries until the total size of the cache is below the size limit.
+        """
+        entries = []
+        total_size = 0
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(".json"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+
+        if total_size <= self.max_bytes:
+            return
+
+        # Oldest entries first:
+        entries.sort()
+        removed = 0
+        for mtime, size, path in entries:
+            if total_size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total_size -= size
+                removed += 1
+            except FileNotFoundError:
+                # Already removed by another process
+                total_size -= size
+        logging.info(f"[diskcache.py] Removed {removed} least recently used entries from {self.directory}.")
+
+    def clear(self):
+        """
+        Removes all entries from the cache.
+
+        Returns:
+        None
+        """
+        with self.lock:
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and entry.name.endswith(".json"):
+                    os.remove(entry.path)
@@ -0,0 +1,447 @@
+import requests
+from requests.adapters import HTTPAdapter
+import threading
+import random
+import time
+import logging
+import sys
+
+import backend.diskcache as diskcache
+import backend.metrics as metrics
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s: %(message)s',
+    force=True,
+    handlers=[
+        logging.FileHandler("app.log"),  # Log to a file named 'app.log'
+        logging.StreamHandler(sys.stdout)  # Also log to console
+    ]
+)
+
+# The URL of the local GROBID server. More servers can be added with grobid_urls in the .env file.
+GROBID_URL = "http://172.28.0.12:8070"
+
+# Named sets of parameters sent to GROBID when processing the full text of a PDF.
+#  full: Consolidates the header, citations and funders against external services and adds coordinates to all elements.
+#  fast: No consolidation, which removes the calls to external services, and only the coordinates the classifier
+#        needs (figures and formulas).
+GROBID_PROFILES = {
+    "full": {
+        "consolidateHeader": 1,
+        "consolidateCitations": 1,
+        "consolidateFunders": 1,
+        "includeRawAffiliations": 1,
+        "includeRawCitations": 1,
+        "segmentSentences": 1,
+        "teiCoordinates": ["ref", "s", "biblStruct", "persName", "figure", "formula", "head", "note", "title", "affiliation"]
+    },
+    "fast": {
+        "consolidateHeader": 0,
+        "consolidateCitations": 0,
+        "consolidateFunders": 0,
+        "teiCoordinates": ["figure", "formula"]
+    }
+}
+
+def get_envdict():
+    """
+    Gets the content of the .env file and creates a dictionary of its elements.
+
+    Parameters:
+    None
+
+    Returns:
+    envdict (dict): A dictionary with the contents of the .env file. Empty if the file doesn't exist.
+    """
+    # Open and read .env file:
+    try:
+        with open("/content/.env", "r") as f:
+            env = f.read()
+        # File is automatically closed after exiting the 'with' block
+    except Exception as e:
+        logging.error(f"[grobidclient.py] An error occurred while opening .env file: {e}", exc_info=True)
+        return {}
+
+    # Add each entry of file to dictionary:
+    envdict = {}
+    for line in env.split("\n"):
+        if (line == ""):
+            continue
+        # Map correct value to key. Only the first '=' separates them, as values like 'sumen=adaptive,unichart=beam' contain '=' too:
+        envdict[line.split("=", 1)[0]] = line.split("=", 1)[1]
+
+    return envdict
+
+envdict = get_envdict()
+
+# Cache for the GROBID responses. Its size can be set with grobid_cache_mb in the .env file,
+#  and it can be turned off with grobid_cache=False.
+try:
+    grobid_cache = diskcache.DiskCache("/content/cache/grobid", max_mb=int(envdict.get("grobid_cache_mb", 1024)))
+except Exception as e:
+    grobid_cache = diskcache.DiskCache("/content/cache/grobid")
+    logging.error(f"[grobidclient.py] An error occurred while setting the size of the GROBID cache: {e}", exc_info=True)
+
+# The profile used when none is given. Can be set with grobid_profile in the .env file.
+DEFAULT_GROBID_PROFILE = envdict.get("grobid_profile", "full")
+if DEFAULT_GROBID_PROFILE not in GROBID_PROFILES:
+    logging.warning(f"[grobidclient.py] Unknown GROBID profile '{DEFAULT_GROBID_PROFILE}' in .env file, using 'full' instead.")
+    DEFAULT_GROBID_PROFILE = "full"
+
+# The GROBID servers requests are balanced between, as a comma separated list in the .env file, e.g.
+#  grobid_urls=http://172.28.0.12:8070,http://172.28.0.12:8072
+GROBID_URLS = [url.strip().rstrip("/") for url in envdict.get("grobid_urls", GROBID_URL).split(",") if url.strip()]
+
+# Maximum number of requests sent to each GROBID server at the same time. This should match the concurrency set in the
+#  grobid.yaml of the server (10 by default), as GROBID answers with 503 when all of its threads are busy.
+GROBID_CONCURRENCY = int(envdict.get("grobid_concurrency", 10))
+
+# How often, in seconds, the servers are checked with /api/isalive, so that failing servers are ejected and
+#  recovered servers are put back.
+GROBID_HEALTH_INTERVAL = float(envdict.get("grobid_health_interval", 10))
+
+# Timeouts in seconds: (connect, read). Processing a long PDF can take a few minutes, so the read timeout is generous.
+GROBID_TIMEOUT = (float(envdict.get("grobid_connect_timeout", 10)), float(envdict.get("grobid_read_timeout", 300)))
+
+# Retries when GROBID is saturated (503) or the connection fails, with jittered exponential backoff in seconds.
+GROBID_MAX_RETRIES = int(envdict.get("grobid_max_retries", 5))
+GROBID_BACKOFF_BASE = 1.0
+GROBID_BACKOFF_MAX = 30.0
+
+# One session is shared by all threads, so that connections to GROBID are reused instead of opened for every request.
+session = requests.Session()
+adapter = HTTPAdapter(pool_connections=len(GROBID_URLS), pool_maxsize=GROBID_CONCURRENCY)
+session.mount("http://", adapter)
+session.mount("https://", adapter)
+
+class GrobidPool:
+    """
+    Balances requests between one or more GROBID servers. Each request goes to the healthy server with the fewest
+    requests in flight (round-robin between servers with the same number), and no server gets more than `concurrency`
+    requests at the same time, so that a batch doesn't flood GROBID with more requests than it can handle.
+    Servers which refuse connections or fail /api/isalive are ejected, and put back once /api/isalive answers again.
+    """
+
+    def __init__(self, urls, concurrency=GROBID_CONCURRENCY, health_interval=GROBID_HEALTH_INTERVAL):
+        """
+        Parameters:
+        urls (list[str]): The URLs of the GROBID servers.
+        concurrency (int): The maximum number of requests in flight for each server.
+        health_interval (float): Seconds between the health checks.
+        """
+        self.urls = list(urls)
+        self.concurrency = concurrency
+        self.health_interval = health_interval
+        self.in_flight = {url: 0 for url in self.urls}
+        self.healthy = {url: True for url in self.urls}
+        self.next_index = 0
+        self.condition = threading.Condition()
+        self.health_thread = None
+
+    def acquire(self):
+        """
+        Picks a server for a request, waiting until one of them has a free slot.
+        Every call must be followed by a call to release() with the returned URL.
+
+        Returns:
+        (str): The URL of the server.
+        """
+        self.start_health_checks()
+        with self.condition:
+            while True:
+                # If every server has been ejected, try them anyway rather than failing without sending a request
+                anyone_healthy = any(self.healthy.values())
+                candidates = [url for url in self.urls if (self.healthy[url] or not anyone_healthy) and self.in_flight[url] < self.concurrency]
+                if candidates:
+                    break
+                self.condition.wait()
+
+            # Fewest requests in flight first, and round-robin between servers with the same number:
+            start = self.next_index
+            self.next_index = (self.next_index + 1) % len(self.urls)
+            url = min(candidates, key=lambda candidate: (self.in_flight[candidate], (self.urls.index(candidate) - start) % len(self.urls)))
+            self.in_flight[url] += 1
+            return url
+
+    def release(self, url):
+        """
+        Frees the slot taken by acquire().
+
+        Parameters:
+        url (str): The URL returned by acquire().
+        """
+        with self.condition:
+            self.in_flight[url] -= 1
+            self.condition.notify_all()
+
+    def eject(self, url, reason):
+        """
+        Stops sending requests to a server until it passes a health check.
+
+        Parameters:
+        url (str): The URL of the server.
+        reason (str): Why the server is ejected, for the log.
+        """
+        with self.condition:
+            if self.healthy[url]:
+                self.healthy[url] = False
+                metrics.increment("grobid_ejections")
+                logging.warning(f"[grobidclient.py] Ejected GROBID server {url}: {reason}")
+            self.condition.notify_all()
+
+    def admit(self, url):
+        """
+        Starts sending requests to a server again after it has recovered.
+
+        Parameters:
+        url (str): The URL of the server.
+        """
+        with self.condition:
+            if not self.healthy[url]:
+                self.healthy[url] = True
+                metrics.increment("grobid_readmissions")
+                logging.info(f"[grobidclient.py] GROBID server {url} is alive again, putting it back in the pool.")
+            self.condition.notify_all()
+
+    def check_health(self):
+        """
+        Calls /api/isalive on every server, and ejects or puts back each server based on the answer.
+        """
+        for url in self.urls:
+            try:
+                response = session.get(f"{url}/api/isalive", timeout=GROBID_TIMEOUT[0])
+                alive = response.status_code == 200 and response.text.strip() == "true"
+            except requests.exceptions.RequestException:
+                alive = False
+
+            if alive:
+                self.admit(url)
+            else:
+                self.eject(url, "did not answer /api/isalive")
+
+    def start_health_checks(self):
+        """
+        Starts the background thread which checks the health of the servers. Not needed for a single server,
+        as it is used even if it has been ejected.
+        """
+        if len(self.urls) < 2:
+            return
+        with self.condition:
+            if self.health_thread is None:
+                self.health_thread = threading.Thread(target=self.health_loop, daemon=True)
+                self.health_thread.start()
+
+    def health_loop(self):
+        """
+        Checks the health of the servers every health_interval seconds. Runs in the background thread.
+        """
+        while True:
+            time.sleep(self.health_interval)
+            try:
+                self.check_health()
+            except Exception as e:
+                logging.error(f"[grobidclient.py] An error occurred while checking the health of the GROBID servers: {e}", exc_info=True)
+
+    def version_url(self):
+        """
+        Returns:
+        (str): The URL of a healthy server, used to get the GROBID version.
+        """
+        with self.condition:
+            return next((url for url in self.urls if self.healthy[url]), self.urls[0])
+
+    def status(self):
+        """
+        Returns:
+        (dict): For each server, whether it is healthy and the number of requests in flight.
+        """
+        with self.condition:
+            return {url: {"healthy": self.healthy[url], "in_flight": self.in_flight[url]} for url in self.urls}
+
+# The pool of the servers in GROBID_URLS, and pools for single servers which are asked for by URL.
+grobid_pool = GrobidPool(GROBID_URLS)
+grobid_pools = {}
+grobid_pools_lock = threading.Lock()
+
+def get_pool(grobid_url=None):
+    """
+    Gets the pool requests are sent through.
+
+    Paramaters:
+    grobid_url (str): The URL of a specific GROBID server, or None for the pool of all servers in GROBID_URLS.
+
+    Returns:
+    (GrobidPool): The pool.
+    """
+    if grobid_url is None:
+        return grobid_pool
+    with grobid_pools_lock:
+        if grobid_url not in grobid_pools:
+            grobid_pools[grobid_url] = GrobidPool([grobid_url])
+        return grobid_pools[grobid_url]
+
+# The version of each GROBID server, so that it is only requested once per process.
+grobid_versions = {}
+
+def get_grobid_version(grobid_url=GROBID_URL):
+    """
+    Gets the version of the GROBID server. The version is part of the cache key, so that an upgrade of GROBID
+    doesn't return responses from the old version.
+
+    Paramaters:
+    grobid_url (str): The URL of the GROBID server.
+
+    Returns:
+    (str): The GROBID version, or None if the server didn't respond.
+    """
+    if grobid_url not in grobid_versions:
+        try:
+            response = session.get(f"{grobid_url}/api/version", timeout=GROBID_TIMEOUT)
+            response.raise_for_status()
+            grobid_versions[grobid_url] = response.text.strip()
+            logging.info(f"[grobidclient.py] GROBID version: {grobid_versions[grobid_url]}")
+        except Exception as e:
+            # Don't remember the failure, so that the version is requested again next time
+            logging.warning(f"[grobidclient.py] Could not get the GROBID version: {e}")
+            return None
+
+    return grobid_versions[grobid_url]
+
+def backoff_delay(attempt):
+    """
+    Calculates how long to wait before the next retry. Uses exponential backoff with full jitter,
+    so that many clients that failed at the same time don't retry at the same time.
+
+    Paramaters:
+    attempt (int): The number of the retry, starting at 0.
+
+    Returns:
+    (float): The number of seconds to wait.
+    """
+    return random.uniform(0, min(GROBID_BACKOFF_MAX, GROBID_BACKOFF_BASE * 2 ** attempt))
+
+def post(pool, endpoint, files, data):
+    """
+    Sends a request to GROBID through the shared session. Waits for a free slot if the maximum number of requests
+    are already in flight on every server, and retries with backoff if GROBID is saturated (503) or can't be reached.
+    A server which can't be reached is ejected from the pool, so the retry goes to another server.
+
+    Paramaters:
+    pool (GrobidPool): The pool of GROBID servers.
+    endpoint (str): The API endpoint, e.g. '/api/processFulltextDocument'.
+    files (dict): The files to send as multipart form-data.
+    data (dict): The form fields to send.
+
+    Returns:
+    (requests.Response): The response from GROBID, with status 200.
+
+    Raises:
+    requests.exceptions.RequestException: If GROBID didn't return status 200 after all retries.
+    """
+    for attempt in range(GROBID_MAX_RETRIES + 1):
+        grobid_url = pool.acquire()
+        try:
+            try:
+                start = time.perf_counter()
+                response = session.post(f"{grobid_url}{endpoint}", files=files, data=data, timeout=GROBID_TIMEOUT)  # Use 'data' for form-data
+                metrics.observe("grobid_latency", time.perf_counter() - start)
+            finally:
+                pool.release(grobid_url)
+            metrics.increment("grobid_requests")
+
+            if response.status_code != 503:
+                response.raise_for_status()  # Raise exception if status is not 200
+                return response
+
+            # GROBID has no free threads, so try again later:
+            metrics.increment("grobid_503")
+            if attempt == GROBID_MAX_RETRIES:
+                response.raise_for_status()
+            logging.warning(f"[grobidclient.py] GROBID is busy (503), retrying. Attempt {attempt + 1} of {GROBID_MAX_RETRIES}.")
+        except (requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout) as e:
+            metrics.increment("grobid_connection_errors")
+            pool.eject(grobid_url, str(e))
+            if attempt == GROBID_MAX_RETRIES:
+                metrics.increment("grobid_failures")
+                raise
+            logging.warning(f"[grobidclient.py] Could not connect to GROBID, retrying. Attempt {attempt + 1} of {GROBID_MAX_RETRIES}: {e}")
+        except requests.exceptions.RequestException:
+            # Read timeouts and other errors are not retried, as sending the same PDF again would most likely fail the same way
+            metrics.increment("grobid_failures")
+            raise
+
+        metrics.increment("grobid_retries")
+        time.sleep(backoff_delay(attempt))
+
+def get_profile_params(profile=None):
+    """
+    Gets the GROBID parameters of a profile.
+
+    Paramaters:
+    profile (str): The name of the profile, one of GROBID_PROFILES. Defaults to DEFAULT_GROBID_PROFILE.
+
+    Returns:
+    (dict): The parameters for GROBID.
+
+    Raises:
+    ValueError: If the profile doesn't exist.
+    """
+    if profile is None:
+        profile = DEFAULT_GROBID_PROFILE
+    if profile not in GROBID_PROFILES:
+        raise ValueError(f"Unknown GROBID profile '{profile}'. Choose one of: {', '.join(GROBID_PROFILES)}")
+    return GROBID_PROFILES[profile]
+
+def process_fulltext_document(pdf_bytes, params=None, use_cache=True, grobid_url=None, profile=None):
+    """
+    Sends a PDF to GROBID's processFulltextDocument endpoint and returns the TEI XML.
+    The responses are cached on disk, keyed by the SHA-256 hash of the PDF, the GROBID version and the exact parameters,
+    so processing the same PDF again (e.g. after a change in the pipeline or the models) skips GROBID entirely.
+    If the GROBID version can't be read, the cache is neither read nor written for this PDF.
+
+    Paramaters:
+    pdf_bytes (bytes): The content of the PDF file.
+    params (dict): The parameters for GROBID. If not given, the parameters of the profile are used.
+    use_cache (bool): Set to False to bypass the cache and always call GROBID. The new response is still stored.
+    grobid_url (str): The URL of a specific GROBID server. Defaults to the least busy healthy server in GROBID_URLS.
+    profile (str): The name of the processing profile, e.g. 'fast' or 'full'. Defaults to DEFAULT_GROBID_PROFILE.
+
+    Returns:
+    (str): The TEI XML returned by GROBID.
+
+    Raises:
+    requests.exceptions.RequestException: If GROBID could not be reached or didn't return status 200 after all retries.
+    """
+    if params is None:
+        params = get_profile_params(profile)
+
+    # The cache can also be turned off for the whole deployment in the .env file:
+    if get_envdict().get("grobid_cache", "True") == "False":
+        use_cache = False
+
+    pool = get_pool(grobid_url)
+    version = get_grobid_version(pool.version_url())
+    if version is None:
+        # Without the version, a cached response could come from an older GROBID, so the cache is skipped entirely
+        logging.warning(f"[grobidclient.py] Not using the GROBID cache for this PDF, as the GROBID version is unknown.")
+        metrics.increment("grobid_cache_skipped")
+        key = None
+    else:
+        key = grobid_cache.make_key(diskcache.hash_bytes(pdf_bytes), version, params)
+
+    if use_cache and key is not None:
+        cached = grobid_cache.get(key)
+        if cached is not None:
+            logging.info(f"[grobidclient.py] Found GROBID response in the cache, skipping GROBID.")
+            metrics.increment("grobid_cache_hits")
+            return cached
+        metrics.increment("grobid_cache_misses")
+
+    logging.info(f"[grobidclient.py] Calling GROBID server.")
+    response = post(pool, "/api/processFulltextDocument", files={'input': pdf_bytes}, data=params)
+    logging.info(f"[grobidclient.py] Successfully called GROBID server.")
+
+    if key is not None:
+        grobid_cache.set(key, response.text)
+    return response.text
@@ -97,4 +97,112 @@ def load_grobid_python_way():
     time.sleep(1)
     clock -= 1
 
-  print("----> GROBID server address: ", socket.gethostbyname(socket.gethostname()), "/8070")
\ No newline at end of file
+  print("----> GROBID server address: ", socket.gethostbyname(socket.gethostname()), "/8070")
+
+# Extra GROBID instances are launched on consecutive pairs of ports after the default instance on 8070 (API) and
+#  8071 (admin), i.e. 8072/8073, 8074/8075 and so on.
+GROBID_HOST = "http://172.28.0.12"
+GROBID_BASE_PORT = 8070
+GROBID_DIR = "/content/grobid-0.8.1"
+
+def instance_urls(count):
+  """
+  Gets the URLs of the GROBID instances started by launch_grobid_instances().
+
+  Paramaters:
+  count (int): The number of GROBID instances.
+
+  Returns:
+  (list[str]): The URL of each instance.
+  """
+  return [f"{GROBID_HOST}:{GROBID_BASE_PORT + 2 * i}" for i in range(count)]
+
+def is_alive(url):
+  """
+  Checks if a GROBID server is up.
+
+  Paramaters:
+  url (str): The URL of the GROBID server.
+
+  Returns:
+  (bool): True if the server answered 'true' on /api/isalive.
+  """
+  try:
+    return requests.get(f"{url}/api/isalive", timeout=5).text.strip() == "true"
+  except Exception:
+    return False
+
+def find_grobid_jar():
+  """
+  Finds the runnable GROBID service jar, and builds it with Gradle if it doesn't exist.
+
+  Paramaters:
+  None
+
+  Returns:
+  (str): The path to the jar, or None if it could not be built.
+  """
+  jars = sorted(Path(GROBID_DIR, "grobid-service", "build", "libs").glob("grobid-service-*-onejar.jar"))
+  if not jars:
+    logging.info(f"[grobidmodule.py] GROBID service jar not found. Building it with Gradle.")
+    print("----> Building GROBID service jar with Gradle...")
+    grobidinstalllogfile = open("grobidinstalllog.txt", "a")
+    n = subprocess.run(["./gradlew", ":grobid-service:shadowJar"], stdout=grobidinstalllogfile, stderr=grobidinstalllogfile, text=True, cwd=GROBID_DIR)
+    jars = sorted(Path(GROBID_DIR, "grobid-service", "build", "libs").glob("grobid-service-*-onejar.jar"))
+  if not jars:
+    logging.error(f"[grobidmodule.py] Could not find or build the GROBID service jar.")
+    return None
+  return str(jars[-1])
+
+def launch_grobid_instances(count, timeout=900):
+  """
+  Launches several local GROBID servers, so that the GROBID client can balance requests between them.
+  The first instance is started by load_grobid_python_way(), which also downloads and installs GROBID if needed.
+  The other instances run the GROBID service jar with the ports of the grobid.yaml overridden, see instance_urls().
+  Each instance is a separate JVM with its own models, so every instance needs a few GB of memory.
+
+  Paramaters:
+  count (int): The number of GROBID instances.
+  timeout (int): Maximum number of seconds to wait for all instances to be up.
+
+  Returns:
+  (list[str]): The URLs of the instances which are up.
+  """
+  logging.info(f"[grobidmodule.py] Launching {count} GROBID instances.")
+  load_grobid_python_way()
+  urls = instance_urls(count)
+  if count < 2:
+    return urls
+
+  jar = find_grobid_jar()
+  if jar is None:
+    return urls[:1]
+
+  for i, url in enumerate(urls[1:], start=1):
+    if is_alive(url):
+      logging.info(f"[grobidmodule.py] GROBID instance {url} is already running.")
+      continue
+    port = GROBID_BASE_PORT + 2 * i
+    # Started with Popen in the background, like the first instance, as the server never finishes the command.
+    grobidrunlogfile = open(f"grobidrunlog_{port}.txt", "w")
+    n = subprocess.Popen(["java",
+                          f"-Ddw.server.applicationConnectors[0].port={port}",
+                          f"-Ddw.server.adminConnectors[0].port={port + 1}",
+                          "-jar", jar, "server", "grobid-home/config/grobid.yaml"],
+                         stdout=grobidrunlogfile, stderr=grobidrunlogfile, text=True, cwd=GROBID_DIR)
+    logging.info(f"[grobidmodule.py] Started GROBID instance on port {port}.")
+
+  print(f"----> Waiting for {count} GROBID instances to be up:")
+  deadline = time.time() + timeout
+  while True:
+    alive = [url for url in urls if is_alive(url)]
+    print(f"{len(alive)} of {count} GROBID instances are up.")
+    if len(alive) == count or time.time() > deadline:
+      break
+    time.sleep(5)
+
+  if len(alive) < count:
+    logging.warning(f"[grobidmodule.py] Only {len(alive)} of {count} GROBID instances are up: {alive}")
+  else:
+    logging.info(f"[grobidmodule.py] All {count} GROBID instances are up.")
+  return alive
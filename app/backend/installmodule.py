@@ -0,0 +1,184 @@
+import os
+import re
+import sys
+import json
+import hashlib
+import logging
+import subprocess
+from importlib import metadata
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s: %(message)s',
+    force=True,
+    handlers=[
+        logging.FileHandler("app.log"),  # Log to a file named 'app.log'
+        logging.StreamHandler(sys.stdout)  # Also log to console
+    ]
+)
+
+# The requirements, relative to /content where the launch scripts are run from.
+REQUIREMENTS_PATH = "Sci2XML/app/requirements_final.txt"
+
+# The apt packages and npm packages installed next to the pip requirements.
+APT_PACKAGES = ["poppler-utils", "libvips"]
+NPM_PACKAGES = ["localtunnel"]
+
+# The fingerprint of the environment after the last successful installation.
+STAMP_PATH = "/content/.install_stamp"
+
+def get_requirement_names(requirements_path):
+    """
+    Gets the names of the packages in a requirements file, without versions.
+
+    Parameters:
+    requirements_path (str): Path to the requirements file.
+
+    Returns:
+    (list[str]): The package names.
+    """
+    names = []
+    with open(requirements_path, "r") as f:
+        for line in f:
+            line = line.split("#")[0].strip()
+            if line and not line.startswith("-"):
+                names.append(re.split(r"[\s<>=!~;\[]", line, maxsplit=1)[0])
+    # File is automatically closed after exiting the 'with' block
+    return names
+
+def get_apt_version(package):
+    """
+    Gets the installed version of an apt package.
+
+    Parameters:
+    package (str): The name of the package.
+
+    Returns:
+    (str): The version, or "missing" if the package is not installed.
+    """
+    try:
+        result = subprocess.run(["dpkg-query", "-W", "-f=${Version}", package], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        return result.stdout.strip() or "missing"
+    except Exception:
+        return "missing"
+
+def get_npm_version(package):
+    """
+    Gets the version of an npm package installed in the current folder.
+
+    Parameters:
+    package (str): The name of the package.
+
+    Returns:
+    (str): The version, or "missing" if the package is not installed.
+    """
+    try:
+        with open(os.path.join("node_modules", package, "package.json"), "r") as f:
+            return json.load(f).get("version", "missing")
+        # File is automatically closed after exiting the 'with' block
+    except Exception:
+        return "missing"
+
+def get_fingerprint(requirements_path=REQUIREMENTS_PATH):
+    """
+    Creates a fingerprint of the environment: the content of the requirements file, the Python version and the
+    installed version of every pip, apt and npm package the application installs. If any of them change,
+    for example because the requirements file was updated or a package was removed, the fingerprint changes.
+
+    Parameters:
+    requirements_path (str): Path to the requirements file.
+
+    Returns:
+    (str): The SHA-256 fingerprint.
+    """
+    with open(requirements_path, "rb") as f:
+        requirements = f.read()
+    # File is automatically closed after exiting the 'with' block
+
+    versions = {"python": sys.version}
+    for name in get_requirement_names(requirements_path):
+        try:
+            versions[f"pip:{name}"] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            versions[f"pip:{name}"] = "missing"
+    for package in APT_PACKAGES:
+        versions[f"apt:{package}"] = get_apt_version(package)
+    for package in NPM_PACKAGES:
+        versions[f"npm:{package}"] = get_npm_version(package)
+
+    fingerprint = hashlib.sha256(requirements)
+    fingerprint.update(json.dumps(versions, sort_keys=True).encode("utf-8"))
+    return fingerprint.hexdigest()
+
+def read_stamp():
+    """
+    Reads the fingerprint stored after the last successful installation.
+
+    Returns:
+    (str): The fingerprint, or None if there is no stamp file.
+    """
+    try:
+        with open(STAMP_PATH, "r") as f:
+            return f.read().strip()
+        # File is automatically closed after exiting the 'with' block
+    except FileNotFoundError:
+        return None
+
+def install_requirements(requirements_path=REQUIREMENTS_PATH):
+    """
+    Installs the pip, apt-get and npm requirements. The output is written to reqlog.txt.
+
+    Parameters:
+    requirements_path (str): Path to the requirements file.
+
+    Returns:
+    (bool): True if every installation command succeeded.
+    """
+    log = open("reqlog.txt", "a")
+    print("\n----> pip installs...")
+    results = [subprocess.run(["pip", "install", '-r', requirements_path], stdout=log, stderr=log, text=True)]
+
+    print("----> apt-get installs...")
+    results.append(subprocess.run(["apt", "update"], stdout=log, stderr=log, text=True))
+    results.append(subprocess.run(["apt-get", "install", "-y"] + APT_PACKAGES, stdout=log, stderr=log, text=True))
+
+    print("----> npm installs...\n")
+    results.append(subprocess.run(["npm", "install"] + NPM_PACKAGES, stdout=log, stderr=log, text=True))
+    log.close()
+
+    return all(result.returncode == 0 for result in results)
+
+def ensure_requirements(requirements_path=REQUIREMENTS_PATH, skip=False):
+    """
+    Installs the requirements, unless the environment is unchanged since the last successful installation.
+    After a successful installation the new fingerprint is stored in the stamp file, so that a restart with
+    the same environment skips the installation.
+
+    Parameters:
+    requirements_path (str): Path to the requirements file.
+    skip (bool): Skip the installation without checking the fingerprint.
+
+    Returns:
+    (str): What was done: "skipped", "up to date", "installed" or "failed".
+    """
+    if skip:
+        logging.info(f"[installmodule.py] Skipping installation of requirements.")
+        return "skipped"
+
+    if read_stamp() == get_fingerprint(requirements_path):
+        logging.info(f"[installmodule.py] Requirements are unchanged since the last installation, skipping installation.")
+        print("----> Requirements are already installed.")
+        return "up to date"
+
+    logging.info(f"[installmodule.py] Requirements or installed packages changed, installing requirements.")
+    if not install_requirements(requirements_path):
+        # Don't write the stamp, so that the installation is tried again at the next start
+        logging.warning(f"[installmodule.py] Some of the installation commands failed, see reqlog.txt.")
+        return "failed"
+
+    # The fingerprint after the installation, with the versions that were just installed:
+    with open(STAMP_PATH, "w") as f:
+        f.write(get_fingerprint(requirements_path))
+    # File is automatically closed after exiting the 'with' block
+    logging.info(f"[installmodule.py] Finished installing requirements.")
+    return "installed"
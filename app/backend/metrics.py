@@ -0,0 +1,86 @@
+import threading
+from collections import deque
+
+# Counters and timings collected in this process. They are exposed through the /metrics endpoint of the API,
+#  and logged at the end of processing in the CLI.
+lock = threading.Lock()
+counters = {}
+timings = {}
+
+# Number of recent samples kept for each timing, used to calculate the percentiles.
+SAMPLE_SIZE = 1000
+
+def increment(name, amount=1):
+    """
+    Increments a counter.
+
+    Paramaters:
+    name (str): The name of the counter, e.g. 'grobid_retries'.
+    amount (int): The amount to add to the counter.
+
+    Returns:
+    None
+    """
+    with lock:
+        counters[name] = counters.get(name, 0) + amount
+
+def observe(name, seconds):
+    """
+    Records a duration, e.g. the latency of a request.
+
+    Paramaters:
+    name (str): The name of the timing, e.g. 'grobid_latency'.
+    seconds (float): The duration in seconds.
+
+    Returns:
+    None
+    """
+    with lock:
+        if name not in timings:
+            timings[name] = {"count": 0, "total": 0.0, "max": 0.0, "samples": deque(maxlen=SAMPLE_SIZE)}
+        timing = timings[name]
+        timing["count"] += 1
+        timing["total"] += seconds
+        timing["max"] = max(timing["max"], seconds)
+        timing["samples"].append(seconds)
+
+def percentile(samples, fraction):
+    """
+    Finds the value below which the given fraction of the samples fall.
+
+    Paramaters:
+    samples (list[float]): The samples, sorted in ascending order.
+    fraction (float): The fraction, e.g. 0.95 for the 95th percentile.
+
+    Returns:
+    (float): The percentile, or 0 if there are no samples.
+    """
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+def snapshot(prefix=""):
+    """
+    Gets the current value of all counters and a summary of all timings.
+
+    Paramaters:
+    prefix (str): Only include counters and timings whose name starts with this prefix.
+
+    Returns:
+    (dict): A dict with the keys 'counters' and 'timings'.
+    """
+    with lock:
+        result = {"counters": {name: value for name, value in counters.items() if name.startswith(prefix)}, "timings": {}}
+        for name, timing in timings.items():
+            if not name.startswith(prefix):
+                continue
+            samples = sorted(timing["samples"])
+            result["timings"][name] = {
+                "count": timing["count"],
+                "mean": timing["total"] / timing["count"],
+                "p50": percentile(samples, 0.50),
+                "p95": percentile(samples, 0.95),
+                "p99": percentile(samples, 0.99),
+                "max": timing["max"]
+            }
+    return result
@@ -0,0 +1,391 @@
+import gc
+import sys
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import backend.grobidclient as grobidclient
+import backend.metrics as metrics
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s: %(message)s',
+    force=True,
+    handlers=[
+        logging.FileHandler("app.log"),  # Log to a file named 'app.log'
+        logging.StreamHandler(sys.stdout)  # Also log to console
+    ]
+)
+
+envdict = grobidclient.get_envdict()
+
+# The models this API instance may load, comma-separated, e.g. 'sumen' for a worker which only parses formulas.
+#  Can be set with models in the .env file. 'all' enables every model.
+ENABLED_MODELS = envdict.get("models", "all")
+
+# Models which have not been used for this many seconds are unloaded to free memory, and loaded again on the next use.
+#  Can be set with model_idle_unload in the .env file. 0 keeps the models loaded.
+IDLE_UNLOAD_SECONDS = int(envdict.get("model_idle_unload", 0))
+
+# The models loaded with their Linear layers quantized to int8, comma-separated, e.g. 'sumen,unichart'.
+#  Can be set with quantize in the .env file. Only has an effect on CPU, see backend/models/quantization.py.
+QUANTIZED_MODELS = envdict.get("quantize", "none")
+
+# The decoding policy of the generative models, see backend/models/decoding.py. Either one policy for every model, e.g. 'adaptive',
+#  or per model, comma-separated, e.g. 'sumen=adaptive,unichart=beam'. Can be set with decoding in the .env file.
+DECODING = envdict.get("decoding", "beam")
+
+@contextmanager
+def intra_op_threads(threads):
+    """
+    Limits the number of threads torch uses for the operations run by the calling thread, so that models which run
+    at the same time in separate threads share the cores instead of each starting a thread per core. With the OpenMP
+    backend of torch the limit of the OpenMP pool only applies to the calling thread. torch.set_num_threads() also
+    sets the number of MKL threads, which is a setting of the whole process, so the operations MKL runs use the
+    limit set last by any thread. The limit is a way to share the cores, not a strict limit per thread: for that,
+    run the models in worker processes (see modelworkers.py). Does nothing on GPU.
+
+    Parameters:
+    threads (int): The number of threads. None keeps the number of threads of torch.
+
+    Returns:
+    A context manager, which restores the previous number of threads when it exits.
+    """
+    import torch
+    if threads is None or torch.cuda.is_available():
+        yield
+        return
+    previous = torch.get_num_threads()
+    torch.set_num_threads(max(1, threads))
+    try:
+        yield
+    finally:
+        torch.set_num_threads(previous)
+
+class ModelDisabledError(RuntimeError):
+    """
+    Raised when a model is requested which is not enabled for this API instance.
+    """
+
+class ModelRegistry:
+    """
+    Keeps track of the models used by the API. A model is loaded the first time it is used, and only once, even if
+    several requests need it at the same time. Models can be disabled, so that an instance only loads the models
+    for the work it gets, and models that have been idle for a while can be unloaded. Models loaded at startup are
+    warmed up with a synthetic input, and the instance is ready when all of them are warm.
+
+    Parameters:
+    enabled (str): Comma-separated names of the enabled models, or 'all'.
+    idle_seconds (int): Unload models which have not been used for this many seconds. 0 turns unloading off.
+    quantized (str): Comma-separated names of the models to load quantized to int8, or 'none'.
+    decoding (str): The decoding policy of every model, or comma-separated 'model=policy' pairs.
+    """
+
+    def __init__(self, enabled=ENABLED_MODELS, idle_seconds=IDLE_UNLOAD_SECONDS, quantized=QUANTIZED_MODELS, decoding=DECODING):
+        self.enabled = None if enabled.strip() == "all" else {name.strip() for name in enabled.split(",") if name.strip()}
+        self.quantized = {name.strip() for name in quantized.split(",") if name.strip() and name.strip() != "none"}
+        self.default_decoding = "beam"
+        self.decoding = {}
+        for setting in decoding.split(","):
+            if "=" in setting:
+                self.decoding[setting.split("=", 1)[0].strip()] = setting.split("=", 1)[1].strip()
+            elif setting.strip():
+                self.default_decoding = setting.strip()
+        self.idle_seconds = idle_seconds
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.unload_thread = None
+        # The models which have to be warmed up before the instance is ready, see preload()
+        self.required = set()
+
+    def register(self, name, loader, unloader=None, warmup=None):
+        """
+        Registers a model without loading it.
+
+        Parameters:
+        name (str): The name of the model, e.g. 'sumen'.
+        loader (callable): Function without arguments which loads the model and returns it.
+        unloader (callable): Optional function without arguments which releases references to the model held elsewhere, e.g. in module globals.
+        warmup (callable): Optional function which gets the loaded model and runs a synthetic input through it.
+
+        Returns:
+        None
+        """
+        with self.lock:
+            self.entries[name] = {
+                "loader": loader,
+                "unloader": unloader,
+                "warmup": warmup,
+                "warmup_seconds": None,
+                "warmup_error": None,
+                "model": None,
+                "loaded": False,
+                "lock": threading.Lock(),
+                "users": 0,
+                "last_used": 0.0,
+            }
+
+    def is_enabled(self, name):
+        """
+        Checks if a model is registered and enabled for this API instance.
+
+        Parameters:
+        name (str): The name of the model.
+
+        Returns:
+        (bool): True if the model may be loaded.
+        """
+        return name in self.entries and (self.enabled is None or name in self.enabled)
+
+    def is_quantized(self, name):
+        """
+        Checks if a model should be loaded quantized to int8. Read by the loaders registered in APIcode.py.
+
+        Parameters:
+        name (str): The name of the model.
+
+        Returns:
+        (bool): True if the model should be quantized.
+        """
+        return name in self.quantized
+
+    def decoding_policy(self, name):
+        """
+        Gets the decoding policy of a generative model: 'beam', 'greedy' or 'adaptive'. Read by the endpoints in APIcode.py.
+
+        Parameters:
+        name (str): The name of the model.
+
+        Returns:
+        (str): The decoding policy.
+        """
+        return self.decoding.get(name, self.default_decoding)
+
+    def load(self, name):
+        """
+        Loads a model, unless it is already loaded. Requests which need the model while it is being loaded wait for
+        the first one to finish, instead of loading it again.
+
+        Parameters:
+        name (str): The name of the model.
+
+        Returns:
+        The loaded model, as returned by its loader.
+
+        Raises:
+        ModelDisabledError: If the model is not enabled.
+        """
+        if not self.is_enabled(name):
+            raise ModelDisabledError(f"The model '{name}' is not enabled on this instance.")
+
+        entry = self.entries[name]
+        if entry["loaded"]:
+            return entry["model"]
+
+        with entry["lock"]:
+            # Another request may have loaded the model while we were waiting for the lock
+            if not entry["loaded"]:
+                start = time.time()
+                entry["model"] = entry["loader"]()
+                entry["loaded"] = True
+                entry["last_used"] = time.time()
+                metrics.increment("model_loads")
+                metrics.observe(f"model_load_{name}", time.time() - start)
+                logging.info(f"[modelregistry.py] Loaded {name} in {time.time() - start:.1f} seconds.")
+        return entry["model"]
+
+    @contextmanager
+    def use(self, name):
+        """
+        Loads a model if needed and keeps it from being unloaded while it is used.
+
+        Parameters:
+        name (str): The name of the model.
+
+        Returns:
+        A context manager which gives the loaded model.
+
+        Raises:
+        ModelDisabledError: If the model is not enabled.
+        """
+        entry = self.entries.get(name)
+        if entry is not None:
+            with entry["lock"]:
+                entry["users"] += 1
+        try:
+            model = self.load(name)
+            yield model
+        finally:
+            if entry is not None:
+                with entry["lock"]:
+                    entry["users"] -= 1
+                    entry["last_used"] = time.time()
+
+    def warm_up(self, name):
+        """
+        Runs the warm-up function of a model, which pushes a synthetic input through it. This pays the one-time costs
+        of the first request, like kernel initialization, tokenizer setup and allocator growth, before a real request comes.
+        A failed warm-up is logged and reported in status(), but doesn't keep the instance from being ready, as the
+        model itself is loaded.
+
+        Parameters:
+        name (str): The name of the model.
+
+        Returns:
+        (float): The time the warm-up took, in seconds.
+        """
+        entry = self.entries[name]
+        start = time.time()
+        with self.use(name) as model:
+            try:
+                if entry["warmup"] is not None:
+                    entry["warmup"](model)
+                entry["warmup_error"] = None
+            except Exception as e:
+                entry["warmup_error"] = str(e)
+                logging.error(f"[modelregistry.py] An error occurred while warming up {name}: {e}", exc_info=True)
+        entry["warmup_seconds"] = time.time() - start
+        metrics.observe(f"model_warmup_{name}", entry["warmup_seconds"])
+        logging.info(f"[modelregistry.py] Warmed up {name} in {entry['warmup_seconds']:.1f} seconds.")
+        return entry["warmup_seconds"]
+
+    def load_and_warm_up(self, name):
+        """
+        Loads a model and warms it up.
+
+        Parameters:
+        name (str): The name of the model.
+
+        Returns:
+        None
+        """
+        self.load(name)
+        self.warm_up(name)
+
+    def preload(self, names=None):
+        """
+        Loads and warms up models in advance, at the same time in separate threads, as most of the time is spent
+        downloading and reading the weights, which doesn't hold the GIL. Disabled models are skipped.
+        The instance is ready when all of them are warm.
+
+        Parameters:
+        names (list[str]): The models to load. Defaults to every registered model.
+
+        Returns:
+        None
+        """
+        names = [name for name in (names or list(self.entries)) if self.is_enabled(name)]
+        self.required.update(names)
+        if not names:
+            return
+        with ThreadPoolExecutor(max_workers=len(names)) as executor:
+            futures = {name: executor.submit(self.load_and_warm_up, name) for name in names}
+        for name, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                logging.error(f"[modelregistry.py] An error occurred while loading {name}: {e}", exc_info=True)
+
+    def unload(self, name):
+        """
+        Unloads a model, unless it is being used. It is loaded again the next time it is used.
+
+        Parameters:
+        name (str): The name of the model.
+
+        Returns:
+        (bool): True if the model was unloaded.
+        """
+        entry = self.entries[name]
+        with entry["lock"]:
+            if not entry["loaded"] or entry["users"] > 0:
+                return False
+            entry["model"] = None
+            entry["loaded"] = False
+            if entry["unloader"] is not None:
+                entry["unloader"]()
+        gc.collect()
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+        metrics.increment("model_unloads")
+        logging.info(f"[modelregistry.py] Unloaded {name}.")
+        return True
+
+    def unload_idle(self):
+        """
+        Unloads the models which have not been used for idle_seconds.
+
+        Returns:
+        (list[str]): The names of the unloaded models.
+        """
+        now = time.time()
+        unloaded = []
+        for name, entry in list(self.entries.items()):
+            if entry["loaded"] and entry["users"] == 0 and now - entry["last_used"] > self.idle_seconds:
+                if self.unload(name):
+                    unloaded.append(name)
+        return unloaded
+
+    def start_idle_unloader(self):
+        """
+        Starts a background thread which unloads idle models. Does nothing if idle unloading is turned off.
+
+        Returns:
+        None
+        """
+        if self.idle_seconds <= 0 or self.unload_thread is not None:
+            return
+
+        def unload_loop():
+            while True:
+                time.sleep(max(1, min(self.idle_seconds / 2, 60)))
+                try:
+                    self.unload_idle()
+                except Exception as e:
+                    logging.error(f"[modelregistry.py] An error occurred while unloading idle models: {e}", exc_info=True)
+
+        self.unload_thread = threading.Thread(target=unload_loop, daemon=True)
+        self.unload_thread.start()
+        logging.info(f"[modelregistry.py] Unloading models after {self.idle_seconds} seconds without use.")
+
+    def is_ready(self):
+        """
+        Checks if every model loaded at startup has been warmed up. Models unloaded after being idle are loaded again
+        when they are needed, so they don't make the instance unready.
+
+        Returns:
+        (bool): True if the instance is ready for requests.
+        """
+        return all(self.entries[name]["warmup_seconds"] is not None for name in self.required)
+
+    def status(self):
+        """
+        Gets the state of every registered model, for monitoring.
+
+        Returns:
+        (dict): For each model, whether it is enabled, loaded and warm, how many requests use it, how long it has been idle
+         and how long the warm-up took.
+        """
+        now = time.time()
+        return {
+            name: {
+                "enabled": self.is_enabled(name),
+                "quantized": self.is_quantized(name),
+                "decoding": self.decoding_policy(name),
+                "loaded": entry["loaded"],
+                "warm": entry["loaded"] and entry["warmup_seconds"] is not None,
+                "users": entry["users"],
+                "idle_seconds": round(now - entry["last_used"], 1) if entry["loaded"] else None,
+                "warmup_seconds": round(entry["warmup_seconds"], 2) if entry["warmup_seconds"] is not None else None,
+                "warmup_error": entry["warmup_error"],
+            }
+            for name, entry in self.entries.items()
+        }
+
+registry = ModelRegistry()
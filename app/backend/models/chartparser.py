@@ -1,6 +1,10 @@
 import torch
-from transformers import DonutProcessor, VisionEncoderDecoderModel
+from transformers import DonutProcessor, VisionEncoderDecoderModel, StoppingCriteria, StoppingCriteriaList
 from collections import Counter
+from PIL import Image
+import backend.models.quantization as quantization
+import backend.models.decoding as decoding
+import backend.metrics as metrics
 
 import sys
 import logging
@@ -18,13 +22,16 @@ logging.basicConfig(
 # Determine the computation device: use GPU (CUDA) if available; otherwise, default to CPU
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-def load_unichart():
+def load_unichart(quantize=False):
     """
     Load the UniChart model and processor.
 
     UniChart is a vision-language model specialized for chart comprehension.
     This function initializes the pre-trained model and processor.
 
+    Parameters:
+        quantize (bool): Quantize the Linear layers to int8 for faster inference on CPU.
+
     Returns:
         model (VisionEncoderDecoderModel): Pre-trained UniChart model.
         processor (DonutProcessor): Processor responsible for image preprocessing and text tokenization.
@@ -37,6 +44,8 @@ def load_unichart():
         # Load the pre-trained UniChart model and assign it to the appropriate device
         global unichart_model, unichart_processor  # Declare global variables for model persistence
         unichart_model = VisionEncoderDecoderModel.from_pretrained("ahmed-masry/unichart-base-960").to(device)
+        if quantize:
+            unichart_model = quantization.quantize_dynamic_int8(unichart_model, "UniChart")
         
         # Load the corresponding processor for image and text handling
         unichart_processor = DonutProcessor.from_pretrained("ahmed-masry/unichart-base-960")
@@ -73,7 +82,43 @@ def is_hallucinated(response, repetition_threshold=20):
     # Check if any word appears more times than the specified threshold
     return any(count > repetition_threshold for count in word_counts.values())
 
-def generate_unichart_response(image, prompt):
+class RepetitionStoppingCriteria(StoppingCriteria):
+    """
+    Stops the generation as soon as every sequence repeats a word more than repetition_threshold times, the same
+    signal is_hallucinated() uses to throw the response away afterwards. Degenerate outputs otherwise run until
+    the maximum length, which is the most expensive response there is.
+
+    The check decodes the sequences, so it only runs every check_every tokens. With beam search, generation only
+    stops when all beams are degenerate, and the result still goes through is_hallucinated().
+
+    Parameters:
+        tokenizer: The tokenizer of the model, to decode the sequences.
+        max_length (int): The maximum length of the generation, to count the tokens saved.
+        repetition_threshold (int): Maximum allowable repetitions of any single word.
+        check_every (int): Number of tokens between the checks.
+    """
+
+    def __init__(self, tokenizer, max_length, repetition_threshold=20, check_every=8):
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.repetition_threshold = repetition_threshold
+        self.check_every = check_every
+        self.aborted = False
+        self.tokens_saved = 0
+
+    def __call__(self, input_ids, scores, **kwargs):
+        # A word can only be repeated more than the threshold once there are more tokens than the threshold
+        if input_ids.shape[1] <= self.repetition_threshold or input_ids.shape[1] % self.check_every != 0:
+            return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+        texts = self.tokenizer.batch_decode(input_ids, skip_special_tokens=True)
+        degenerate = [max(Counter(text.lower().split()).values(), default=0) > self.repetition_threshold for text in texts]
+        if all(degenerate):
+            self.aborted = True
+            self.tokens_saved = self.max_length - input_ids.shape[1]
+        return torch.tensor(degenerate, dtype=torch.bool, device=input_ids.device)
+
+def generate_unichart_response(image, prompt, decoding_policy="beam"):
     """
     Generates a response using the UniChart model based on an input image and text prompt.
 
@@ -83,6 +128,8 @@ def generate_unichart_response(image, prompt):
     Parameters:
     image (PIL.Image or tensor): Input image of a chart or table.
     prompt (str): Text prompt describing the task or expected output.
+    decoding_policy (str): 'beam', 'greedy', or 'adaptive' to decode greedily and only use beam search if the
+     response is unlikely or hallucinated. See backend/models/decoding.py.
 
     Returns:
     response (str): The generated response, post-processed to remove special tokens.
@@ -95,19 +142,38 @@ def generate_unichart_response(image, prompt):
         # Tokenize the input prompt for the model's decoder
         decoder_input_ids = unichart_processor.tokenizer(prompt, add_special_tokens=False, return_tensors="pt").input_ids
         
-        # Generate a response using beam search
-        outputs = unichart_model.generate(
-            pixel_values,  # Processed image input
-            decoder_input_ids=decoder_input_ids.to(device),  
-            max_length=unichart_model.decoder.config.max_position_embeddings,  
-            early_stopping=True,  
-            pad_token_id=unichart_processor.tokenizer.pad_token_id,  
-            eos_token_id=unichart_processor.tokenizer.eos_token_id,
-            use_cache=True,
-            num_beams=4,  # Use beam search with 4 beams for better decoding accuracy
-            bad_words_ids=[[unichart_processor.tokenizer.unk_token_id]],  # Prevent unknown tokens from appearing
-            return_dict_in_generate=True,  # Return structured output
-        )
+        max_length = unichart_model.decoder.config.max_position_embeddings
+
+        def run(num_beams, output_scores):
+            # Stop early if the response degenerates into repeating words
+            repetition_criteria = RepetitionStoppingCriteria(unichart_processor.tokenizer, max_length)
+
+            # Generate a response, using beam search unless num_beams is 1
+            outputs = unichart_model.generate(
+                pixel_values,  # Processed image input
+                decoder_input_ids=decoder_input_ids.to(device),  
+                max_length=max_length,  
+                early_stopping=True,  
+                pad_token_id=unichart_processor.tokenizer.pad_token_id,  
+                eos_token_id=unichart_processor.tokenizer.eos_token_id,
+                use_cache=True,
+                num_beams=num_beams,  # Beam search with 4 beams gives better decoding accuracy
+                bad_words_ids=[[unichart_processor.tokenizer.unk_token_id]],  # Prevent unknown tokens from appearing
+                return_dict_in_generate=True,  # Return structured output
+                output_scores=output_scores,  # Token scores, for the log-probability of greedy outputs
+                stopping_criteria=StoppingCriteriaList([repetition_criteria]),  # Abort degenerate responses early
+            )
+
+            if repetition_criteria.aborted:
+                metrics.increment("unichart_aborted_generations")
+                metrics.increment("unichart_tokens_saved", repetition_criteria.tokens_saved)
+                logging.info(f"[chartparser.py] Stopped unichart generation early because of repeated words, saved up to {repetition_criteria.tokens_saved} tokens.")
+            return outputs
+
+        def accept(outputs):
+            return not is_hallucinated(unichart_processor.batch_decode(outputs.sequences, skip_special_tokens=True)[0])
+
+        outputs = decoding.generate("unichart", decoding_policy, unichart_model, run, accept)
 
         # Decode the generated sequence into a human-readable response
         response = unichart_processor.batch_decode(outputs.sequences)[0]
@@ -168,4 +234,31 @@ def parse_table_data(table_data):
 
         parsed_data = []
 
-    return parsed_data # Return the structured table data
\ No newline at end of file
+    return parsed_data # Return the structured table data
+
+def warmup(max_new_tokens=8):
+    """
+    Runs a blank image through the UniChart model, so that the one-time costs of the first request (kernel initialization,
+    tokenizer setup, allocator growth) are paid before a real chart arrives. Only a few tokens are generated.
+
+    Parameters:
+    max_new_tokens (int): The number of tokens to generate.
+
+    Returns:
+    None
+    """
+    image = Image.new("RGB", (960, 960), "white")
+    pixel_values = unichart_processor(image, return_tensors="pt").pixel_values.to(device)
+    decoder_input_ids = unichart_processor.tokenizer("<extract_data_table><s_answer>", add_special_tokens=False, return_tensors="pt").input_ids
+
+    with torch.no_grad():
+        unichart_model.generate(
+            pixel_values,
+            decoder_input_ids=decoder_input_ids.to(device),
+            max_new_tokens=max_new_tokens,
+            pad_token_id=unichart_processor.tokenizer.pad_token_id,
+            eos_token_id=unichart_processor.tokenizer.eos_token_id,
+            use_cache=True,
+            num_beams=4,
+        )
+    logging.info(f"[chartparser.py] Finished warming up UniChart.")
@@ -1,14 +1,13 @@
 ## Load-modules ##
-from skorch import NeuralNetClassifier
+# skorch is only needed by load_ml() and albumentations only by call_ml(), so they are imported there.
+import os
 import torch.nn as nn
 import torch
 import multiprocessing as mp
-from skorch.dataset import ValidSplit
-from skorch.callbacks import LRScheduler, Checkpoint
-from skorch.callbacks import Freezer, EarlyStopping
 import torchvision
-import albumentations as A
 import numpy as np
+import backend.models.quantization as quantization
+from PIL import Image
 
 import sys
 import logging
@@ -24,6 +23,242 @@ logging.basicConfig(
 
 # This code is adapted from ---> https://www.kaggle.com/code/sunedition/classification-of-graphs <---
 
+# The trained weights, as saved by skorch, and the same weights as safetensors, which can be memory-mapped.
+WEIGHTS_PATH = 'Sci2XML/app/backend/models/best_model_densenet169_sentence.pkl'
+SAFETENSORS_PATH = 'Sci2XML/app/backend/models/best_model_densenet169_sentence.safetensors'
+
+# The trained model exported to ONNX, see export_onnx().
+ONNX_PATH = 'Sci2XML/app/backend/models/best_model_densenet169_sentence.onnx'
+
+# The size of the images the classifier was trained on.
+IMG_SIZE = 224
+
+# The classes the classifier was trained on, in the order of its outputs.
+CLASS_NAMES = ['just_image', 'bar_chart', 'diagram', 'flow_chart', 'graph',
+                'growth_chart', 'pie_chart', 'table', 'text_sentence']
+
+class DenseNet169(nn.Module):
+  """
+  DenseNet169 with the custom classification head used by the classifier.
+
+  Paramaters:
+  output_features: The number of classes.
+  pretrained: Start from the ImageNet weights. Not needed when the trained weights are loaded afterwards.
+  """
+  def __init__(self, output_features, num_units=512, drop=0.5,
+              num_units1=512, drop1=0.5, pretrained=True):
+      super().__init__()
+      model = torchvision.models.densenet169(weights="DEFAULT" if pretrained else None)
+      n_inputs = model.classifier.in_features
+      model.classifier = nn.Sequential(
+                              nn.Linear(n_inputs, num_units),
+                              nn.ReLU(),
+                              nn.Dropout(p=drop),
+                              nn.Linear(num_units, num_units1),
+                              nn.ReLU(),
+                              nn.Dropout(p=drop1),
+                              nn.Linear(num_units1, output_features))
+      self.model = model
+
+  def forward(self, x):
+      return self.model(x)
+
+class InferenceClassifier:
+  """
+  The trained DenseNet169 without the training machinery of skorch. Has the same predict() as the skorch
+  NeuralNetClassifier, so call_ml() works with both.
+
+  Paramaters:
+  module: The DenseNet169 module with the trained weights.
+  device: The device the module is on.
+  """
+  def __init__(self, module, device):
+    self.module = module.eval()
+    self.device = device
+
+  def predict(self, x):
+    """
+    Predicts the class of each image in a batch.
+
+    Paramaters:
+    x: A batch of transformed images, as a tensor.
+
+    Returns:
+    The index of the predicted class for each image, as a numpy array.
+    """
+    with torch.inference_mode():
+      return self.module(x.to(self.device)).argmax(dim=1).cpu().numpy()
+
+def read_state_dict():
+  """
+  Reads the trained weights. If the safetensors file exists it is memory-mapped, so the weights are only read from
+  disk when they are used. Otherwise the weights saved by skorch are read, and written as safetensors for the next start.
+
+  Paramaters:
+  None
+
+  Returns:
+  state_dict: The weights of the DenseNet169 module, on the CPU.
+  """
+  try:
+    from safetensors.torch import load_file, save_file
+  except ImportError:
+    load_file, save_file = None, None
+
+  if load_file is not None and os.path.exists(SAFETENSORS_PATH):
+    logging.info(f"[classifiermodel.py] Memory-mapping weights from {SAFETENSORS_PATH}.")
+    return load_file(SAFETENSORS_PATH, device="cpu")
+
+  try:
+    state_dict = torch.load(WEIGHTS_PATH, map_location="cpu", weights_only=True, mmap=True)
+  except (TypeError, RuntimeError):
+    # Older PyTorch versions, or files in the legacy format, can't be memory-mapped
+    state_dict = torch.load(WEIGHTS_PATH, map_location="cpu")
+
+  if save_file is not None:
+    try:
+      save_file({key: value.contiguous() for key, value in state_dict.items()}, SAFETENSORS_PATH)
+      logging.info(f"[classifiermodel.py] Saved weights as safetensors to {SAFETENSORS_PATH}.")
+    except Exception as e:
+      logging.error(f"[classifiermodel.py] An error occurred while saving the weights as safetensors: {e}", exc_info=True)
+  return state_dict
+
+def build_inference_module():
+  """
+  Creates the DenseNet169 module with the trained weights, on the CPU and in eval mode. The module is created without
+  memory on the 'meta' device and the trained weights are assigned to it directly, so no weights are initialized
+  which would be overwritten anyway.
+
+  Paramaters:
+  None
+
+  Returns:
+  module: The DenseNet169 module.
+  """
+  state_dict = read_state_dict()
+  try:
+    # No memory is allocated and no weights are initialized on the meta device
+    with torch.device("meta"):
+      module = DenseNet169(output_features=len(CLASS_NAMES), pretrained=False)
+    module.load_state_dict(state_dict, assign=True)
+  except (AttributeError, TypeError):
+    # PyTorch before 2.1 can't create modules on the meta device or assign the weights
+    module = DenseNet169(output_features=len(CLASS_NAMES), pretrained=False)
+    module.load_state_dict(state_dict)
+  return module.eval()
+
+def load_ml_inference(quantize=False):
+  """
+  Load the ML model used for classification, for inference only. Unlike load_ml() it doesn't download the ImageNet
+  weights, doesn't create the skorch training callbacks, and doesn't initialize weights which are overwritten anyway:
+  see build_inference_module().
+
+  Paramaters:
+  quantize: Quantize the Linear layers of the classification head to int8 for faster inference on CPU.
+
+  Returns:
+  classifier: The ML model, with the same predict() as the one returned by load_ml().
+  """
+  print("\n#-------------------- # Loading ML Classifier # --------------------#\n")
+  device = "cuda:0" if torch.cuda.is_available() else "cpu"
+
+  try:
+    module = build_inference_module().to(device)
+    if quantize:
+      # The only Linear layers of DenseNet169 are in the classification head
+      module = quantization.quantize_dynamic_int8(module, "DenseNet169 classifier")
+    classifier = InferenceClassifier(module, device)
+    logging.info(f"[classifiermodel.py] Finished loading densenet169 model for inference.")
+  except Exception as e:
+    logging.error(f"[classifiermodel.py] An error occurred while loading densenet169 model for inference: {e}", exc_info=True)
+    raise
+  print("\n----> ML classifier model loaded successfully")
+  return classifier
+
+class OnnxClassifier:
+  """
+  The trained DenseNet169 exported to ONNX and run with ONNX Runtime. Has the same predict() as the skorch
+  NeuralNetClassifier and InferenceClassifier, so call_ml() works with all of them.
+
+  Paramaters:
+  session: The ONNX Runtime InferenceSession of the exported model.
+  """
+  def __init__(self, session):
+    self.session = session
+    self.input_name = session.get_inputs()[0].name
+
+  def predict(self, x):
+    """
+    Predicts the class of each image in a batch.
+
+    Paramaters:
+    x: A batch of transformed images, as a tensor or a numpy array.
+
+    Returns:
+    The index of the predicted class for each image, as a numpy array.
+    """
+    if isinstance(x, torch.Tensor):
+      x = x.detach().cpu().numpy()
+    logits = self.session.run(None, {self.input_name: x.astype(np.float32, copy=False)})[0]
+    return logits.argmax(axis=1)
+
+def export_onnx(onnx_path=ONNX_PATH, opset=17):
+  """
+  Exports the trained DenseNet169 to ONNX, with a dynamic batch axis, so that batches of any size can be classified.
+
+  Paramaters:
+  onnx_path: Where to write the ONNX model.
+  opset: The ONNX opset version.
+
+  Returns:
+  onnx_path: Where the ONNX model was written.
+  """
+  module = build_inference_module()
+  dummy_input = torch.zeros(1, 3, IMG_SIZE, IMG_SIZE)
+  with torch.no_grad():
+    torch.onnx.export(
+        module,
+        dummy_input,
+        onnx_path,
+        input_names=["image"],
+        output_names=["logits"],
+        dynamic_axes={"image": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=opset,
+    )
+  logging.info(f"[classifiermodel.py] Exported densenet169 model to ONNX at {onnx_path}.")
+  return onnx_path
+
+def load_ml_onnx(onnx_path=ONNX_PATH, providers=None):
+  """
+  Load the ML model used for classification, run with ONNX Runtime instead of PyTorch. The model is exported to
+  ONNX first if there is no exported model yet.
+
+  Paramaters:
+  onnx_path: Path to the exported ONNX model.
+  providers: The ONNX Runtime execution providers. Defaults to CUDA if available, otherwise the CPU.
+
+  Returns:
+  classifier: The ML model, with the same predict() as the one returned by load_ml().
+  """
+  print("\n#-------------------- # Loading ML Classifier # --------------------#\n")
+  import onnxruntime as ort
+
+  try:
+    if not os.path.exists(onnx_path):
+      export_onnx(onnx_path)
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    # Use the GPU if ONNX Runtime was built with CUDA, otherwise the CPU
+    providers = providers or [provider for provider in ["CUDAExecutionProvider", "CPUExecutionProvider"] if provider in ort.get_available_providers()]
+    classifier = OnnxClassifier(ort.InferenceSession(onnx_path, sess_options=options, providers=providers))
+    logging.info(f"[classifiermodel.py] Finished loading densenet169 model with ONNX Runtime ({', '.join(providers)}).")
+  except Exception as e:
+    logging.error(f"[classifiermodel.py] An error occurred while loading densenet169 model with ONNX Runtime: {e}", exc_info=True)
+    raise
+  print("\n----> ML classifier model loaded successfully")
+  return classifier
+
 def load_ml():
   """
   Load the ML model used for classification.
@@ -35,8 +270,12 @@ def load_ml():
   densenet: The ML model.
   """
   print("\n#-------------------- # Loading ML Classifier # --------------------#\n")
+  from skorch import NeuralNetClassifier
+  from skorch.dataset import ValidSplit
+  from skorch.callbacks import LRScheduler, Checkpoint
+  from skorch.callbacks import Freezer, EarlyStopping
 
-  n_classes = 9
+  n_classes = len(CLASS_NAMES)
   batch_size = 128
   num_workers = mp.cpu_count()
 
@@ -58,31 +297,6 @@ def load_ml():
   except Exception as e:
     logging.error(f"[classifiermodel.py] An error occurred while initiating densenet169: {e}", exc_info=True)
 
-  # ... (import other necessary libraries) ...
-  try:
-    class DenseNet169(nn.Module):
-        def __init__(self, output_features, num_units=512, drop=0.5,
-                    num_units1=512, drop1=0.5):
-            super().__init__()
-            model = torchvision.models.densenet169(pretrained=True)
-            n_inputs = model.classifier.in_features
-            model.classifier = nn.Sequential(
-                                    nn.Linear(n_inputs, num_units),
-                                    nn.ReLU(),
-                                    nn.Dropout(p=drop),
-                                    nn.Linear(num_units, num_units1),
-                                    nn.ReLU(),
-                                    nn.Dropout(p=drop1),
-                                    nn.Linear(num_units1, output_features))
-            self.model = model
-
-        def forward(self, x):
-            return self.model(x)
-        
-        logging.info(f"[classifiermodel.py] Created densenet169 class.")
-  except Exception as e:
-    logging.error(f"[classifiermodel.py] An error occurred while creating densenet169 class: {e}", exc_info=True)
-  
   # NeuralNetClassifier for based on DenseNet169 with custom parameters
   try:
     densenet = NeuralNetClassifier(
@@ -116,7 +330,7 @@ def load_ml():
 
   try:
     densenet.initialize()  # Initialize the model before loading parameters
-    densenet.load_params(f_params='Sci2XML/app/backend/models/best_model_densenet169_sentence.pkl')
+    densenet.load_params(f_params=WEIGHTS_PATH)
     # Load the saved model
     global ML
     ML = densenet
@@ -126,6 +340,37 @@ def load_ml():
   print("\n----> ML classifier model loaded successfully")
   return densenet
 
+def preprocess_image(image):
+  """
+  Applies the same transformations to an image as during training.
+
+  Paramaters:
+  image: The image to be classified, as a PIL image.
+
+  Returns:
+  transformed_image: The transformed image as a tensor with a batch dimension, on the CPU.
+  """
+  import albumentations as A
+  import albumentations.pytorch
+
+  # Load the image
+  image = image.convert("RGB")  # Ensure the image is in RGB format
+
+  img_size = IMG_SIZE
+
+  # Define the same transformations used during training
+  data_transforms = A.Compose([
+      A.Resize(img_size, img_size),
+      A.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+      A.pytorch.transforms.ToTensorV2()
+  ])
+
+  # Apply transformations
+  transformed_image = data_transforms(image=np.array(image))["image"]
+
+  # Add a batch dimension
+  return transformed_image.unsqueeze(0)
+
 def call_ml(model, image):
   """
   Calls the ML model that will classify the image.
@@ -138,23 +383,7 @@ def call_ml(model, image):
   predicted_class_name: The name of the predicted class.
   """
   try:
-    # Load the image
-    image = image.convert("RGB")  # Ensure the image is in RGB format
-
-    img_size = 224
-
-    # Define the same transformations used during training
-    data_transforms = A.Compose([
-        A.Resize(img_size, img_size),
-        A.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
-        A.pytorch.transforms.ToTensorV2()
-    ])
-
-    # Apply transformations
-    transformed_image = data_transforms(image=np.array(image))["image"]
-
-    # Add a batch dimension
-    transformed_image = transformed_image.unsqueeze(0)
+    transformed_image = preprocess_image(image)
 
     # Move the image to the appropriate device (GPU or CPU)
     device = "cuda:0" if torch.cuda.is_available() else "cpu"
@@ -168,11 +397,23 @@ def call_ml(model, image):
     predicted_class = model.predict(transformed_image)
 
     # Get the class name
-    class_names = ['just_image', 'bar_chart', 'diagram', 'flow_chart', 'graph',
-                    'growth_chart', 'pie_chart', 'table', 'text_sentence']
-    predicted_class_name = class_names[predicted_class[0]]
+    predicted_class_name = CLASS_NAMES[predicted_class[0]]
     logging.info(f"[classifiermodel.py] Successfully predicted class.")
   except Exception as e:
     logging.error(f"[classifiermodel.py] An error occurred while predicting class: {e}", exc_info=True)
 
-  return predicted_class_name
\ No newline at end of file
+  return predicted_class_name
+
+def warmup(model):
+  """
+  Classifies a blank image, so that the one-time costs of the first request (kernel initialization, allocator growth)
+  are paid before a real figure arrives.
+
+  Paramaters:
+  model: The ML model.
+
+  Returns:
+  None
+  """
+  call_ml(model, Image.new("RGB", (224, 224), "white"))
+  logging.info(f"[classifiermodel.py] Finished warming up classifier.")
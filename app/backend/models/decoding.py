@@ -0,0 +1,100 @@
+import sys
+import logging
+
+import backend.metrics as metrics
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s: %(message)s',
+    force=True,
+    handlers=[
+        logging.FileHandler("app.log"),  # Log to a file named 'app.log'
+        logging.StreamHandler(sys.stdout)  # Also log to console
+    ]
+)
+
+# The decoding policies of the generative models (Sumen and UniChart):
+#  'beam' always uses beam search, 'greedy' always decodes greedily, and 'adaptive' decodes greedily first
+#  and only runs beam search when the greedy output fails a quality check.
+DECODING_POLICIES = ["beam", "greedy", "adaptive"]
+
+# The number of beams of beam search.
+NUM_BEAMS = 4
+
+# A greedy output whose tokens have a lower mean log-probability than this is decoded again with beam search.
+#  -0.3 is a geometric mean probability of about 0.74 per token.
+MIN_MEAN_LOGPROB = -0.3
+
+def mean_token_logprob(model, outputs):
+    """
+    Calculates the mean log-probability of the generated tokens of the first sequence.
+
+    Parameters:
+    model: The model which generated the outputs.
+    outputs: The output of model.generate(), with return_dict_in_generate=True and output_scores=True.
+
+    Returns:
+    (float): The mean log-probability, 0 if no tokens were generated.
+    """
+    transition_scores = model.compute_transition_scores(outputs.sequences, outputs.scores, normalize_logits=True)[0]
+    if len(transition_scores) == 0:
+        return 0.0
+    return float(transition_scores.float().mean())
+
+def latex_is_balanced(latex):
+    """
+    Checks if a LaTeX string has as many \\left as \\right commands and as many \\begin as \\end commands,
+    the same check as latex_validity() in the frontend.
+
+    Parameters:
+    latex (str): The formula in LaTeX format.
+
+    Returns:
+    (bool): True if the commands are balanced.
+    """
+    return latex.count(r"\begin") == latex.count(r"\end") and latex.count(r"\left") == latex.count(r"\right")
+
+def generate(name, policy, model, run, accept, min_mean_logprob=None, finished=None):
+    """
+    Generates an output with the given decoding policy. With the adaptive policy, the output is first decoded greedily,
+    which is roughly a quarter of the decoder work of beam search, and only decoded again with beam search if the
+    mean log-probability of the tokens is too low, or if accept() rejects the output.
+
+    Parameters:
+    name (str): The name of the model, used in the metrics, e.g. 'sumen'.
+    policy (str): One of DECODING_POLICIES.
+    model: The model, used to calculate the log-probabilities.
+    run (callable): Function which gets num_beams and output_scores, calls model.generate() with return_dict_in_generate=True and returns the outputs.
+    accept (callable): Function which gets the outputs of the greedy decoding and returns False if they are unreliable.
+    min_mean_logprob (float): The lowest mean log-probability of an accepted greedy output. Defaults to MIN_MEAN_LOGPROB.
+    finished (callable): Function which gets the outputs of the greedy decoding and returns False if they were cut off
+     by a token budget. Such outputs are returned without beam search, as beam search with the same budget would
+     be cut off as well, and the caller decodes again with a larger budget. None if there is no budget.
+
+    Returns:
+    The outputs of model.generate().
+    """
+    if policy not in DECODING_POLICIES:
+        logging.warning(f"[decoding.py] Unknown decoding policy '{policy}' for {name}, using beam search.")
+        policy = "beam"
+
+    if policy == "beam":
+        return run(num_beams=NUM_BEAMS, output_scores=False)
+
+    outputs = run(num_beams=1, output_scores=policy == "adaptive")
+    if policy == "greedy":
+        return outputs
+    if finished is not None and not finished(outputs):
+        logging.info(f"[decoding.py] Greedy output of {name} reached the token budget, leaving the retry to the caller.")
+        return outputs
+
+    if min_mean_logprob is None:
+        min_mean_logprob = MIN_MEAN_LOGPROB
+    mean_logprob = mean_token_logprob(model, outputs)
+    if mean_logprob >= min_mean_logprob and accept(outputs):
+        metrics.increment(f"decoding_greedy_accepted_{name}")
+        return outputs
+
+    metrics.increment(f"decoding_escalations_{name}")
+    logging.info(f"[decoding.py] Greedy output of {name} rejected (mean log-probability {mean_logprob:.3f}), decoding again with beam search.")
+    return run(num_beams=NUM_BEAMS, output_scores=False)
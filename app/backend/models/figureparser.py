@@ -2,6 +2,10 @@ import torch
 from PIL import Image
 from transformers import AutoModelForCausalLM, AutoTokenizer
 from io import BytesIO
+from collections import OrderedDict
+import threading
+import hashlib
+import backend.metrics as metrics
 
 import sys
 import logging
@@ -19,6 +23,121 @@ logging.basicConfig(
 # Determine the device to use: CUDA (GPU) if available, otherwise CPU
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
+class EncodedImageCache:
+    """
+    Keeps the images encoded by the vision encoder of Moondream2 in memory, so that several prompts against the same
+    image only run the encoder once. The images are identified by the hash of their pixels. When the encoded images
+    take more than the size limit, the least recently used ones are removed. An encoded image holds the key/value
+    cache of the image tokens for every layer, which is in the order of 100 MB, on the device of the model.
+    """
+
+    def __init__(self, max_mb=512):
+        """
+        Parameters:
+        max_mb (int): The maximum total size of the encoded images in megabytes. 0 turns the cache off.
+        """
+        self.max_bytes = max_mb * 1024 * 1024
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.model_id = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(image):
+        """
+        Creates a cache key from the pixels of an image.
+
+        Parameters:
+        image (PIL.Image): The image.
+
+        Returns:
+        (str): The cache key.
+        """
+        return hashlib.sha256(f"{image.mode}{image.size}".encode("utf-8") + image.tobytes()).hexdigest()
+
+    @staticmethod
+    def size_of(encoded):
+        """
+        Adds up the size of the tensors of an encoded image.
+
+        Parameters:
+        encoded: The encoded image, as returned by model.encode_image().
+
+        Returns:
+        (int): The size in bytes.
+        """
+        tensors = []
+        pending = [getattr(encoded, "caches", encoded)]
+        while pending:
+            value = pending.pop()
+            if torch.is_tensor(value):
+                tensors.append(value)
+            elif isinstance(value, (list, tuple)):
+                pending.extend(value)
+        return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+    def get(self, model, key):
+        """
+        Gets an encoded image from the cache. The cache is emptied when a different model is used, e.g. after the
+        model was unloaded and loaded again.
+
+        Parameters:
+        model: The Moondream2 model.
+        key (str): The cache key.
+
+        Returns:
+        The encoded image, or None if it is not in the cache.
+        """
+        with self.lock:
+            if self.model_id != id(model):
+                self._clear()
+                self.model_id = id(model)
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+            return None
+
+    def set(self, key, encoded):
+        """
+        Stores an encoded image, and removes the least recently used ones if the cache is too big.
+
+        Parameters:
+        key (str): The cache key.
+        encoded: The encoded image.
+
+        Returns:
+        None
+        """
+        size = self.size_of(encoded)
+        with self.lock:
+            if size > self.max_bytes or key in self.entries:
+                return
+            self.entries[key] = (encoded, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, removed_size) = self.entries.popitem(last=False)
+                self.total_bytes -= removed_size
+
+    def clear(self):
+        """
+        Removes every encoded image, e.g. when the model is unloaded.
+
+        Returns:
+        None
+        """
+        with self.lock:
+            self._clear()
+
+    def _clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+encoded_image_cache = EncodedImageCache()
+
 def load():
     """
     Load the Moondream2 model and tokenizer.
@@ -51,3 +170,73 @@ def load():
     except Exception as e:
         logging.error(f"[figureparser.py] Failed to load Moondream2 model or tokenizer: {e}", exc_info=True)
         return None, None
+
+def warmup(model, max_tokens=8):
+    """
+    Runs a blank image through Moondream2, so that the one-time costs of the first request (kernel initialization,
+    tokenizer setup, allocator growth) are paid before a real figure arrives. Only a few tokens are generated.
+
+    Parameters:
+        model (torch.nn.Module): The loaded Moondream2 model.
+        max_tokens (int): The number of tokens to generate.
+
+    Returns:
+        None
+    """
+    image = Image.new("RGB", (378, 378), "white")
+    try:
+        model.query(image, "Describe this image.", settings={"max_tokens": max_tokens})
+    except TypeError:
+        # Revisions of Moondream2 without generation settings
+        model.query(image, "Describe this image.")
+    logging.info(f"[figureparser.py] Finished warming up Moondream2.")
+
+def encode_image(model, image):
+    """
+    Encodes an image with the vision encoder of Moondream2, or gets it from the cache if it was encoded before.
+
+    Parameters:
+        model (torch.nn.Module): The loaded Moondream2 model.
+        image (PIL.Image): The image.
+
+    Returns:
+        The encoded image, which can be given to model.query() instead of the image. The image itself if the model
+        can't encode images separately or the cache is turned off.
+    """
+    if encoded_image_cache.max_bytes <= 0 or not hasattr(model, "encode_image"):
+        return image
+
+    key = encoded_image_cache.make_key(image)
+    encoded = encoded_image_cache.get(model, key)
+    if encoded is not None:
+        metrics.increment("moondream_encode_cache_hits")
+        return encoded
+
+    metrics.increment("moondream_encode_cache_misses")
+    with torch.no_grad():
+        encoded = model.encode_image(image)
+    encoded_image_cache.set(key, encoded)
+    return encoded
+
+def query(model, image, prompt, max_tokens=None):
+    """
+    Asks Moondream2 a question about an image. The image is only encoded the first time it is asked about.
+
+    Parameters:
+        model (torch.nn.Module): The loaded Moondream2 model.
+        image (PIL.Image): The image.
+        prompt (str): The question or instruction.
+        max_tokens (int): The most tokens the answer may have. The time of the query grows with the length of the answer.
+            Defaults to the limit of the model.
+
+    Returns:
+        (dict): The result of model.query(), with the answer in 'answer'.
+    """
+    encoded = encode_image(model, image)
+    if max_tokens is None:
+        return model.query(encoded, prompt)
+    try:
+        return model.query(encoded, prompt, settings={"max_tokens": max_tokens})
+    except TypeError:
+        # Revisions of Moondream2 without generation settings
+        return model.query(encoded, prompt)
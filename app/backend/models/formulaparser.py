@@ -1,5 +1,9 @@
 import torch
+from PIL import Image
 from transformers import DonutProcessor, VisionEncoderDecoderModel, AutoProcessor
+import backend.models.quantization as quantization
+import backend.models.decoding as decoding
+import backend.metrics as metrics
 
 import sys
 import logging
@@ -17,13 +21,24 @@ logging.basicConfig(
 # Determine the computation device: use GPU (CUDA) if available; otherwise, default to CPU
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-def load_sumen():
+# The token budget of a formula is predicted from the size of its image and the length of GROBID's raw text of it.
+#  The pixel sizes are for the crops made in classifier.process_formulas(), which scales the PDF coordinates by 2.775.
+CHAR_WIDTH_PX = 16  # The width of a character of a formula
+LINE_HEIGHT_PX = 45  # The height of a line of a formula
+TOKENS_PER_CHAR = 1.5  # LaTeX tokens per visible character, as commands like \frac and braces add tokens
+BUDGET_MARGIN = 1.5  # The predicted length is multiplied by this, so that few formulas are cut off
+MIN_BUDGET = 32  # The budgets are rounded up to powers of two from this, so that formulas of similar length get the same budget
+
+def load_sumen(quantize=False):
     """
     Load the Sumen model and processor.
 
     Sumen is an OCR (Optical Character Recognition) model optimized for document understanding tasks.
     This function loads the pre-trained model and the associated processor for handling image inputs.
 
+    Parameters:
+        quantize (bool): Quantize the Linear layers to int8 for faster inference on CPU.
+
     Returns:
         model (VisionEncoderDecoderModel): Pre-trained Sumen OCR model.
         processor (AutoProcessor): Processor for image preprocessing and text tokenization.
@@ -36,6 +51,8 @@ def load_sumen():
         # Load the model and move it to the appropriate device
         sumen_model = VisionEncoderDecoderModel.from_pretrained("hoang-quoc-trung/sumen-base").to(device)
         sumen_processor = AutoProcessor.from_pretrained("hoang-quoc-trung/sumen-base")
+        if quantize:
+            sumen_model = quantization.quantize_dynamic_int8(sumen_model, "Sumen")
 
         logging.info(f"[formulaparser.py] Successfully loaded formulaparser, Sumen.")
         print("\n----> Sumen model loaded successfully!")
@@ -45,12 +62,43 @@ def load_sumen():
         logging.error(f"[formulaparser.py] Failed to load Sumen model or processor: {e}", exc_info=True)
         return None, None
 
-def run_sumen_ocr(image):
+def predict_max_length(image, text=""):
+    """
+    Predicts a token budget for a formula, so that short formulas don't get the maximum length of the model.
+    The length is estimated both from the image, as the number of characters which fit in it, and from GROBID's
+    raw text of the formula, and the larger one is used. The budget is rounded up to a power of two.
+
+    Parameters:
+    image (PIL.Image): The image of the formula, cropped from the page as in classifier.process_formulas().
+    text (str): GROBID's raw text of the formula. Optional.
+
+    Returns:
+    max_length (int): The token budget, at most the maximum length of the model.
+    """
+    width, height = image.size
+    lines = max(1, round(height / LINE_HEIGHT_PX))
+    image_chars = lines * width / CHAR_WIDTH_PX
+    text_chars = len("".join(text.split()))
+
+    predicted = max(image_chars, text_chars) * TOKENS_PER_CHAR * BUDGET_MARGIN
+    max_length = MIN_BUDGET
+    while max_length < predicted:
+        max_length *= 2
+    return min(max_length, sumen_model.decoder.config.max_length)
+
+def run_sumen_ocr(image, decoding_policy="beam", max_length=None, length_budget=False, text=""):
     """
     Perform OCR using the Sumen model on a given image.
 
     Parameters:
     image (PIL.Image or tensor): Input image to be processed by the OCR model.
+    decoding_policy (str): 'beam', 'greedy', or 'adaptive' to decode greedily and only use beam search if the
+     formula is unlikely or has unbalanced \\left/\\right or \\begin/\\end. See backend/models/decoding.py.
+    max_length (int): The token budget, e.g. from predict_max_length(). Formulas which reach it without being finished
+     are decoded again with the maximum length of the model. Defaults to the maximum length of the model.
+    length_budget (bool): Predict the token budget with predict_max_length() when max_length is not given. The budget
+     is predicted here rather than by the caller, so that with model workers the image is only sent once.
+    text (str): GROBID's raw text of the formula, for predict_max_length(). Optional.
 
     Returns:
     clean_latex (str): The extracted text in LaTeX format, with unnecessary tokens removed.    
@@ -65,18 +113,45 @@ def run_sumen_ocr(image):
         task_prompt = sumen_processor.tokenizer.bos_token
         decoder_input_ids = sumen_processor.tokenizer(task_prompt, add_special_tokens=False, return_tensors="pt").input_ids
 
-        with torch.no_grad():
-            outputs = sumen_model.generate(
-                pixel_values,
-                decoder_input_ids=decoder_input_ids.to(device),
-                max_length=sumen_model.decoder.config.max_length,
-                pad_token_id=sumen_processor.tokenizer.pad_token_id,
-                eos_token_id=sumen_processor.tokenizer.eos_token_id,
-                use_cache=True,
-                num_beams=4,
-                bad_words_ids=[[sumen_processor.tokenizer.unk_token_id]],
-                return_dict_in_generate=True,
-            )
+        model_max_length = sumen_model.decoder.config.max_length
+        if max_length is None and length_budget:
+            max_length = predict_max_length(image, text)
+        budget = min(max_length or model_max_length, model_max_length)
+
+        def generate(max_length):
+            def run(num_beams, output_scores):
+                with torch.no_grad():
+                    return sumen_model.generate(
+                        pixel_values,
+                        decoder_input_ids=decoder_input_ids.to(device),
+                        max_length=max_length,
+                        pad_token_id=sumen_processor.tokenizer.pad_token_id,
+                        eos_token_id=sumen_processor.tokenizer.eos_token_id,
+                        use_cache=True,
+                        num_beams=num_beams,
+                        bad_words_ids=[[sumen_processor.tokenizer.unk_token_id]],
+                        return_dict_in_generate=True,
+                        output_scores=output_scores,
+                    )
+
+            def accept(outputs):
+                return decoding.latex_is_balanced(sumen_processor.tokenizer.batch_decode(outputs.sequences)[0])
+
+            # Only a budget below the maximum length can cut a formula off early, see finished() below
+            return decoding.generate("sumen", decoding_policy, sumen_model, run, accept,
+                                     finished=finished if max_length < model_max_length else None)
+
+        def finished(outputs):
+            return bool((outputs.sequences[0] == sumen_processor.tokenizer.eos_token_id).any())
+
+        outputs = generate(budget)
+
+        # A formula without an end token was cut off by the budget, so it is decoded again with the full length.
+        #  With the adaptive policy a cut-off greedy output comes straight here, instead of being decoded with beam search at the budget first.
+        if budget < model_max_length and not finished(outputs):
+            metrics.increment("sumen_length_budget_retries")
+            logging.info(f"[formulaparser.py] Formula reached the token budget of {budget}, decoding again with {model_max_length}.")
+            outputs = generate(model_max_length)
 
         clean_latex = sumen_processor.tokenizer.batch_decode(outputs.sequences)[0]
         logging.info(f"[formulaparser.py] Finished performing OCR with Sumen.")
@@ -85,3 +160,30 @@ def run_sumen_ocr(image):
     except Exception as e:
         logging.error(f"[formulaparser.py] An error occured while running Sumen OCR: {e}", exc_info=True)
         return ""
+
+def warmup(max_new_tokens=8):
+    """
+    Runs a blank image through the Sumen model, so that the one-time costs of the first request (kernel initialization,
+    tokenizer setup, allocator growth) are paid before a real formula arrives. Only a few tokens are generated.
+
+    Parameters:
+    max_new_tokens (int): The number of tokens to generate.
+
+    Returns:
+    None
+    """
+    image = Image.new("RGB", (384, 96), "white")
+    pixel_values = sumen_processor.image_processor(image, return_tensors="pt").pixel_values.to(device)
+    decoder_input_ids = sumen_processor.tokenizer(sumen_processor.tokenizer.bos_token, add_special_tokens=False, return_tensors="pt").input_ids
+
+    with torch.no_grad():
+        sumen_model.generate(
+            pixel_values,
+            decoder_input_ids=decoder_input_ids.to(device),
+            max_new_tokens=max_new_tokens,
+            pad_token_id=sumen_processor.tokenizer.pad_token_id,
+            eos_token_id=sumen_processor.tokenizer.eos_token_id,
+            use_cache=True,
+            num_beams=4,
+        )
+    logging.info(f"[formulaparser.py] Finished warming up Sumen.")
@@ -0,0 +1,40 @@
+import torch
+import torch.nn as nn
+
+import sys
+import logging
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s: %(message)s',
+    force=True,
+    handlers=[
+        logging.FileHandler("app.log"),  # Log to a file named 'app.log'
+        logging.StreamHandler(sys.stdout)  # Also log to console
+    ]
+)
+
+def quantize_dynamic_int8(model, name):
+    """
+    Quantizes the Linear layers of a model to int8 with dynamic quantization: the weights are stored as int8, and the
+    activations are quantized on the fly for every input. This makes the Linear layers faster and smaller on CPU,
+    at the cost of a small loss in accuracy, see evaluation/quantization.
+
+    Dynamic quantization only runs on CPU, so models on a GPU are returned unchanged.
+
+    Parameters:
+        model (torch.nn.Module): The model, in place.
+        name (str): The name of the model, for the log.
+
+    Returns:
+        model (torch.nn.Module): The quantized model.
+    """
+    if any(parameter.is_cuda for parameter in model.parameters()):
+        logging.info(f"[quantization.py] {name} runs on GPU, skipping int8 quantization.")
+        return model
+
+    # torch.ao.quantization is the current location, torch.quantization the location before PyTorch 1.10
+    quantization = getattr(torch, "ao", torch).quantization
+    model = quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    logging.info(f"[quantization.py] Quantized the Linear layers of {name} to int8.")
+    return model
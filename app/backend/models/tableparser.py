@@ -1,8 +1,14 @@
 import xml.etree.ElementTree as ET
 import pdfplumber
 import re
+import io
+import importlib.util
+import os
 import logging
 import sys
+from tempfile import NamedTemporaryFile
+
+import backend.diskcache as diskcache
 
 # Configure logging to store logs in a file
 logging.basicConfig(
@@ -14,7 +20,187 @@ logging.basicConfig(
     ]
 )
 
-def extract_tables_from_pdf(pdf_path, max_margin=50):
+# Matches a GROBID table figure, from its opening <figure type="table"> tag to the closing </figure> tag.
+TABLE_FIGURE_PATTERN = r'<figure[^>]*\s+type="table"[^>]*>.*?</figure>'
+
+TABLE_FIGURE_REGEX = re.compile(TABLE_FIGURE_PATTERN, flags=re.DOTALL)
+
+def collect_table_context(words, bbox, max_margin=50):
+    """
+    Collects the words right above and right below a table, which are used as context for the table.
+
+    Parameters:
+        words (list[dict]): The words on the page, as dicts with the keys 'x0', 'top', 'bottom' and 'text'.
+        bbox (tuple): The bounding box (x0, top, x1, bottom) of the table.
+        max_margin (int, optional): Maximum margin for capturing text context near the table. Defaults to 50.
+
+    Returns:
+        tuple: A tuple (above_text, below_text) with the words above and below the table joined by spaces.
+    """
+    x0, y0, x1, y1 = bbox
+    words_above = []
+    words_below = []
+    for word in words:
+        word_x0, word_y0, word_y1 = word['x0'], word['top'], word['bottom']
+        # Check if the word is above the table and within the max margin
+        if word_y1 <= y0 and x0 <= word_x0 <= x1:
+            distance = y0 - word_y1
+            if distance <= max_margin:
+                words_above.append(word['text'])
+        # Check if the word is below the table and within the max margin
+        if word_y0 >= y1 and x0 <= word_x0 <= x1:
+            distance = word_y0 - y1
+            if distance <= max_margin:
+                words_below.append(word['text'])
+
+    return " ".join(words_above), " ".join(words_below)
+
+def extract_tables_pdfplumber(pdf_path, max_margin=50):
+    """
+    Table extraction backend based on pdfplumber. This is the default backend.
+
+    Every table backend takes the path to a PDF file and the context margin, and returns a list of dicts with the keys:
+        - 'page' (int): The page number of the table, starting at 1.
+        - 'bbox' (tuple or None): The bounding box (x0, top, x1, bottom) of the table in PDF points.
+        - 'rows' (list[list[str or None]]): The cells of the table, row by row.
+        - 'above' (str): The text right above the table.
+        - 'below' (str): The text right below the table.
+
+    Parameters:
+        pdf_path (str): Path to the PDF file.
+        max_margin (int, optional): Maximum margin for capturing text context near the table. Defaults to 50.
+
+    Returns:
+        list[dict]: The tables found in the PDF, in reading order.
+    """
+    tables = []
+    # Open the PDF file using pdfplumber
+    with pdfplumber.open(pdf_path) as pdf:
+        # Iterate over each page in the PDF
+        for page_number, page in enumerate(pdf.pages, start=1):
+            # Find the tables once per page. page.extract_tables() would do the same search again.
+            found_tables = page.find_tables()
+            if not found_tables:
+                continue
+
+            # The words on the page are the same for every table, so only extract them once
+            words = page.extract_words()
+            for found_table in found_tables:
+                above_text, below_text = collect_table_context(words, found_table.bbox, max_margin)
+                tables.append({
+                    "page": page_number,
+                    "bbox": found_table.bbox,
+                    "rows": found_table.extract(),
+                    "above": above_text,
+                    "below": below_text
+                })
+
+    return tables
+
+def extract_tables_pymupdf(pdf_path, max_margin=50):
+    """
+    Table extraction backend based on PyMuPDF. Only available if PyMuPDF is installed.
+    Returns the same structure as extract_tables_pdfplumber().
+
+    Parameters:
+        pdf_path (str): Path to the PDF file.
+        max_margin (int, optional): Maximum margin for capturing text context near the table. Defaults to 50.
+
+    Returns:
+        list[dict]: The tables found in the PDF, in reading order.
+    """
+    import pymupdf
+
+    tables = []
+    with pymupdf.open(pdf_path) as pdf:
+        for page_number, page in enumerate(pdf, start=1):
+            found_tables = page.find_tables().tables
+            if not found_tables:
+                continue
+
+            # Convert the PyMuPDF words (x0, y0, x1, y1, text, ...) to the same format as pdfplumber uses
+            words = [{"x0": word[0], "top": word[1], "bottom": word[3], "text": word[4]} for word in page.get_text("words")]
+            for found_table in found_tables:
+                above_text, below_text = collect_table_context(words, tuple(found_table.bbox), max_margin)
+                tables.append({
+                    "page": page_number,
+                    "bbox": tuple(found_table.bbox),
+                    "rows": found_table.extract(),
+                    "above": above_text,
+                    "below": below_text
+                })
+
+    return tables
+
+# The available table extraction backends. The benchmark in evaluation/tables/Code/tableBackendBenchmark.py
+# can be used to compare their speed and accuracy before choosing one for a deployment.
+TABLE_BACKENDS = {"pdfplumber": extract_tables_pdfplumber}
+DEFAULT_TABLE_BACKEND = "pdfplumber"
+
+# PyMuPDF is only imported when its backend is used, as importing it is slow
+if importlib.util.find_spec("pymupdf") is not None:
+    TABLE_BACKENDS["pymupdf"] = extract_tables_pymupdf
+else:
+    logging.info(f"[tableparser.py] PyMuPDF is not installed, the pymupdf table backend is not available.")
+
+def tables_to_xml(tables):
+    """
+    Converts the tables returned by a table backend to the XML string that is inserted into the GROBID XML.
+
+    Parameters:
+        tables (list[dict]): The tables returned by a table backend.
+
+    Returns:
+        str: The XML string of the tables.
+    """
+    # Create the root element for the XML structure
+    root = ET.Element("pdf_tables")
+
+    for table_count, table in enumerate(tables, start=1):
+        page_number = table["page"]
+        # Create an XML element for the table with page and table number attributes
+        table_node = ET.SubElement(root, "table", {
+            "page": str(page_number),
+            "table_number": str(table_count)
+        })
+
+        # Add the bounding box of the table if available
+        if table["bbox"]:
+            x0, y0, x1, y1 = table["bbox"]
+            width = x1 - x0
+            height = y1 - y0
+            coordinates_text = f"{page_number},{x0:.2f},{y0:.2f},{width:.2f},{height:.2f}"
+        else:
+            coordinates_text = f"{page_number},No coordinates found"
+
+        # Add coordinates information as a child element
+        coordinates_node = ET.SubElement(table_node, "coordinates")
+        coordinates_node.text = coordinates_text
+
+        # Create context text from the words above and below the table
+        context = f"Text above table: {table['above']}".strip()
+        if table["below"]:
+            context += f" | Text under table: {table['below']}"
+        
+        # Add the context as a child element
+        context_node = ET.SubElement(table_node, "context")
+        context_node.text = context
+
+        # Add each row of the table as an XML element
+        for row in table["rows"]:
+            row_node = ET.SubElement(table_node, "row")
+            # Add each cell in the row as an XML element
+            for cell in row:
+                cell_text = str(cell) if cell is not None and cell.strip() else "NAN"
+                cell_node = ET.SubElement(row_node, "cell")
+                cell_node.text = cell_text
+
+    # Convert the XML tree to a string
+    xml_str = ET.tostring(root, encoding="utf-8").decode("utf-8")
+    # Add a line break before each table element for better readability
+    return xml_str.replace('<table', '\n<table')
+
+def extract_tables_from_pdf(pdf_path, max_margin=50, backend=DEFAULT_TABLE_BACKEND, raise_errors=False):
     """
     Extracts tables from the given PDF file and returns an XML string representing the tables,
     along with the count of tables found.
@@ -22,92 +208,69 @@ def extract_tables_from_pdf(pdf_path, max_margin=50):
     Parameters:
         pdf_path (str): Path to the PDF file.
         max_margin (int, optional): Maximum margin for capturing text context near the table. Defaults to 50.
+        backend (str, optional): Name of the table extraction backend in TABLE_BACKENDS. Defaults to pdfplumber.
+        raise_errors (bool, optional): Raise the error instead of returning it as a message. Defaults to False.
 
     Returns:
         tuple: A tuple (xml_str, table_count) where xml_str is the XML string of extracted tables,
                and table_count is the number of tables extracted. In case of an error, returns an error message and 0.
+
+    Raises:
+        Exception: Any error of the backend, if raise_errors is True.
     """
     try:
-        # Open the PDF file using pdfplumber
-        with pdfplumber.open(pdf_path) as pdf:
-            # Create the root element for the XML structure
-            root = ET.Element("pdf_tables")
-            table_count = 0
-
-            # Iterate over each page in the PDF
-            for page_number, page in enumerate(pdf.pages, start=1):
-                tables = page.extract_tables()
-                # Check if any tables are found on the current page
-                if tables:
-                    # Iterate over each table found on the page
-                    for table_index, table in enumerate(tables, start=1):
-                        table_count += 1
-                        # Create an XML element for the table with page and table number attributes
-                        table_node = ET.SubElement(root, "table", {
-                            "page": str(page_number),
-                            "table_number": str(table_count)
-                        })
-
-                        # Retrieve the bounding box for the table if available
-                        table_bbox = page.find_tables()[table_index - 1].bbox if page.find_tables() else None
-                        if table_bbox:
-                            x0, y0, x1, y1 = table_bbox
-                            width = x1 - x0
-                            height = y1 - y0
-                            coordinates_text = f"{page_number},{x0:.2f},{y0:.2f},{width:.2f},{height:.2f}"
-                        else:
-                            coordinates_text = f"{page_number},No coordinates found"
-
-                        # Add coordinates information as a child element
-                        coordinates_node = ET.SubElement(table_node, "coordinates")
-                        coordinates_node.text = coordinates_text
-
-                        # Capture text context from above and below the table
-                        words_above = []
-                        words_below = []
-                        for word in page.extract_words():
-                            word_x0, word_y0, word_x1, word_y1 = word['x0'], word['top'], word['x1'], word['bottom']
-                            # Check if the word is above the table and within the max margin
-                            if word_y1 <= y0 and x0 <= word_x0 <= x1:
-                                distance = y0 - word_y1
-                                if distance <= max_margin:
-                                    words_above.append(word['text'])
-                            # Check if the word is below the table and within the max margin
-                            if word_y0 >= y1 and x0 <= word_x0 <= x1:
-                                distance = word_y0 - y1
-                                if distance <= max_margin:
-                                    words_below.append(word['text'])
-
-                        # Create context text from the collected words
-                        above_text = " ".join(words_above) if words_above else ""
-                        below_text = " ".join(words_below) if words_below else ""
-                        context = f"Text above table: {above_text}".strip()
-                        if below_text:
-                            context += f" | Text under table: {below_text}"
-                        
-                        # Add the context as a child element
-                        context_node = ET.SubElement(table_node, "context")
-                        context_node.text = context
-
-                        # Add each row of the table as an XML element
-                        for row in table:
-                            row_node = ET.SubElement(table_node, "row")
-                            # Add each cell in the row as an XML element
-                            for cell in row:
-                                cell_text = str(cell) if cell is not None and cell.strip() else "NAN"
-                                cell_node = ET.SubElement(row_node, "cell")
-                                cell_node.text = cell_text
-
-            # Convert the XML tree to a string
-            xml_str = ET.tostring(root, encoding="utf-8").decode("utf-8")
-            # Add a line break before each table element for better readability
-            xml_str = xml_str.replace('<table', '\n<table')
-        
-            return xml_str, table_count
+        if backend not in TABLE_BACKENDS:
+            raise ValueError(f"Unknown table backend '{backend}'. Available backends: {', '.join(TABLE_BACKENDS)}")
+
+        tables = TABLE_BACKENDS[backend](pdf_path, max_margin)
+        logging.info(f"[tableparser.py] Extracted {len(tables)} tables with the {backend} backend.")
+        return tables_to_xml(tables), len(tables)
     except Exception as e:
+        if raise_errors:
+            raise
         # In case of an error, return the error message and table count as 0
         return f"Error processing {pdf_path}: {e}", 0
 
+def extract_tables_from_pdf_cached(pdf_bytes, cache, max_margin=50, backend=DEFAULT_TABLE_BACKEND):
+    """
+    Extracts tables from the given PDF content like extract_tables_from_pdf(), but first looks in the cache.
+    The cache key is the SHA-256 hash of the PDF content together with the extraction parameters, so the same PDF
+    is only parsed once, no matter how many times it is sent to the API.
+
+    Parameters:
+        pdf_bytes (bytes): The content of the PDF file.
+        cache (DiskCache): The cache for the extracted tables.
+        max_margin (int, optional): Maximum margin for capturing text context near the table. Defaults to 50.
+        backend (str, optional): Name of the table extraction backend in TABLE_BACKENDS. Defaults to pdfplumber.
+
+    Returns:
+        tuple: A tuple (xml_str, table_count) where xml_str is the XML string of extracted tables,
+               and table_count is the number of tables extracted. In case of an error, returns an error message and 0.
+    """
+    key = cache.make_key(diskcache.hash_bytes(pdf_bytes), backend, max_margin)
+    cached = cache.get(key)
+    if cached is not None:
+        logging.info(f"[tableparser.py] Found {cached['table_count']} tables in the cache.")
+        return cached["xml"], cached["table_count"]
+
+    # Save the PDF file temporarily, as the backends read the PDF from a path
+    with NamedTemporaryFile(delete=False, suffix=".pdf") as temp_pdf:
+        temp_pdf.write(pdf_bytes)
+        pdf_path = temp_pdf.name
+
+    try:
+        xml_str, table_count = extract_tables_from_pdf(pdf_path, max_margin, backend=backend, raise_errors=True)
+    except Exception as e:
+        # Errors are returned as a message with 0 tables, like extract_tables_from_pdf(), and are not cached
+        logging.error(f"[tableparser.py] An error occurred while extracting tables: {e}", exc_info=True)
+        return f"Error processing {pdf_path}: {e}", 0
+    finally:
+        # Remove the temporary file
+        os.remove(pdf_path)
+
+    cache.set(key, {"xml": xml_str, "table_count": table_count})
+    return xml_str, table_count
+
 def remove_tables_from_grobid_xml(grobid_file):
     """
     Removes existing table figures from the GROBID XML file and returns the updated XML content
@@ -125,7 +288,7 @@ def remove_tables_from_grobid_xml(grobid_file):
     # File is automatically closed after exiting the 'with' block
     
     # Find all table figure elements in the GROBID XML
-    matches = list(re.finditer(r'<figure[^>]*\s+type="table"[^>]*>.*?</figure>', grobid_content, flags=re.DOTALL))
+    matches = list(re.finditer(TABLE_FIGURE_PATTERN, grobid_content, flags=re.DOTALL))
     
     if matches:
         # Get the position of the first table found
@@ -134,7 +297,7 @@ def remove_tables_from_grobid_xml(grobid_file):
         first_table_position = None
     
     # Remove all table figure elements from the GROBID XML
-    updated_content = re.sub(r'<figure[^>]*\s+type="table"[^>]*>.*?</figure>', '', grobid_content, flags=re.DOTALL)
+    updated_content = re.sub(TABLE_FIGURE_PATTERN, '', grobid_content, flags=re.DOTALL)
     
     removed_tables = len(matches)
     logging.info(f"[tableparser.py]{removed_tables} tables removed from {grobid_file}.")
@@ -155,11 +318,7 @@ def insert_pdfplumber_content(grobid_xml, pdfplumber_xml, insert_position):
         str: The final GROBID XML content with the pdfplumber tables inserted.
     """
     # Create a section to mark the beginning and end of the inserted tables
-    table_section = (
-        "\n<!-- ======== START: Tables from pdfplumber ======== -->\n"
-        f"{pdfplumber_xml}\n"
-        "<!-- ======== END: Tables from pdfplumber ======== -->\n"
-    )
+    table_section = create_table_section(pdfplumber_xml)
 
     # Insert the table section at the specified position or append if no position is provided
     if insert_position is not None:
@@ -187,4 +346,100 @@ def remove_empty_lines(xml_content):
     Returns:
         str: The XML content without any empty lines.
     """
-    return "\n".join([line for line in xml_content.splitlines() if line.strip()])
\ No newline at end of file
+    return "\n".join([line for line in xml_content.splitlines() if line.strip()])
+
+def create_table_section(pdfplumber_xml):
+    """
+    Wraps the pdfplumber XML content in comments marking the beginning and end of the inserted tables.
+
+    Parameters:
+        pdfplumber_xml (str): The XML content extracted from the PDF.
+
+    Returns:
+        str: The table section to be inserted into the GROBID XML.
+    """
+    return (
+        "\n<!-- ======== START: Tables from pdfplumber ======== -->\n"
+        f"{pdfplumber_xml}\n"
+        "<!-- ======== END: Tables from pdfplumber ======== -->\n"
+    )
+
+def splice_tables_into_grobid_xml(grobid_content, pdfplumber_xml):
+    """
+    Removes the table figures from the GROBID XML and inserts the pdfplumber XML content in a single pass.
+    Gives the same result as calling remove_tables_from_grobid_xml(), insert_pdfplumber_content() and
+    remove_empty_lines() after each other, but only scans the GROBID XML once and writes everything into
+    one output buffer instead of copying the whole document at every step.
+
+    The pdfplumber content is inserted at the position of the first removed table. If there are no tables
+    it is inserted before the first closing </TEI> tag, or appended at the end if that tag is missing too.
+    Only then is the XML searched a second time, for the </TEI> tag.
+
+    Parameters:
+        grobid_content (str): The GROBID XML content.
+        pdfplumber_xml (str): The XML content extracted from the PDF.
+
+    Returns:
+        tuple: A tuple (final_xml, removed_tables) where final_xml is the GROBID XML with the pdfplumber tables
+               inserted and without empty lines, and removed_tables is the number of table figures removed.
+    """
+    output = io.StringIO()
+    table_section = create_table_section(pdfplumber_xml)
+
+    # Text after the last line break written so far. Empty lines can only be detected once the whole line is known,
+    # and a line might be split between the text before and after a removed table.
+    pending_line = ""
+    wrote_line = False
+
+    def write_line(line):
+        nonlocal wrote_line
+        # Only keep lines with content, and separate them with newlines like remove_empty_lines() does
+        if line.strip():
+            if wrote_line:
+                output.write("\n")
+            output.write(line)
+            wrote_line = True
+
+    def write(text):
+        nonlocal pending_line
+        # Split with str.splitlines() like remove_empty_lines(), so '\r', '\x0c' etc. also end a line
+        lines = (pending_line + text).splitlines(keepends=True)
+        pending_line = ""
+        # Keep an unfinished last line for later, and a last line ending with '\r' too, which might be the start of '\r\n'
+        if lines and (lines[-1].endswith("\r") or lines[-1].splitlines()[0] == lines[-1]):
+            pending_line = lines.pop()
+        for line in lines:
+            write_line(line.splitlines()[0])
+
+    matches = TABLE_FIGURE_REGEX.finditer(grobid_content)
+    first_match = next(matches, None)
+
+    removed_tables = 0
+    if first_match is not None:
+        # Insert the tables at the first table figure, and drop every table figure
+        write(grobid_content[:first_match.start()])
+        write(table_section)
+        position = first_match.end()
+        removed_tables = 1
+        for match in matches:
+            write(grobid_content[position:match.start()])
+            position = match.end()
+            removed_tables += 1
+        write(grobid_content[position:])
+    else:
+        # No table figure found, adding the tables before the closing </TEI> tag, or to the end of document:
+        tei_position = grobid_content.find("</TEI>")
+        if tei_position != -1:
+            write(grobid_content[:tei_position])
+            write(table_section)
+            write(grobid_content[tei_position:])
+        else:
+            write(grobid_content)
+            write("\n" + table_section)
+
+    # Flush the last line, which is not followed by a line break
+    for line in pending_line.splitlines():
+        write_line(line)
+
+    logging.info(f"[tableparser.py] {removed_tables} tables removed and pdfplumber tables inserted in a single pass.")
+    return output.getvalue(), removed_tables
@@ -0,0 +1,507 @@
+import os
+import sys
+import time
+import queue
+import logging
+import itertools
+import threading
+import importlib
+import traceback
+import multiprocessing
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import backend.grobidclient as grobidclient
+import backend.metrics as metrics
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s: %(message)s',
+    force=True,
+    handlers=[
+        logging.FileHandler("app.log"),  # Log to a file named 'app.log'
+        logging.StreamHandler(sys.stdout)  # Also log to console
+    ]
+)
+
+envdict = grobidclient.get_envdict()
+
+# Run every model in its own worker process, instead of in the process of the API. Can be set with model_workers in the .env file.
+WORKERS_ENABLED = envdict.get("model_workers", "False") == "True"
+
+# The number of torch threads of each worker, either 'auto' or per model, comma-separated, e.g. 'sumen=2,unichart=4'.
+#  Can be set with worker_threads in the .env file. 'auto' gives each worker as many threads as it has cores.
+WORKER_THREADS = envdict.get("worker_threads", "auto")
+
+# The cores each worker runs on, either 'auto' or per model, comma-separated, e.g. 'sumen=0-1,unichart=2-5'.
+#  Can be set with worker_cpus in the .env file. 'auto' splits the cores of the machine evenly between the workers.
+WORKER_CPUS = envdict.get("worker_cpus", "auto")
+
+# The number of requests which can wait for a worker. Further requests wait until there is room in the queue.
+#  Can be set with worker_queue in the .env file.
+WORKER_QUEUE = int(envdict.get("worker_queue", 16))
+
+# The number of seconds a call waits for room in the queue of a worker, and then for its result, before it fails.
+#  Keeps the requests of the API from hanging forever if a worker wedges. Can be set with worker_timeout in the .env file.
+WORKER_TIMEOUT = float(envdict.get("worker_timeout", 900))
+
+# The module of each model, which the API calls through a ModuleProxy when the workers are enabled.
+MODEL_MODULES = {
+    "classifier": "backend.models.classifiermodel",
+    "unichart": "backend.models.chartparser",
+    "sumen": "backend.models.formulaparser",
+    "moondream": "backend.models.figureparser",
+}
+
+class ModelHandle:
+    """
+    Stands in for a model which lives in a worker process. The API passes it to the functions of the model modules
+    like the model itself, and the worker replaces it with the loaded model before calling the function.
+
+    Parameters:
+    index (int): The index of the model in what the loader returned, e.g. 0 for the model of (model, tokenizer). None for all of it.
+    """
+
+    def __init__(self, index=None):
+        self.index = index
+
+def load_classifier(runtime="torch", quantize=False):
+    """
+    Loads and warms up the DenseNet169 figure classifier in a worker.
+
+    Parameters:
+    runtime (str): 'torch', or 'onnx' for ONNX Runtime.
+    quantize (bool): Quantize the Linear layers to int8, only for the torch runtime.
+
+    Returns:
+    The classifier.
+    """
+    import backend.models.classifiermodel as classifier_ML
+    model = classifier_ML.load_ml_onnx() if runtime == "onnx" else classifier_ML.load_ml_inference(quantize=quantize)
+    classifier_ML.warmup(model)
+    return model
+
+def load_unichart(quantize=False):
+    """
+    Loads and warms up UniChart in a worker. The model is kept in the globals of the chart parser module.
+
+    Parameters:
+    quantize (bool): Quantize the Linear layers to int8.
+
+    Returns:
+    None
+    """
+    import backend.models.chartparser as charter
+    charter.load_unichart(quantize=quantize)
+    charter.warmup()
+
+def load_sumen(quantize=False):
+    """
+    Loads and warms up Sumen in a worker. The model is kept in the globals of the formula parser module.
+
+    Parameters:
+    quantize (bool): Quantize the Linear layers to int8.
+
+    Returns:
+    None
+    """
+    import backend.models.formulaparser as formula
+    model, processor = formula.load_sumen(quantize=quantize)
+    if model is None:
+        raise RuntimeError("Sumen could not be loaded.")
+    formula.warmup()
+
+def load_moondream(cache_mb=512):
+    """
+    Loads and warms up Moondream2 in a worker.
+
+    Parameters:
+    cache_mb (int): The size of the cache of encoded images in megabytes.
+
+    Returns:
+    (model, tokenizer): The Moondream2 model and tokenizer.
+    """
+    import backend.models.figureparser as figure
+    model, tokenizer = figure.load()
+    if model is None:
+        raise RuntimeError("Moondream2 could not be loaded.")
+    figure.encoded_image_cache.max_bytes = cache_mb * 1024 * 1024
+    figure.warmup(model)
+    return model, tokenizer
+
+LOADERS = {
+    "classifier": load_classifier,
+    "unichart": load_unichart,
+    "sumen": load_sumen,
+    "moondream": load_moondream,
+}
+
+# What the registry gets instead of the model, the same shape as what the loaders of APIcode.py return.
+HANDLES = {
+    "moondream": (ModelHandle(0), ModelHandle(1)),
+}
+
+def parse_cpus(value):
+    """
+    Parses a set of cores, e.g. '0-3' or '5'.
+
+    Parameters:
+    value (str): The cores, as a range or a single number.
+
+    Returns:
+    (list[int]): The cores.
+
+    Raises:
+    ValueError: If value is not a core or a range of cores.
+    """
+    if "-" in value:
+        first, last = value.split("-")
+        if int(first) > int(last):
+            raise ValueError(f"the range of cores '{value}' is empty")
+        return list(range(int(first), int(last) + 1))
+    return [int(value)]
+
+def parse_threads(value):
+    """
+    Parses a number of threads.
+
+    Parameters:
+    value (str): The number of threads.
+
+    Returns:
+    (int): The number of threads.
+
+    Raises:
+    ValueError: If value is not a positive whole number.
+    """
+    if int(value) < 1:
+        raise ValueError(f"the number of threads must be at least 1, not {value}")
+    return int(value)
+
+def parse_pairs(setting_name, value, names, parse):
+    """
+    Parses a per-model setting of comma-separated 'model=value' pairs, e.g. 'sumen=0-1,unichart=2-5'. Pairs which can't
+    be parsed, or which name a model without a worker, are logged and left out, so that the other pairs still apply.
+
+    Parameters:
+    setting_name (str): The name of the setting in the .env file, for the log.
+    value (str): The setting.
+    names (list[str]): The models which get a worker.
+    parse (callable): Parses the value of one pair.
+
+    Returns:
+    (dict): The parsed value of each model.
+    """
+    pairs = {}
+    for setting in value.split(","):
+        if not setting.strip():
+            continue
+        if "=" not in setting:
+            logging.warning(f"[modelworkers.py] Ignoring '{setting.strip()}' in {setting_name}: expected 'model=value' or 'auto'.")
+            continue
+        name, pair_value = (part.strip() for part in setting.split("=", 1))
+        if name not in names:
+            logging.warning(f"[modelworkers.py] Ignoring '{setting.strip()}' in {setting_name}: '{name}' is not one of the models with a worker ({', '.join(names)}).")
+            continue
+        try:
+            pairs[name] = parse(pair_value)
+        except ValueError as e:
+            logging.error(f"[modelworkers.py] Ignoring '{setting.strip()}' in {setting_name}: {e}")
+    return pairs
+
+def plan_workers(names, threads_setting=WORKER_THREADS, cpus_setting=WORKER_CPUS):
+    """
+    Decides the cores and the number of threads of each worker. With 'auto', the cores the API may use are split into
+    one contiguous block per worker, and each worker gets as many threads as it has cores, so that the workers
+    don't compete for the same cores. If there are fewer cores than workers, the cores are shared. Models which
+    have no usable cores in a per-model setting get their block of the 'auto' split.
+
+    Parameters:
+    names (list[str]): The models which get a worker.
+    threads_setting (str): 'auto', or comma-separated 'model=threads' pairs.
+    cpus_setting (str): 'auto', or comma-separated 'model=cores' pairs, e.g. 'sumen=0-1'.
+
+    Returns:
+    (dict): For each model, a tuple of the number of threads and the list of cores.
+    """
+    available = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    # The 'auto' split: one contiguous block of the available cores per worker
+    auto_cpus = {}
+    for index, name in enumerate(names):
+        start = index * len(available) // len(names)
+        end = (index + 1) * len(available) // len(names)
+        auto_cpus[name] = available[start:end] or [available[index % len(available)]]
+
+    if cpus_setting.strip() == "auto":
+        cpus = auto_cpus
+    else:
+        cpus = parse_pairs("worker_cpus", cpus_setting, names, parse_cpus)
+        for name in list(cpus):
+            if not set(cpus[name]) <= set(available):
+                logging.warning(f"[modelworkers.py] Ignoring the cores of {name} in worker_cpus: {cpus[name]} are not all among the available cores {available}.")
+                del cpus[name]
+        # A model without usable cores in the setting gets its block of the 'auto' split, rather than every core,
+        #  which would make it compete with the pinned workers
+        for name in names:
+            if name not in cpus:
+                cpus[name] = auto_cpus[name]
+                logging.warning(f"[modelworkers.py] No usable cores for {name} in worker_cpus, using its share of the 'auto' split: {cpus[name]}.")
+
+    threads = {}
+    if threads_setting.strip() != "auto":
+        threads = parse_pairs("worker_threads", threads_setting, names, parse_threads)
+
+    plan = {}
+    for name in names:
+        plan[name] = (threads.get(name, len(cpus[name])), cpus[name])
+    return plan
+
+def resolve(value, model):
+    """
+    Replaces a ModelHandle with the model it stands in for.
+
+    Parameters:
+    value: An argument of a call from the API.
+    model: The model loaded in the worker.
+
+    Returns:
+    The model if value is a ModelHandle, otherwise value.
+    """
+    if isinstance(value, ModelHandle):
+        return model if value.index is None else model[value.index]
+    return value
+
+def worker_main(name, threads, cpus, settings, requests, responses):
+    """
+    The main function of a worker process. Pins the process to its cores, sets the number of torch threads, loads
+    the model, and then runs the calls from the API one after another until it gets None.
+
+    Parameters:
+    name (str): The name of the model.
+    threads (int): The number of torch threads.
+    cpus (list[int]): The cores of the worker, or None.
+    settings (dict): The keyword arguments of the loader of the model.
+    requests (multiprocessing.Queue): The calls from the API, as (request id, module, function, args, kwargs).
+    responses (multiprocessing.Queue): The results, as (request id, result, error, counters).
+
+    Returns:
+    None
+    """
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    # Set before torch is imported, so that OpenMP and MKL start with the right number of threads
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ["MKL_NUM_THREADS"] = str(threads)
+
+    try:
+        import torch
+        torch.set_num_threads(threads)
+        model = LOADERS[name](**settings)
+        logging.info(f"[modelworkers.py] Worker for {name} loaded the model, with {threads} threads on cores {cpus}.")
+        responses.put(("ready", None, None, {}))
+    except Exception as e:
+        logging.error(f"[modelworkers.py] An error occurred while loading {name} in its worker: {e}", exc_info=True)
+        responses.put(("ready", None, traceback.format_exc(), {}))
+        return
+
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        request_id, module_name, function, args, kwargs = request
+        try:
+            module = importlib.import_module(module_name)
+            args = [resolve(arg, model) for arg in args]
+            kwargs = {key: resolve(value, model) for key, value in kwargs.items()}
+            result, error = getattr(module, function)(*args, **kwargs), None
+        except Exception as e:
+            logging.error(f"[modelworkers.py] An error occurred in the worker for {name} while calling {function}: {e}", exc_info=True)
+            result, error = None, f"{type(e).__name__}: {e}"
+
+        # The counters of the model modules are sent along and added to the counters of the API
+        with metrics.lock:
+            counters = dict(metrics.counters)
+            metrics.counters.clear()
+        responses.put((request_id, result, error, counters))
+
+class ModelWorker:
+    """
+    A model running in its own process, pinned to its own cores and with its own number of torch threads. The API
+    sends calls of functions of the model module to it through a queue, and the worker runs them one after another.
+    This keeps the models from competing for the same cores, and the pre- and post-processing of one model from
+    holding the GIL of another.
+
+    Parameters:
+    name (str): The name of the model, e.g. 'sumen'.
+    threads (int): The number of torch threads of the worker.
+    cpus (list[int]): The cores of the worker, or None to not restrict them.
+    settings (dict): The keyword arguments of the loader of the model, see LOADERS.
+    queue_size (int): The number of calls which can wait for the worker.
+    timeout (float): The number of seconds a call waits for room in the queue, and then for its result.
+    """
+
+    def __init__(self, name, threads, cpus, settings, queue_size=WORKER_QUEUE, timeout=WORKER_TIMEOUT):
+        self.name = name
+        self.threads = threads
+        self.cpus = cpus
+        self.settings = settings
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.process = None
+        self.requests = None
+        self.responses = None
+        self.pending = {}
+        self.request_ids = itertools.count()
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        Starts the worker process and waits until it has loaded the model. Does nothing if it is already running.
+        Used as the loader of the model in the model registry.
+
+        Returns:
+        A ModelHandle, or a tuple of them, which the API uses like the model.
+        """
+        with self.lock:
+            if self.process is None or not self.process.is_alive():
+                # Spawn, so that the worker doesn't inherit the threads and the CUDA state of the API process
+                context = multiprocessing.get_context("spawn")
+                self.requests = context.Queue(maxsize=self.queue_size)
+                self.responses = context.Queue()
+                self.process = context.Process(target=worker_main, name=f"worker-{self.name}", daemon=True,
+                                               args=(self.name, self.threads, self.cpus, self.settings, self.requests, self.responses))
+                self.process.start()
+
+                # Wait for the model to be loaded
+                while True:
+                    try:
+                        request_id, result, error, counters = self.responses.get(timeout=1)
+                        break
+                    except queue.Empty:
+                        if not self.process.is_alive():
+                            raise RuntimeError(f"The worker for {self.name} stopped while loading the model.")
+                if error is not None:
+                    self.process.join()
+                    raise RuntimeError(f"The worker for {self.name} could not load the model: {error}")
+
+                # The calls waiting for this process. A new dict for every process, so that the dispatcher of a
+                #  stopped process only fails its own calls, not those of the process started after it.
+                self.pending = {}
+                threading.Thread(target=self._dispatch, args=(self.process, self.responses, self.pending), daemon=True).start()
+                logging.info(f"[modelworkers.py] Started worker for {self.name} (pid {self.process.pid}).")
+        return HANDLES.get(self.name, ModelHandle())
+
+    def _dispatch(self, process, responses, pending):
+        """
+        Gives the results from the worker to the calls waiting for them. If the worker stops, the waiting calls fail.
+        Calls register under the lock only while the process is alive, and a stopped process never comes back, so no
+        call can register after the waiting calls have been failed here.
+        """
+        while True:
+            try:
+                request_id, result, error, counters = responses.get(timeout=1)
+            except queue.Empty:
+                if process.is_alive():
+                    continue
+                with self.lock:
+                    failed = list(pending.values())
+                    pending.clear()
+                for future in failed:
+                    future.set_exception(RuntimeError(f"The worker for {self.name} stopped."))
+                if process.exitcode not in (0, None, -15):
+                    logging.error(f"[modelworkers.py] The worker for {self.name} stopped with exit code {process.exitcode}.")
+                return
+
+            for counter, amount in counters.items():
+                metrics.increment(counter, amount)
+            with self.lock:
+                future = pending.pop(request_id, None)
+            if future is None:
+                continue
+            if error is not None:
+                future.set_exception(RuntimeError(f"The worker for {self.name} failed: {error}"))
+            else:
+                future.set_result(result)
+
+    def call(self, module_name, function, *args, **kwargs):
+        """
+        Calls a function of a model module in the worker, and waits for the result. The worker is started if it
+        isn't running, e.g. after it crashed.
+
+        Parameters:
+        module_name (str): The name of the module, e.g. 'backend.models.formulaparser'.
+        function (str): The name of the function, e.g. 'run_sumen_ocr'.
+        *args, **kwargs: The arguments of the function. They are pickled, so e.g. PIL images can be used.
+
+        Returns:
+        The result of the function.
+
+        Raises:
+        RuntimeError: If the worker stopped or failed, or didn't take the call or answer within the timeout.
+        """
+        future = Future()
+        while True:
+            # The liveness check and the registration happen together under the lock, see _dispatch()
+            with self.lock:
+                if self.process is not None and self.process.is_alive():
+                    request_id = next(self.request_ids)
+                    pending = self.pending
+                    pending[request_id] = future
+                    requests = self.requests
+                    break
+            self.start()
+
+        start = time.time()
+        try:
+            requests.put((request_id, module_name, function, args, kwargs), timeout=self.timeout)
+        except queue.Full:
+            with self.lock:
+                pending.pop(request_id, None)
+            raise RuntimeError(f"The worker for {self.name} didn't take the call to {function} within {self.timeout:.0f} seconds, its queue is full.")
+        try:
+            result = future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            with self.lock:
+                pending.pop(request_id, None)
+            raise RuntimeError(f"The worker for {self.name} didn't answer the call to {function} within {self.timeout:.0f} seconds.")
+        metrics.observe(f"worker_{self.name}", time.time() - start)
+        return result
+
+    def stop(self):
+        """
+        Stops the worker process, which frees the memory of its model. Used to unload the model in the model registry.
+
+        Returns:
+        None
+        """
+        with self.lock:
+            if self.process is None:
+                return
+            if self.process.is_alive():
+                self.requests.put(None)
+                self.process.join(timeout=30)
+                if self.process.is_alive():
+                    self.process.terminate()
+            self.process = None
+        logging.info(f"[modelworkers.py] Stopped worker for {self.name}.")
+
+class ModuleProxy:
+    """
+    Stands in for a model module in the API when the models run in workers. Calling a function of the proxy, e.g.
+    formula.run_sumen_ocr(image), calls the function of the module in the worker of the model.
+
+    Parameters:
+    worker (ModelWorker): The worker of the model.
+    module_name (str): The name of the module.
+    """
+
+    def __init__(self, worker, module_name):
+        self.worker = worker
+        self.module_name = module_name
+
+    def __getattr__(self, function):
+        if function.startswith("__"):
+            raise AttributeError(function)
+
+        def call(*args, **kwargs):
+            return self.worker.call(self.module_name, function, *args, **kwargs)
+        return call
@@ -0,0 +1,46 @@
+import os
+import sys
+import argparse
+import logging
+
+import backend.models.classifiermodel as classifier_ML
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s: %(message)s',
+    force=True,
+    handlers=[
+        logging.FileHandler("app.log"),  # Log to a file named 'app.log'
+        logging.StreamHandler(sys.stdout)  # Also log to console
+    ]
+)
+
+def main():
+  """
+  Exports the trained DenseNet169 figure classifier to ONNX, with a dynamic batch axis. The API does this itself at
+  the first start with --classifier_backend onnx, but the model can also be exported in advance, e.g. to ship it
+  to workers without PyTorch, or to check it with evaluation/classifier/Code/onnxParityBenchmark.py.
+
+  Paramaters:
+  None
+
+  Returns:
+  None
+  """
+  parser = argparse.ArgumentParser(description="Export the DenseNet169 figure classifier to ONNX.")
+  parser.add_argument('--weights', dest='weights', type=str, help='Path to the trained weights saved by skorch.', default=classifier_ML.WEIGHTS_PATH)
+  parser.add_argument('--output', dest='output', type=str, help='Where to write the ONNX model.', default=classifier_ML.ONNX_PATH)
+  parser.add_argument('--opset', dest='opset', type=int, help='ONNX opset version.', default=17)
+  args = parser.parse_args()
+
+  classifier_ML.WEIGHTS_PATH = args.weights
+  classifier_ML.SAFETENSORS_PATH = os.path.splitext(args.weights)[0] + ".safetensors"
+  try:
+    classifier_ML.export_onnx(args.output, opset=args.opset)
+    print(f"----> Exported classifier to {args.output}")
+  except Exception as e:
+    logging.error(f"[export_classifier_onnx.py] An error occurred while exporting the classifier to ONNX: {e}", exc_info=True)
+    sys.exit(1)
+
+if __name__ == '__main__':
+  main()
@@ -12,6 +12,10 @@ import importlib.util
 from streamlit_pdf_viewer import pdf_viewer # PDF viewer for displaying PDFs in Streamlit
 from annotated_text import annotated_text, annotation # Annotated text library for displaying styled and annotated text
 
+# Streamlit runs this file as a script, so the app folder has to be added to the path to import the backend modules.
+sys.path.append("/content/Sci2XML/app")
+import backend.grobidclient as grobidclient # Shared GROBID client with a cache for the GROBID responses
+
 # Configure logging to store logs in a file
 logging.basicConfig(
     level=logging.INFO,
@@ -47,8 +51,8 @@ def get_envdict():
     for env in envlist:
         if (env == ""):
             continue
-        # Map correct value to key:
-        envdict[env.split("=")[0]] = env.split("=")[1]
+        # Map correct value to key. Only the first '=' separates them, as values like 'sumen=adaptive,unichart=beam' contain '=' too:
+        envdict[env.split("=", 1)[0]] = env.split("=", 1)[1]
 
     return envdict
 
@@ -450,6 +454,7 @@ def process_classifier(xml_input, pdf_file):
 def process_pdf(file, params=None):
     """
     Process a PDF file using the GROBID API and return the response content.
+    The GROBID responses are cached, so uploading the same PDF again does not call GROBID.
 
     Parameters:
     file (file-object): The PDF file to process.
@@ -459,24 +464,17 @@ def process_pdf(file, params=None):
     response.text: The XML content returned by the GROBID API as a string, or None if an error occurred.
     """
 
-    # Create a dict with the value as the file to be sent.
-    files = {'input': file}
-
-    # Define the URL for the GROBID API endpoint
-    grobid_url = "http://172.28.0.12:8070/api/processFulltextDocument"
-
     try:
         logging.info(f"[app.py] Call GROBID API endpoint")
-        response = requests.post(grobid_url, files=files, data=params) # Send request to GROBID
-        response.raise_for_status()  # Raise exception if status is not 200
-        logging.info(f'[app.py] Response from GROBID: {response}')
+        xml_content = grobidclient.process_fulltext_document(file.getvalue(), params=params) # Send request to GROBID
+        logging.info(f'[app.py] Received response from GROBID')
 
         # Check if coordinates are missing in the response
-        if 'coords' not in response.text:
+        if 'coords' not in xml_content:
             logging.warning("[app.py] No coordinates found in PDF file. Please check GROBID settings.")
             st.warning("No coordinates found in PDF file. Please check GROBID settings.")
 
-        return response.text  # Return XML recevied from GROBID
+        return xml_content  # Return XML recevied from GROBID
 
     except requests.exceptions.RequestException as e:
         logging.error(f"[app.py] An error occured while communicating with GROBID: {e}", exc_info=True)
@@ -653,6 +651,14 @@ def main():
         st.session_state.pdf_ref = None
         logging.info("[app.py] pdf_ref was missing in session state and has now been initialized.")
 
+    # GROBID processing profile, used when the PDF is uploaded
+    profiles = list(grobidclient.GROBID_PROFILES)
+    st.selectbox("GROBID profile",
+                 options=profiles,
+                 index=profiles.index(grobidclient.DEFAULT_GROBID_PROFILE),
+                 key="grobid_profile",
+                 help="'fast' skips the consolidation against external services and only adds coordinates to figures and formulas. Applies to the next uploaded PDF file.")
+
     # Access the uploaded ref via a key
     uploaded_pdf = st.file_uploader("Upload PDF", 
                                     type='pdf', 
@@ -685,16 +691,8 @@ def main():
                 st.session_state.pdf_ref = None
 
             if st.session_state.pdf_ref:
-                # Parameters for GROBID
-                params = {
-                    "consolidateHeader": 1,
-                    "consolidateCitations": 1,
-                    "consolidateFunders": 1,
-                    "includeRawAffiliations": 1,
-                    "includeRawCitations": 1,
-                    "segmentSentences": 1,
-                    "teiCoordinates": ["ref", "s", "biblStruct", "persName", "figure", "formula", "head", "note", "title", "affiliation"]
-                }
+                # Parameters for GROBID, from the selected processing profile
+                params = grobidclient.get_profile_params(st.session_state.grobid_profile)
 
                 result = None  # Ensure result is always defined
 
@@ -193,7 +193,7 @@ def get_envdict():
     for env in envlist:
         if (env == ""):
             continue
-        # Map correct value to key:
-        envdict[env.split("=")[0]] = env.split("=")[1]
+        # Map correct value to key. Only the first '=' separates them, as values like 'sumen=adaptive,unichart=beam' contain '=' too:
+        envdict[env.split("=", 1)[0]] = env.split("=", 1)[1]
 
     return envdict
\ No newline at end of file
@@ -1,4 +1,5 @@
 import time
+import threading
 import argparse
 import subprocess
 import logging
@@ -37,7 +38,24 @@ def launch():
   parser = argparse.ArgumentParser()
   parser.add_argument('--authtoken', dest='authtoken', type=str, help='Set authtoken for ngrok.', default ="None")
   parser.add_argument('--port', dest='port', type=int, help='Set port number', choices=range(8000, 8070), metavar="[8000-8069]", default =8000)
+  parser.add_argument('--table_backend', dest='table_backend', type=str, help='Set table extraction backend: either pdfplumber or pymupdf (requires PyMuPDF).', choices=['pdfplumber', 'pymupdf'], default ="pdfplumber")
+  parser.add_argument('--grobid_profile', dest='grobid_profile', type=str, help='Set default GROBID processing profile: either full or fast (no consolidation, only figure and formula coordinates).', choices=['full', 'fast'], default ="full")
+  parser.add_argument('--grobid_instances', dest='grobid_instances', type=int, help='Set number of local GROBID servers to launch. Requests are balanced between them.', choices=range(1, 9), metavar="[1-8]", default =1)
+  parser.add_argument('--models', dest='models', type=str, help="Set the models this instance loads, comma-separated: classifier, unichart, sumen, moondream, or all. E.g. 'sumen' for a formula-only instance.", default ="all")
+  parser.add_argument('--lazy_models', dest='lazy_models', action='store_true', help='Load each model the first time it is used, instead of at startup.')
+  parser.add_argument('--classifier_backend', dest='classifier_backend', type=str, help='Set runtime of the figure classifier: either torch or onnx (ONNX Runtime, exported from the trained model at the first start).', choices=['torch', 'onnx'], default ="torch")
+  parser.add_argument('--quantize', dest='quantize', type=str, help="Set the models loaded with int8 quantized Linear layers for faster CPU inference, comma-separated: classifier, unichart, sumen, or none.", default ="none")
+  parser.add_argument('--decoding', dest='decoding', type=str, help="Set the decoding of sumen and unichart: beam, greedy, or adaptive (greedy, and beam search only for unreliable outputs). Either one for both or per model, e.g. 'sumen=adaptive,unichart=beam'.", default ="beam")
+  parser.add_argument('--formula_length_budget', dest='formula_length_budget', type=str, help='Choose if the token budget of each formula is predicted from its size, instead of always allowing the maximum length.', choices=['True', 'False'], default ="True")
+  parser.add_argument('--model_workers', dest='model_workers', type=str, help='Choose if every model runs in its own worker process, pinned to its own cores.', choices=['True', 'False'], default ="False")
+  parser.add_argument('--worker_threads', dest='worker_threads', type=str, help="Set the torch threads of each model worker: auto (one per core of the worker) or per model, e.g. 'sumen=2,unichart=4'.", default ="auto")
+  parser.add_argument('--worker_cpus', dest='worker_cpus', type=str, help="Set the cores of each model worker: auto (the cores split evenly between the workers) or per model, e.g. 'sumen=0-1,unichart=2-5'.", default ="auto")
+  parser.add_argument('--worker_queue', dest='worker_queue', type=int, help='Set the number of requests which can wait for each model worker.', default =16)
+  parser.add_argument('--worker_timeout', dest='worker_timeout', type=float, help='Set the number of seconds a request waits for a model worker before it fails.', default =900)
+  parser.add_argument('--model_idle_unload', dest='model_idle_unload', type=int, help='Unload models which have not been used for this many seconds to free memory. 0 keeps them loaded.', default =0)
+  parser.add_argument('--skip-install', '--skip_install', dest='skip_install', action='store_true', help='Skip installing the requirements, e.g. when restarting on a machine where they are already installed.')
   parser.add_argument('--nl_formula', dest='nlformula', type=str, help='Choose if you want NL generated for the formulas.', choices=['True', 'False', None], default ="False")
+  parser.add_argument('--nl_mode', dest='nl_mode', type=str, help='Choose the default NL of figures, charts and formulas: a short caption, which is much faster for bulk ingestion, or a detailed description.', choices=['short', 'detailed'], default ="detailed")
   args = parser.parse_args()
   logging.info("[launch_onlyAPI.py] Arguments parsed.")
   
@@ -45,34 +63,63 @@ def launch():
   args.port = str(args.port)
   tunnel = "ngrok"
   
+  # The GROBID module knows the ports of the GROBID instances. Importing it doesn't launch GROBID yet.
+  import backend.grobidmodule as grobidmod
+
   # Create .env file with the various environment variables:
   with open("/content/.env", "w") as f:
     f.write(f"port={args.port}\n")
     f.write(f"tunnel={tunnel}\n")
     f.write(f"nl_formula={args.nlformula}\n")
     f.write(f"authtoken={args.authtoken}\n")
+    f.write(f"table_backend={args.table_backend}\n")
+    f.write(f"grobid_profile={args.grobid_profile}\n")
+    f.write(f"models={args.models}\n")
+    f.write(f"lazy_models={args.lazy_models}\n")
+    f.write(f"model_idle_unload={args.model_idle_unload}\n")
+    f.write(f"quantize={args.quantize}\n")
+    f.write(f"decoding={args.decoding}\n")
+    f.write(f"formula_length_budget={args.formula_length_budget}\n")
+    f.write(f"nl_mode={args.nl_mode}\n")
+    f.write(f"model_workers={args.model_workers}\n")
+    f.write(f"worker_threads={args.worker_threads}\n")
+    f.write(f"worker_cpus={args.worker_cpus}\n")
+    f.write(f"worker_queue={args.worker_queue}\n")
+    f.write(f"worker_timeout={args.worker_timeout}\n")
+    f.write(f"classifier_backend={args.classifier_backend}\n")
+    # The URLs of the GROBID instances which launch_grobid_instances() starts:
+    f.write(f"grobid_urls={','.join(grobidmod.instance_urls(args.grobid_instances))}\n")
   # File is automatically closed after exiting the 'with' block
 
+  ## Load GROBID and launch GROBID server in the background ##
+  # GROBID only needs Java, so it can be downloaded, built and booted while the requirements are installed and the models are loaded.
+  #  The startup then takes roughly as long as the slowest of these, instead of the sum of them.
+  print("\n#------------- ### Load & launch GROBID in background ### ----------#\n")
+  logging.info("[launch_onlyAPI.py] Loading and launching GROBID in the background.")
+  grobid_times = {}
+
+  def launch_grobid():
+    grobid_start = time.time()
+    try:
+      grobidmod.launch_grobid_instances(args.grobid_instances)
+      logging.info(f"[launch_onlyAPI.py] Finished loading and launching GROBID.")
+    except Exception as e:
+      logging.error(f"[launch_onlyAPI.py] An error occurred while trying to load and launch GROBID: {e}", exc_info=True)
+    grobid_times["time"] = time.time() - grobid_start
+
+  grobid_thread = threading.Thread(target=launch_grobid, daemon=True)
+  grobid_thread.start()
+
   ## Setup ##
   print("\n#-------------------------- ### Setup ### --------------------------#\n")
   print("#-------------------- # Installing requirements # ------------------#\n")
   logging.info("[launch_onlyAPI.py] Installing requirements.")
   
   try:
-      # Using subprocess to install the pip, apt-get and npm requirements.
-      log = open("reqlog.txt", "a")
-      print("\n----> pip installs...")
-      
-      n = subprocess.run(["pip", "install", '-r', "Sci2XML/app/requirements_final.txt"], stdout=log, stderr=log, text=True)
-      print("----> apt-get installs...")
-      
-      n = subprocess.run(["apt", "update"], stdout=log, stderr=log, text=True)
-      n = subprocess.run(["apt-get", "install", "poppler-utils"], stdout=log, stderr=log, text=True)
-      n = subprocess.run(["apt-get", "install", "-y", "libvips"], stdout=log, stderr=log, text=True)
-      print("----> npm installs...\n")
-      
-      n = subprocess.run(["npm", "install", "localtunnel"], stdout=log, stderr=log, text=True)
-      logging.info(f"[launch_onlyAPI.py] Finished installing requirements.")
+    # Install the pip, apt-get and npm requirements, unless nothing changed since the last installation:
+    import backend.installmodule as installmodule
+    install_result = installmodule.ensure_requirements(skip=args.skip_install)
+    logging.info(f"[launch_onlyAPI.py] Requirements: {install_result}.")
   except Exception as e:
       logging.error(f"[launch_onlyAPI.py] An error occurred while trying to install requirements: {e}", exc_info=True)
   
@@ -101,24 +148,19 @@ def launch():
   logging.info(f"[launch_onlyAPI.py] Launching APIs time: {int(minutes)} minutes and {int(seconds)} seconds")
   print(f"\n---> Launching APIs time: {int(minutes)} minutes and {int(seconds)} seconds")
 
-  ## Load GROBID and launch GROBID server ##
-  print("\n#------------------- ### Load & launch GROBID ### ------------------#\n")
-  logging.info("[launch_onlyAPI.py] Loading and launching GROBID.")
-  
-  try:
-      # Import GROBID module. This will also automatically download, install and launch GROBID server.
-      import backend.grobidmodule as grobidmod
-      grobidmod.load_grobid_python_way()
-      logging.info(f"[launch_onlyAPI.py] Finished loading and launching GROBID.")
-  except Exception as e:
-    logging.error(f"[launch_onlyAPI.py] An error occurred while trying to load and launch GROBID: {e}", exc_info=True)
-  
+  ## Wait for GROBID ##
+  print("\n#------------------- ### Waiting for GROBID ### --------------------#\n")
+  logging.info("[launch_onlyAPI.py] Waiting for GROBID to be up.")
+  # Readiness barrier: the models are loaded, now wait for the GROBID server which was started in the background.
+  grobid_thread.join()
+
   # Time logging:
   grobid_time = time.time()
   minutes, seconds = divmod(grobid_time - api_time, 60)
-  time_array.append({"name": "Launching GROBID", "time": grobid_time - api_time})
-  logging.info(f"[launch_onlyAPI.py] Launching GROBID time: {int(minutes)} minutes and {int(seconds)} seconds")
-  print(f"\n----> Launching GROBID time: {int(minutes)} minutes and {int(seconds)} seconds")
+  time_array.append({"name": "Launching GROBID (in background)", "time": grobid_times.get("time", 0)})
+  time_array.append({"name": "Waiting for GROBID after the models were loaded", "time": grobid_time - api_time})
+  logging.info(f"[launch_onlyAPI.py] Waiting for GROBID time: {int(minutes)} minutes and {int(seconds)} seconds")
+  print(f"\n----> Waiting for GROBID time: {int(minutes)} minutes and {int(seconds)} seconds")
 
   ## Start API using tunnel ##
   print("\n#------------ ### Starting API through tunnel ### ------------#\n")
@@ -134,8 +176,8 @@ def launch():
   
   # Time logging:
   localtunnel_api_time = time.time()
-  minutes, seconds = divmod(localtunnel_api_time - api_time, 60)
-  time_array.append({"name": "Launching Localtunnel API", "time": localtunnel_api_time - api_time})
+  minutes, seconds = divmod(localtunnel_api_time - grobid_time, 60)
+  time_array.append({"name": "Launching Localtunnel API", "time": localtunnel_api_time - grobid_time})
   time_array.append({"name": "Total startup", "time": time.time() - start_time})
   print(f"\n----> Launching Localtunnel API time: {int(minutes)} minutes and {int(seconds)} seconds")
 
@@ -149,4 +191,6 @@ def launch():
 
   print("\n#--------------------- ### User Interaction ### --------------------#\n")
 
-launch()
\ No newline at end of file
+# Guarded, so that the model worker processes, which import this script again, don't launch the application
+if __name__ == "__main__":
+  launch()
\ No newline at end of file
@@ -5,6 +5,9 @@ import logging
 import os
 from glob import glob # Used to find *.pdf files in folder
 
+import backend.grobidclient as grobidclient
+import backend.metrics as metrics
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s: %(message)s',
@@ -28,6 +31,9 @@ def main():
     --folder: Path to a folder containing multiple PDFs (mutually exclusive with --output).
     --output: Path to save the processed XML file (only used with --pdf).
     --nl_formula: Whether to enable natural language generation for formulas ('True' or 'False').
+    --no_grobid_cache: Always call GROBID, even if the response for the PDF is already cached.
+    --grobid_profile: The GROBID processing profile: 'full' (consolidation and all coordinates) or 'fast' (no consolidation, only figure and formula coordinates).
+    --chunk_pages: Process PDFs with more pages than this in chunks of this many pages (0 turns chunking off).
 
     Returns:
     The processed XML file(s).
@@ -40,6 +46,9 @@ def main():
     parser.add_argument('--output', dest='path_to_save', type=str, help='Set path to save processed XML file.', default="")
     parser.add_argument('--folder', dest='folder', type=str, help='Set path to a folder containing PDFs.', default="")
     parser.add_argument('--nl_formula', dest='nlformula', type=str, help='Choose if you want NL generated for the formulas.', choices=['True', 'False', None], default="False")
+    parser.add_argument('--no_grobid_cache', dest='no_grobid_cache', action='store_true', help='Always call GROBID, even if the PDF is in the GROBID cache.')
+    parser.add_argument('--grobid_profile', dest='grobid_profile', type=str, help='Set GROBID processing profile: full (slower, consolidates against external services) or fast.', choices=list(grobidclient.GROBID_PROFILES), default=grobidclient.DEFAULT_GROBID_PROFILE)
+    parser.add_argument('--chunk_pages', dest='chunk_pages', type=int, help='Process PDFs with more pages than this in chunks of this many pages, e.g. 50. 0 turns chunking off.', default=int(grobidclient.get_envdict().get("chunk_pages", 0)))
 
     args = parser.parse_args()
 
@@ -51,6 +60,10 @@ def main():
     if not args.pdf and not args.folder:
         parser.error("You must provide either --pdf or --folder.")
 
+    # A negative chunk size would give no chunks at all
+    if args.chunk_pages < 0:
+        parser.error("--chunk_pages must be 0 or more.")
+
     # Handle the --nl_formula flag
     if args.nlformula.lower() == "true":
         envdict = get_envdict()
@@ -91,7 +104,7 @@ def main():
         for idx, pdf_file in enumerate(pdf_files, start=next_index):
             output_path = os.path.join(args.folder, f"{idx}.xml")
             print(f"\nProcessing {pdf_file} -> {output_path}")
-            start_processing(pdf_file, output_path)
+            start_processing(pdf_file, output_path, use_grobid_cache=not args.no_grobid_cache, grobid_profile=args.grobid_profile, chunk_pages=args.chunk_pages)
     
     # Single PDF mode
     else:
@@ -109,9 +122,9 @@ def main():
         print(f"\nProcessing single file:")
         print(f"PDF path: {pdf_path}")
         print(f"Output path: {final_path}")
-        start_processing(pdf_path, final_path)
+        start_processing(pdf_path, final_path, use_grobid_cache=not args.no_grobid_cache, grobid_profile=args.grobid_profile, chunk_pages=args.chunk_pages)
 
-def start_processing(pdf_path, path_to_save):
+def start_processing(pdf_path, path_to_save, use_grobid_cache=True, grobid_profile=None, chunk_pages=0):
       print("Starting processing")
       """
       Function for initiating the entire process, without the use of frontend.
@@ -122,9 +135,13 @@ def start_processing(pdf_path, path_to_save):
 
       Paramaters:
       pdf_path: Path to the PDF.
+      path_to_save: Path to save the processed XML file.
+      use_grobid_cache: Set to False to always call GROBID, even if the response for the PDF is cached.
+      grobid_profile: The GROBID processing profile, e.g. 'fast' or 'full'. Defaults to the profile in the .env file, or 'full'.
+      chunk_pages: If the PDF has more pages than this, it is processed in chunks of this many pages. 0 turns chunking off.
 
       Returns:
-      The processed XML file.
+      The processed XML file, or None if GROBID could not process the PDF.
       """
       print("\n")
       logging.info(f"[processing.py] process - You have reached function for full processing.")
@@ -133,63 +150,81 @@ def start_processing(pdf_path, path_to_save):
         byte_data_PDF = f.read()
       # File is automatically closed after exiting the 'with' block
 
-      ## Calling GROBID ##
-      print_update("Calling GROBID")
-      logging.info(f"[processing.py] process - Calling GROBID.")
-      grobid_url="http://172.28.0.12:8070/api/processFulltextDocument"
-      files = {'input': byte_data_PDF}
-      params = {
-                    "consolidateHeader": 1,
-                    "consolidateCitations": 1,
-                    "consolidateFunders": 1,
-                    "includeRawAffiliations": 1,
-                    "includeRawCitations": 1,
-                    "segmentSentences": 1,
-                    "teiCoordinates": ["ref", "s", "biblStruct", "persName", "figure", "formula", "head", "note", "title", "affiliation"]
-                }
-      # Call GROBID server:
-      try:
-        response = requests.post(grobid_url, files=files, data=params)  # Use 'data' for form-data
-        response.raise_for_status()  # Raise exception if status is not 200
-        string_data_XML = response.text
-        logging.info(f"[processing.py] Successfully called GROBID server.")
+      # Very large PDFs are split into chunks of pages, which are processed by GROBID and the table parser at the same time:
+      chunked = False
+      if chunk_pages:
+        # Only imported when chunking is on, as it loads pypdf and the table parser
+        import backend.chunking as chunking
+        try:
+          page_count = chunking.get_page_count(byte_data_PDF)
+          chunked = page_count > chunk_pages
+          logging.info(f"[processing.py] The PDF has {page_count} pages, chunked processing: {chunked}.")
+        except Exception as e:
+          logging.error(f"[processing.py] An error occurred while counting the pages of the PDF, processing it without chunks: {e}", exc_info=True)
+
+      if chunked:
+        ## Calling GROBID and Table parser on chunks ##
+        print_update(f"Calling GROBID and Table parser on chunks of {chunk_pages} pages.")
+        logging.info(f"[processing.py] process - Calling GROBID and Table parser on chunks of {chunk_pages} pages.")
+        try:
+          string_data_XML = chunking.process_pdf_in_chunks(byte_data_PDF, chunk_pages=chunk_pages, use_grobid_cache=use_grobid_cache, grobid_profile=grobid_profile,
+                                                           table_backend=get_envdict().get("table_backend", "pdfplumber"))
+        except Exception as e:
+          logging.error(f"[processing.py] An error occurred while processing the chunks: {e}", exc_info=True)
+          print_update("Could not get a response from GROBID, stopping the processing of this PDF.")
+          return None
+        finally:
+          logging.info(f"[processing.py] GROBID metrics: {metrics.snapshot(prefix='grobid')}")
+
+      else:
+        ## Calling GROBID ##
+        print_update("Calling GROBID")
+        logging.info(f"[processing.py] process - Calling GROBID.")
+        # Call GROBID server (or get the response from the GROBID cache):
+        try:
+          string_data_XML = grobidclient.process_fulltext_document(byte_data_PDF, use_cache=use_grobid_cache, profile=grobid_profile)
+          logging.info(f"[processing.py] Successfully called GROBID server.")
         
-        # Check if coordinates are missing in the response
-        if 'coords' not in response.text:
-            logging.warning("[processing.py] No coordinates found in PDF file. Please check GROBID settings.")
-      except Exception as e:
-        logging.error(f"[processing.py] An error occurred while calling GROBID server: {e}", exc_info=True)
-
-      ## Table Parser ##
-      print_update("Received response from GROBID, will not initiate Table parser.")
-      logging.info(f"[processing.py] process - Initiating Table parser.")
-      # Run the xml and pdf through the table parser before processing further. Could also be done after the processing of the other elements instead.
-      # Ready the files:
-      files = {"grobid_xml": ("xml_file.xml", string_data_XML, "application/json"), "pdf": ("pdf_file.pdf", byte_data_PDF)}
+          # Check if coordinates are missing in the response
+          if 'coords' not in string_data_XML:
+              logging.warning("[processing.py] No coordinates found in PDF file. Please check GROBID settings.")
+        except Exception as e:
+          logging.error(f"[processing.py] An error occurred while calling GROBID server: {e}", exc_info=True)
+          print_update("Could not get a response from GROBID, stopping the processing of this PDF.")
+          return None
+        finally:
+          logging.info(f"[processing.py] GROBID metrics: {metrics.snapshot(prefix='grobid')}")
+
+        ## Table Parser ##
+        print_update("Received response from GROBID, will not initiate Table parser.")
+        logging.info(f"[processing.py] process - Initiating Table parser.")
+        # Run the xml and pdf through the table parser before processing further. Could also be done after the processing of the other elements instead.
+        # Ready the files:
+        files = {"grobid_xml": ("xml_file.xml", string_data_XML, "application/json"), "pdf": ("pdf_file.pdf", byte_data_PDF)}
 
-      try:
-        # Send to API endpoint for processing of tables
         try:
-            envdict = get_envdict()
+          # Send to API endpoint for processing of tables
+          try:
+              envdict = get_envdict()
             
-            if ("port" not in envdict): # If key doesnt exist, create it with default value '8000':
-                with open("/content/.env", "a") as f:
-                    f.write("port=8000\n")
-                # File is automatically closed after exiting the 'with' block
+              if ("port" not in envdict): # If key doesnt exist, create it with default value '8000':
+                  with open("/content/.env", "a") as f:
+                      f.write("port=8000\n")
+                  # File is automatically closed after exiting the 'with' block
             
-            envdict = get_envdict()
-            port = envdict["port"] # Either what the user selected at launch, or default 8000
-            api_url = f"http://172.28.0.12:{port}/" # The URL for the local API.
-            logging.info(f"[processing.py] Set URL for api to: {api_url}")
-        except Exception as e:
-            api_url = "http://172.28.0.12:8000/" # The URL for the local API.
-            logging.error(f"[processing.py] An error occurred while setting the port and URL for api: {e}", exc_info=True)
+              envdict = get_envdict()
+              port = envdict["port"] # Either what the user selected at launch, or default 8000
+              api_url = f"http://172.28.0.12:{port}/" # The URL for the local API.
+              logging.info(f"[processing.py] Set URL for api to: {api_url}")
+          except Exception as e:
+              api_url = "http://172.28.0.12:8000/" # The URL for the local API.
+              logging.error(f"[processing.py] An error occurred while setting the port and URL for api: {e}", exc_info=True)
         
-        response = requests.post(f"{api_url}parse_table", files=files)
-        string_data_XML = response.text
-        logging.info(f'[processing.py] Response from table parser: {response}')
-      except requests.exceptions.RequestException as e:
-        logging.error(f"An error occurred while communication with the table parser: {e}", exc_info=True)
+          response = requests.post(f"{api_url}parse_table", files=files)
+          string_data_XML = response.text
+          logging.info(f'[processing.py] Response from table parser: {response}')
+        except requests.exceptions.RequestException as e:
+          logging.error(f"An error occurred while communication with the table parser: {e}", exc_info=True)
 
       ##  Starting classifier ##
       print_update("Received response from Table parser, will not initiate classification and further processing.")
@@ -207,7 +242,8 @@ def start_processing(pdf_path, path_to_save):
       try:
         # Open the XML file and extract all figures and formulas, as well as getting each page of the PDF as an image.
         print_update("Opening XML file and extracting figures and formulas.")
-        images, figures, formulas = classifier.open_XML(string_data_XML, byte_data_PDF, frontend=False)
+        # For chunked PDFs, only one chunk of pages is converted to images at a time:
+        images, figures, formulas = classifier.open_XML(string_data_XML, byte_data_PDF, frontend=False, page_block=chunk_pages if chunked else None)
         logging.info(f'[processing.py] Successfully opened XML file.')
       except requests.exceptions.RequestException as e:
         logging.error(f"An error occurred while opening the XML file: {e}", exc_info=True)
@@ -264,8 +300,8 @@ def get_envdict():
     for env in envlist:
         if (env == ""):
             continue
-        # Map correct value to key:
-        envdict[env.split("=")[0]] = env.split("=")[1]
+        # Map correct value to key. Only the first '=' separates them, as values like 'sumen=adaptive,unichart=beam' contain '=' too:
+        envdict[env.split("=", 1)[0]] = env.split("=", 1)[1]
 
     return envdict
 
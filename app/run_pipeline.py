@@ -1,18 +1,38 @@
 import subprocess
+import threading
 import argparse
+import time
 import os
 import sys
-
-def wait_for_launchoutput(process, ready_signal):
-    """Wait until the LaunchOnlyAPI prints the ready message."""
-    while True:
-        line = process.stdout.readline()
-        if not line:
-            continue
-        print(line.strip())
-        if ready_signal in line:
-            print("API is ready! Proceeding to CLI mode.")
-            break
+import requests
+
+def forward_launchoutput(process, show):
+    """Read the output of LaunchOnlyAPI, so its pipe never fills up, and print it while show is set."""
+    for line in process.stdout:
+        if show.is_set():
+            print(line.strip())
+
+def wait_for_ready(process, port, timeout=3600, interval=5):
+    """Wait until the API reports on /ready that its models are warmed up and GROBID is alive."""
+    ready_url = f"http://172.28.0.12:{port}/ready"
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            print("LaunchOnlyAPI exited before the API was ready.")
+            return False
+        try:
+            response = requests.get(ready_url, timeout=interval)
+            if response.status_code == 200:
+                if response.json().get("status") == "lazy":
+                    print("API is up, the models will be loaded when they are first used. Proceeding to CLI mode.")
+                else:
+                    print("API is ready! Proceeding to CLI mode.")
+                return True
+        except requests.exceptions.RequestException:
+            pass  # The API is not up yet
+        time.sleep(interval)
+    print(f"API was not ready after {timeout} seconds.")
+    return False
 
 def process_pdf(args, pdf=None, folder=None, output=None):
     """Process PDF or folder with processing.py."""
@@ -35,6 +55,7 @@ def main():
     parser.add_argument('--port', type=int, default=8001, help='Port for API')
     parser.add_argument('--authtoken', type=str, required=True, help='Auth token for API')
     parser.add_argument('--nl_formula', type=bool, default=False, help='Use natural language formula')
+    parser.add_argument('--nl_mode', type=str, choices=['short', 'detailed'], default='detailed', help='NL of figures, charts and formulas: short captions are much faster for large batches')
 
     args = parser.parse_args()
 
@@ -42,7 +63,8 @@ def main():
     launch_cmd = [
         "python", "Sci2XML/app/launch_onlyAPI.py",
         "--port", str(args.port),
-        "--authtoken", args.authtoken
+        "--authtoken", args.authtoken,
+        "--nl_mode", args.nl_mode
     ]
 
     launch_proc = subprocess.Popen(
@@ -53,9 +75,16 @@ def main():
         text=True
     )
 
+    # Print the output of LaunchOnlyAPI until the API is ready
+    show_output = threading.Event()
+    show_output.set()
+    threading.Thread(target=forward_launchoutput, args=(launch_proc, show_output), daemon=True).start()
+
     try:
         # 2. Wait until API is ready
-        wait_for_launchoutput(launch_proc, "### User Interaction ###")
+        if not wait_for_ready(launch_proc, args.port):
+            return
+        show_output.clear()
 
         # 3. Start CLI loop
         while True:
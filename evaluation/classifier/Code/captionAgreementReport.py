@@ -0,0 +1,115 @@
+import os
+import sys
+import argparse
+from collections import Counter
+from bs4 import BeautifulSoup
+from pdf2image import convert_from_bytes
+
+# Make the application importable, so that the report runs the exact same rules, GROBID parameters and classifier as the pipeline.
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..", "app")))
+import backend.grobidclient as grobidclient
+import backend.captionrules as captionrules
+import backend.models.classifiermodel as classifier_ML
+
+# Where classify() in classifier.py sends each class of figure.
+ROUTES = {
+    "bar_chart": "chart", "diagram": "chart", "graph": "chart", "pie_chart": "chart",
+    "flow_chart": "figure", "growth_chart": "figure",
+    "just_image": "skip", "table": "skip", "text_sentence": "skip",
+}
+
+# The factor between the GROBID coordinates and the pixels of the page images, the same as in process_figures().
+COORDS_SCALE = 2.775
+
+def load_figures(dataset_dir):
+    """
+    Sends every PDF of the dataset to GROBID, and crops the figures from the pages the same way as process_figures().
+
+    Args:
+        dataset_dir (str): Folder with one subfolder per PDF, e.g. evaluation/tables/Dataset.
+
+    Returns:
+        list[dict]: For every figure, the PDF, the caption, the head, the type attribute and the cropped image.
+    """
+    figures = []
+    for root, dirs, files in sorted(os.walk(dataset_dir)):
+        for file in sorted(files):
+            if not file.endswith(".pdf"):
+                continue
+            with open(os.path.join(root, file), "rb") as pdf:
+                pdf_bytes = pdf.read()
+            # File is automatically closed after exiting the 'with' block
+            xml = BeautifulSoup(grobidclient.process_fulltext_document(pdf_bytes), "xml")
+            pages = convert_from_bytes(pdf_bytes)
+
+            for figure in xml.find_all("figure"):
+                if not figure.get("coords"):
+                    continue
+                coords = [float(value) for value in figure.get("coords").split(";")[-1].split(",")]
+                page, x, y, width, height = int(coords[0]), *coords[1:5]
+                desc, head = figure.find("figDesc"), figure.find("head")
+                figures.append({
+                    "pdf": file,
+                    "caption": desc.text if desc is not None else "",
+                    "head": head.text if head is not None else "",
+                    "type": figure.get("type", ""),
+                    "image": pages[page - 1].crop((x * COORDS_SCALE, y * COORDS_SCALE, (x + width) * COORDS_SCALE, (y + height) * COORDS_SCALE)),
+                })
+    return figures
+
+def main():
+    """
+    Measures how often the caption rules (backend/captionrules.py) agree with the DenseNet-169 figure classifier. The
+    classifier dataset only has images, so the figures and their captions come from running GROBID on the PDFs of
+    the table dataset. Every figure is classified by DenseNet, and the figures with an obvious caption also by the
+    rules. Reports the share of figures the rules decide (the classifier calls saved), and the agreement with DenseNet
+    on those, both for the exact class and for the route (chart parser, figure parser or skipped) which is what
+    decides the output.
+    """
+    parser = argparse.ArgumentParser(description="Measure the agreement of the caption rules with the figure classifier.")
+    parser.add_argument('--dataset', dest='dataset', type=str, help='Folder with one subfolder per PDF.', default=os.path.join("..", "tables", "Dataset"))
+    parser.add_argument('--weights', dest='weights', type=str, help='Path to the trained weights saved by skorch.', default=classifier_ML.WEIGHTS_PATH)
+    args = parser.parse_args()
+
+    classifier_ML.WEIGHTS_PATH = args.weights
+    classifier_ML.SAFETENSORS_PATH = os.path.splitext(args.weights)[0] + ".safetensors"
+    model = classifier_ML.load_ml_inference()
+    figures = load_figures(args.dataset)
+
+    rows = []
+    for figure in figures:
+        rows.append({**figure, "rules": captionrules.match_caption(figure["caption"], figure["head"], figure["type"]),
+                     "densenet": classifier_ML.call_ml(model, figure["image"])})
+    decided = [row for row in rows if row["rules"] is not None]
+
+    def share(count, total):
+        return f"{count} / {total} ({count / total * 100 if total else 0:.1f} %)"
+
+    lines = [f"Figures: {len(rows)} in {len({row['pdf'] for row in rows})} PDFs", "",
+             f"Decided by the caption rules: {share(len(decided), len(rows))}",
+             f"Same class as DenseNet: {share(sum(row['rules'] == row['densenet'] for row in decided), len(decided))}",
+             f"Same route as DenseNet: {share(sum(ROUTES[row['rules']] == ROUTES[row['densenet']] for row in decided), len(decided))}",
+             "", f"{'Rules':<14}{'Figures':>10}{'Same class':>12}{'Same route':>12}  DenseNet classes"]
+    for rule_class in sorted({row["rules"] for row in decided}):
+        bucket = [row for row in decided if row["rules"] == rule_class]
+        densenet = ", ".join(f"{name} {count}" for name, count in Counter(row["densenet"] for row in bucket).most_common())
+        lines.append(f"{rule_class:<14}{len(bucket):>10}{sum(row['densenet'] == rule_class for row in bucket):>12}"
+                     f"{sum(ROUTES[row['densenet']] == ROUTES[rule_class] for row in bucket):>12}  {densenet}")
+
+    lines += ["", "Different route than DenseNet:"]
+    for row in decided:
+        if ROUTES[row["rules"]] != ROUTES[row["densenet"]]:
+            lines.append(f"  {row['pdf']}: rules {row['rules']}, DenseNet {row['densenet']}, head '{row['head']}', caption '{row['caption'][:100]}'")
+
+    results_dir = os.path.join(os.getcwd(), "Results", "CaptionRules")
+    os.makedirs(results_dir, exist_ok=True)
+    with open(os.path.join(results_dir, "caption_agreement_report.txt"), "w", encoding="utf-8") as log:
+        log.write("\n".join(lines) + "\n")
+        log.write("\n# The route is where classify() sends the figure: the chart parser, the figure parser or nowhere (skipped).\n")
+        log.write("# Agreement with DenseNet is not accuracy: DenseNet also makes mistakes, so check the listed figures by hand.\n")
+    # File is automatically closed after exiting the 'with' block
+
+    print("\n".join(lines))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import os
+import re
+import sys
+import time
+import argparse
+import statistics
+import numpy as np
+import torch
+from PIL import Image
+
+# Make the classifier of the application importable, so that the benchmark runs the exact same code as the API.
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..", "app")))
+import backend.models.classifiermodel as classifier_ML
+
+def load_images(dataset_dir):
+    """
+    Loads and transforms the images of the classifier dataset, the same way as call_ml() does.
+
+    Args:
+        dataset_dir (str): Path to evaluation/classifier/Dataset.
+
+    Returns:
+        tuple: The file names, and the transformed images as one tensor of shape (N, 3, 224, 224).
+    """
+    files = sorted(file for file in os.listdir(dataset_dir) if re.match(r"[a-z]+\d+\.png$", file))
+    images = [classifier_ML.preprocess_image(Image.open(os.path.join(dataset_dir, file))) for file in files]
+    return files, torch.cat(images)
+
+def time_batches(predict, images, batch_size, repeats):
+    """
+    Measures the time to classify every image, in batches of the given size.
+
+    Args:
+        predict (callable): Function which gets a batch of images and returns the logits.
+        images (torch.Tensor): The transformed images.
+        batch_size (int): The number of images per batch.
+        repeats (int): The number of times every batch is classified.
+
+    Returns:
+        list[float]: The time of every batch, in seconds.
+    """
+    times = []
+    for _ in range(repeats):
+        for start in range(0, len(images), batch_size):
+            batch = images[start:start + batch_size]
+            begin = time.perf_counter()
+            predict(batch)
+            times.append(time.perf_counter() - begin)
+    return times
+
+def main():
+    """
+    Parity test and CPU benchmark of the ONNX Runtime backend of the figure classifier against the PyTorch backend.
+    Both classify every image of the classifier dataset. The classes must be the same, and the logits may only differ
+    by the tolerance. Then the latency per image (batch size 1) and the throughput for larger batches are compared.
+    Exits with status 1 if the parity test fails.
+    """
+    parser = argparse.ArgumentParser(description="Compare the ONNX Runtime and PyTorch backends of the figure classifier.")
+    parser.add_argument('--dataset', dest='dataset', type=str, help='Path to the classifier dataset.', default="Dataset")
+    parser.add_argument('--weights', dest='weights', type=str, help='Path to the trained weights saved by skorch.', default=classifier_ML.WEIGHTS_PATH)
+    parser.add_argument('--onnx', dest='onnx', type=str, help='Path to the exported ONNX model. Exported first if it does not exist.', default=classifier_ML.ONNX_PATH)
+    parser.add_argument('--batch_sizes', dest='batch_sizes', type=int, nargs='+', help='Batch sizes for the throughput comparison.', default=[1, 8, 32])
+    parser.add_argument('--repeats', dest='repeats', type=int, help='Number of times the dataset is classified per batch size.', default=3)
+    parser.add_argument('--tolerance', dest='tolerance', type=float, help='Largest allowed absolute difference between the logits.', default=1e-3)
+    args = parser.parse_args()
+
+    classifier_ML.WEIGHTS_PATH = args.weights
+    classifier_ML.SAFETENSORS_PATH = os.path.splitext(args.weights)[0] + ".safetensors"
+
+    # Both backends on CPU, as in production
+    torch_module = classifier_ML.build_inference_module()
+    onnx_classifier = classifier_ML.load_ml_onnx(args.onnx, providers=["CPUExecutionProvider"])
+
+    def predict_torch(batch):
+        with torch.inference_mode():
+            return torch_module(batch).numpy()
+
+    def predict_onnx(batch):
+        return onnx_classifier.session.run(None, {onnx_classifier.input_name: batch.numpy()})[0]
+
+    files, images = load_images(args.dataset)
+
+    # Parity: the same classes, and logits within the tolerance
+    torch_logits, onnx_logits = predict_torch(images), predict_onnx(images)
+    max_difference = float(np.abs(torch_logits - onnx_logits).max())
+    mismatches = [(file, classifier_ML.CLASS_NAMES[a], classifier_ML.CLASS_NAMES[b])
+                  for file, a, b in zip(files, torch_logits.argmax(axis=1), onnx_logits.argmax(axis=1)) if a != b]
+    parity = max_difference <= args.tolerance and not mismatches
+
+    lines = [f"Images: {len(files)}, threads: {torch.get_num_threads()}, repeats: {args.repeats}", "",
+             f"Parity: {'PASS' if parity else 'FAIL'}",
+             f"    Max logit difference: {max_difference:.2e} (tolerance {args.tolerance:.0e})",
+             f"    Different classes: {len(mismatches)}"]
+    lines += [f"        {file}: torch {a}, onnx {b}" for file, a, b in mismatches]
+
+    # Latency and throughput, after one warm-up pass each
+    lines += ["", f"{'Batch':<8}{'torch ms/batch':>16}{'onnx ms/batch':>16}{'torch img/s':>14}{'onnx img/s':>14}{'Speedup':>10}"]
+    for batch_size in args.batch_sizes:
+        results = {}
+        for name, predict in [("torch", predict_torch), ("onnx", predict_onnx)]:
+            predict(images[:batch_size])
+            times = time_batches(predict, images, batch_size, args.repeats)
+            results[name] = {"median": statistics.median(times), "throughput": len(images) * args.repeats / sum(times)}
+        lines.append(f"{batch_size:<8}{results['torch']['median'] * 1000:>16.1f}{results['onnx']['median'] * 1000:>16.1f}"
+                     f"{results['torch']['throughput']:>14.1f}{results['onnx']['throughput']:>14.1f}"
+                     f"{results['onnx']['throughput'] / results['torch']['throughput']:>9.2f}x")
+
+    results_dir = os.path.join(os.getcwd(), "Results", "ONNX")
+    os.makedirs(results_dir, exist_ok=True)
+    with open(os.path.join(results_dir, "onnx_parity_benchmark_log.txt"), "w", encoding="utf-8") as log:
+        log.write("\n".join(lines) + "\n")
+        log.write("\n# ms/batch is the median time per batch, img/s the throughput over all batches, on CPU.\n")
+    # File is automatically closed after exiting the 'with' block
+
+    print("\n".join(lines))
+    sys.exit(0 if parity else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import os
+import sys
+import time
+import argparse
+import statistics
+from PIL import Image
+
+# Make the model modules of the application importable, so that the report runs the exact same code as the API.
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..", "app")))
+import backend.metrics as metrics
+import backend.models.decoding as decoding
+import backend.models.formulaparser as formula
+
+# The LaTeX comparison of the formula evaluation, so that the similarity is the same as in evaluation/formulas.
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "formulas", "Evaluation", "Code", "Sumen")))
+from OCR_Evaluation import compare_latex
+
+EVALUATION_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+def load_formula_dataset(dataset_dir):
+    """
+    Loads the images and ground truth LaTeX of the formula dataset.
+
+    Args:
+        dataset_dir (str): Path to evaluation/formulas/Dataset.
+
+    Returns:
+        list[tuple]: For each formula, the path to the image and the correct LaTeX.
+    """
+    items = []
+    for folder in sorted(os.listdir(dataset_dir)):
+        img_path = os.path.join(dataset_dir, folder, f"{folder}.png")
+        txt_path = os.path.join(dataset_dir, folder, f"{folder}.txt")
+        if os.path.exists(img_path) and os.path.exists(txt_path):
+            with open(txt_path, "r") as file:
+                items.append((img_path, file.read().strip()))
+            # File is automatically closed after exiting the 'with' block
+    return items
+
+def evaluate_policy(items, policy):
+    """
+    Runs Sumen over the formula dataset with a decoding policy.
+
+    Args:
+        items (list[tuple]): The formula dataset, as returned by load_formula_dataset().
+        policy (str): The decoding policy, one of decoding.DECODING_POLICIES.
+
+    Returns:
+        dict: The similarity to the correct LaTeX and the time of every formula, and the number of escalations to beam search.
+    """
+    escalations_before = metrics.snapshot("decoding_escalations_sumen")["counters"].get("decoding_escalations_sumen", 0)
+    scores, times = [], []
+    for img_path, correct_latex in items:
+        image = Image.open(img_path).convert("RGB")
+        start = time.perf_counter()
+        ocr_latex = formula.run_sumen_ocr(image, decoding_policy=policy)
+        times.append(time.perf_counter() - start)
+        scores.append(compare_latex(correct_latex, ocr_latex))
+    escalations = metrics.snapshot("decoding_escalations_sumen")["counters"].get("decoding_escalations_sumen", 0) - escalations_before
+    return {"scores": scores, "times": times, "escalations": escalations}
+
+def main():
+    """
+    Compares the decoding policies of Sumen on the formula dataset: beam search for every formula (the default),
+    greedy decoding for every formula, and adaptive decoding, which decodes greedily and only uses beam search when
+    the greedy formula is unlikely or has unbalanced \\left/\\right or \\begin/\\end. Reports the average similarity,
+    the latency and, for adaptive decoding, how often it escalated to beam search.
+    """
+    parser = argparse.ArgumentParser(description="Compare the decoding policies of Sumen on the formula dataset.")
+    parser.add_argument('--policies', dest='policies', type=str, nargs='+', choices=decoding.DECODING_POLICIES, help='Decoding policies to compare.', default=decoding.DECODING_POLICIES)
+    parser.add_argument('--min_mean_logprob', dest='min_mean_logprob', type=float, help='Lowest mean token log-probability of an accepted greedy formula.', default=decoding.MIN_MEAN_LOGPROB)
+    args = parser.parse_args()
+
+    # Read by decoding.generate() when run_sumen_ocr() decodes adaptively
+    decoding.MIN_MEAN_LOGPROB = args.min_mean_logprob
+
+    items = load_formula_dataset(os.path.join(EVALUATION_DIR, "formulas", "Dataset"))
+    formula.load_sumen()
+    formula.warmup()
+
+    results = {policy: evaluate_policy(items, policy) for policy in args.policies}
+
+    lines = [f"Formulas: {len(items)}, min mean log-probability: {args.min_mean_logprob}", "",
+             f"{'Policy':<12}{'Similarity':>12}{'Mean s':>10}{'p95 s':>10}{'Speedup':>10}{'Escalated':>12}"]
+    reference = results.get("beam")
+    for policy, result in results.items():
+        mean_time = statistics.mean(result["times"])
+        p95_time = sorted(result["times"])[min(len(result["times"]) - 1, int(0.95 * len(result["times"])))]
+        speedup = f"{statistics.mean(reference['times']) / mean_time:.2f}x" if reference and mean_time else "-"
+        escalated = f"{result['escalations'] / len(items) * 100:.1f} %" if policy == "adaptive" else "-"
+        lines.append(f"{policy:<12}{statistics.mean(result['scores']):>12.4f}{mean_time:>10.3f}{p95_time:>10.3f}{speedup:>10}{escalated:>12}")
+
+    results_dir = os.path.join(os.getcwd(), "Results")
+    os.makedirs(results_dir, exist_ok=True)
+    with open(os.path.join(results_dir, "adaptive_decoding_report.txt"), "w", encoding="utf-8") as log:
+        log.write("\n".join(lines) + "\n")
+        log.write("\n# Similarity is the difflib ratio between the normalized LaTeX, as in evaluation/formulas.\n")
+        log.write("# Speedup is relative to beam search. Escalated is the share of formulas decoded again with beam search.\n")
+    # File is automatically closed after exiting the 'with' block
+
+    print("\n".join(lines))
+
+if __name__ == "__main__":
+    main()
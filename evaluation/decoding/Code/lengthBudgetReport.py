@@ -0,0 +1,89 @@
+import os
+import sys
+import time
+import argparse
+import statistics
+from PIL import Image
+
+# Make the model modules of the application importable, so that the report runs the exact same code as the API.
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..", "app")))
+import backend.metrics as metrics
+import backend.models.formulaparser as formula
+
+from adaptiveDecodingReport import load_formula_dataset, compare_latex, EVALUATION_DIR
+
+def count_tokens(latex):
+    """
+    Counts the tokens of a LaTeX string with the tokenizer of Sumen.
+
+    Args:
+        latex (str): The LaTeX string.
+
+    Returns:
+        int: The number of tokens, including the start and end token.
+    """
+    return len(formula.sumen_processor.tokenizer(latex).input_ids)
+
+def main():
+    """
+    Compares Sumen with the maximum length of the model for every formula against the token budget predicted from
+    the size of the formula by formulaparser.predict_max_length(). Reports the similarity and the latency of both,
+    how far the budgets are from the actual number of tokens, and how many formulas reached their budget and had
+    to be decoded again. The formula dataset has no GROBID text, so only the image size is used for the prediction.
+    """
+    parser = argparse.ArgumentParser(description="Compare Sumen with and without the predicted token budget on the formula dataset.")
+    parser.add_argument('--scale', dest='scale', type=float, help='Factor the dataset images are resized with, to match the scale of the crops made by the application.', default=1.0)
+    parser.add_argument('--decoding', dest='decoding', type=str, choices=['beam', 'greedy', 'adaptive'], help='Decoding policy of Sumen.', default='beam')
+    args = parser.parse_args()
+
+    items = load_formula_dataset(os.path.join(EVALUATION_DIR, "formulas", "Dataset"))
+    formula.load_sumen()
+    formula.warmup()
+    model_max_length = formula.sumen_model.decoder.config.max_length
+
+    rows = []
+    for img_path, correct_latex in items:
+        image = Image.open(img_path).convert("RGB")
+        if args.scale != 1.0:
+            image = image.resize((max(1, int(image.width * args.scale)), max(1, int(image.height * args.scale))))
+
+        start = time.perf_counter()
+        full_latex = formula.run_sumen_ocr(image, decoding_policy=args.decoding)
+        full_time = time.perf_counter() - start
+
+        budget = formula.predict_max_length(image)
+        retries_before = metrics.snapshot("sumen_length_budget_retries")["counters"].get("sumen_length_budget_retries", 0)
+        start = time.perf_counter()
+        budget_latex = formula.run_sumen_ocr(image, decoding_policy=args.decoding, max_length=budget)
+        budget_time = time.perf_counter() - start
+        retried = metrics.snapshot("sumen_length_budget_retries")["counters"].get("sumen_length_budget_retries", 0) > retries_before
+
+        rows.append({"budget": budget, "tokens": count_tokens(full_latex), "retried": retried,
+                     "full_score": compare_latex(correct_latex, full_latex), "budget_score": compare_latex(correct_latex, budget_latex),
+                     "full_time": full_time, "budget_time": budget_time})
+
+    full_time, budget_time = statistics.mean(row["full_time"] for row in rows), statistics.mean(row["budget_time"] for row in rows)
+    lines = [f"Formulas: {len(rows)}, model max length: {model_max_length}, decoding: {args.decoding}, scale: {args.scale}", "",
+             f"{'':<24}{'Similarity':>12}{'Mean s':>10}",
+             f"{'Maximum length':<24}{statistics.mean(row['full_score'] for row in rows):>12.4f}{full_time:>10.3f}",
+             f"{'Predicted budget':<24}{statistics.mean(row['budget_score'] for row in rows):>12.4f}{budget_time:>10.3f}",
+             "", f"Speedup: {full_time / budget_time if budget_time else 0:.2f}x",
+             f"Reached budget and decoded again: {sum(row['retried'] for row in rows)} ({sum(row['retried'] for row in rows) / len(rows) * 100:.1f} %)",
+             f"Mean budget: {statistics.mean(row['budget'] for row in rows):.1f} tokens, mean output: {statistics.mean(row['tokens'] for row in rows):.1f} tokens",
+             "", f"{'Budget':<10}{'Formulas':>10}{'Max tokens':>12}{'Retries':>10}"]
+    for budget in sorted({row["budget"] for row in rows}):
+        bucket = [row for row in rows if row["budget"] == budget]
+        lines.append(f"{budget:<10}{len(bucket):>10}{max(row['tokens'] for row in bucket):>12}{sum(row['retried'] for row in bucket):>10}")
+
+    results_dir = os.path.join(os.getcwd(), "Results")
+    os.makedirs(results_dir, exist_ok=True)
+    with open(os.path.join(results_dir, "length_budget_report.txt"), "w", encoding="utf-8") as log:
+        log.write("\n".join(lines) + "\n")
+        log.write("\n# Max tokens is the longest output of the formulas with this budget, decoded with the maximum length.\n")
+        log.write("# Formulas which reach their budget are decoded again with the maximum length, so their time includes both.\n")
+    # File is automatically closed after exiting the 'with' block
+
+    print("\n".join(lines))
+
+if __name__ == "__main__":
+    main()
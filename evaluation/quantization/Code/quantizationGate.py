@@ -0,0 +1,187 @@
+import os
+import re
+import sys
+import time
+import argparse
+import statistics
+from PIL import Image
+
+# Make the model modules of the application importable, so that the gate runs the exact same code as the API.
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..", "app"))
+sys.path.insert(0, APP_DIR)
+import backend.models.formulaparser as formula
+import backend.models.classifiermodel as classifier_ML
+
+# The LaTeX comparison of the formula evaluation, so that the similarity is the same as in evaluation/formulas.
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "formulas", "Evaluation", "Code", "Sumen")))
+from OCR_Evaluation import compare_latex
+
+EVALUATION_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+# The classes of the classifier which count as correct for each category of the classifier dataset,
+#  the same as in evaluation/classifier/Code/ClassifierBenchmark.ipynb.
+CATEGORY_CLASSES = {
+    "chart": ["bar_chart", "graph", "pie_chart"],
+    "figure": ["flow_chart", "growth_chart", "diagram"],
+    "table": ["just_image", "table", "text_sentence"],
+    "other": ["just_image", "table", "text_sentence"],
+}
+
+def load_formula_dataset(dataset_dir):
+    """
+    Loads the images and ground truth LaTeX of the formula dataset.
+
+    Args:
+        dataset_dir (str): Path to evaluation/formulas/Dataset.
+
+    Returns:
+        list[tuple]: For each formula, the path to the image and the correct LaTeX.
+    """
+    items = []
+    for folder in sorted(os.listdir(dataset_dir)):
+        img_path = os.path.join(dataset_dir, folder, f"{folder}.png")
+        txt_path = os.path.join(dataset_dir, folder, f"{folder}.txt")
+        if os.path.exists(img_path) and os.path.exists(txt_path):
+            with open(txt_path, "r") as file:
+                items.append((img_path, file.read().strip()))
+            # File is automatically closed after exiting the 'with' block
+    return items
+
+def load_classifier_dataset(dataset_dir):
+    """
+    Loads the images of the classifier dataset, with the category given by the file name, e.g. chart4.png.
+
+    Args:
+        dataset_dir (str): Path to evaluation/classifier/Dataset.
+
+    Returns:
+        list[tuple]: For each image, the path and the category.
+    """
+    items = []
+    for file in sorted(os.listdir(dataset_dir)):
+        match = re.match(r"([a-z]+)\d+\.png$", file)
+        if match and match.group(1) in CATEGORY_CLASSES:
+            items.append((os.path.join(dataset_dir, file), match.group(1)))
+    return items
+
+def evaluate_formulas(items, quantize):
+    """
+    Runs Sumen over the formula dataset.
+
+    Args:
+        items (list[tuple]): The formula dataset, as returned by load_formula_dataset().
+        quantize (bool): Load Sumen with its Linear layers quantized to int8.
+
+    Returns:
+        dict: The outputs, the similarity to the correct LaTeX and the time of every formula.
+    """
+    formula.load_sumen(quantize=quantize)
+    formula.warmup()
+    outputs, scores, times = [], [], []
+    for img_path, correct_latex in items:
+        image = Image.open(img_path).convert("RGB")
+        start = time.perf_counter()
+        ocr_latex = formula.run_sumen_ocr(image)
+        times.append(time.perf_counter() - start)
+        outputs.append(ocr_latex)
+        scores.append(compare_latex(correct_latex, ocr_latex))
+    return {"outputs": outputs, "scores": scores, "times": times}
+
+def evaluate_classifier(items, quantize):
+    """
+    Runs the DenseNet169 classifier over the classifier dataset.
+
+    Args:
+        items (list[tuple]): The classifier dataset, as returned by load_classifier_dataset().
+        quantize (bool): Load the classifier with the Linear layers of its head quantized to int8.
+
+    Returns:
+        dict: The predicted classes, whether each is correct for the category of the image, and the time of every image.
+    """
+    model = classifier_ML.load_ml_inference(quantize=quantize)
+    classifier_ML.warmup(model)
+    outputs, scores, times = [], [], []
+    for img_path, category in items:
+        image = Image.open(img_path)
+        start = time.perf_counter()
+        predicted = classifier_ML.call_ml(model, image)
+        times.append(time.perf_counter() - start)
+        outputs.append(predicted)
+        scores.append(1.0 if predicted in CATEGORY_CLASSES[category] else 0.0)
+    return {"outputs": outputs, "scores": scores, "times": times}
+
+def compare_modes(name, metric, fp32, int8, max_drop):
+    """
+    Compares the results of the fp32 and the int8 model.
+
+    Args:
+        name (str): The name of the model.
+        metric (str): The name of the accuracy metric.
+        fp32 (dict): The results of the fp32 model.
+        int8 (dict): The results of the int8 model.
+        max_drop (float): The largest drop in the metric for which the gate passes.
+
+    Returns:
+        tuple: The lines of the report, and whether the gate passed.
+    """
+    fp32_score, int8_score = statistics.mean(fp32["scores"]), statistics.mean(int8["scores"])
+    fp32_time, int8_time = statistics.mean(fp32["times"]), statistics.mean(int8["times"])
+    agreement = sum(a == b for a, b in zip(fp32["outputs"], int8["outputs"])) / len(fp32["outputs"])
+    passed = fp32_score - int8_score <= max_drop
+
+    lines = [
+        f"{name} ({len(fp32['scores'])} elements)",
+        f"    {metric:<24}fp32 {fp32_score:.4f}   int8 {int8_score:.4f}   delta {int8_score - fp32_score:+.4f}",
+        f"    {'Mean time per element':<24}fp32 {fp32_time:.4f} s   int8 {int8_time:.4f} s   speedup {fp32_time / int8_time if int8_time else 0:.2f}x",
+        f"    {'Identical outputs':<24}{agreement * 100:.1f} %",
+        f"    Gate (max drop {max_drop}): {'PASS' if passed else 'FAIL'}",
+    ]
+    return lines, passed
+
+def main():
+    """
+    Evaluation gate for the int8 quantization mode. Runs the formula and classifier evaluation datasets through the
+    models in fp32 and with dynamically quantized int8 Linear layers, and reports the accuracy delta and the speedup.
+    Exits with status 1 if the accuracy of a quantized model drops more than allowed, so it can be used before
+    enabling --quantize for a model.
+    """
+    parser = argparse.ArgumentParser(description="Compare the fp32 and int8 quantized models on the evaluation datasets.")
+    parser.add_argument('--models', dest='models', type=str, nargs='+', choices=['sumen', 'classifier'], help='Models to evaluate.', default=['sumen', 'classifier'])
+    parser.add_argument('--classifier_weights', dest='classifier_weights', type=str, help='Path to the trained DenseNet169 weights saved by skorch.', default=classifier_ML.WEIGHTS_PATH)
+    parser.add_argument('--max_similarity_drop', dest='max_similarity_drop', type=float, help='Largest allowed drop in the average LaTeX similarity of Sumen.', default=0.01)
+    parser.add_argument('--max_accuracy_drop', dest='max_accuracy_drop', type=float, help='Largest allowed drop in the accuracy of the classifier.', default=0.02)
+    args = parser.parse_args()
+
+    report, gate_passed = [], True
+
+    if "sumen" in args.models:
+        items = load_formula_dataset(os.path.join(EVALUATION_DIR, "formulas", "Dataset"))
+        fp32, int8 = evaluate_formulas(items, quantize=False), evaluate_formulas(items, quantize=True)
+        lines, passed = compare_modes("Sumen", "Average similarity", fp32, int8, args.max_similarity_drop)
+        report += lines + [""]
+        gate_passed = gate_passed and passed
+
+    if "classifier" in args.models:
+        classifier_ML.WEIGHTS_PATH = args.classifier_weights
+        classifier_ML.SAFETENSORS_PATH = os.path.splitext(args.classifier_weights)[0] + ".safetensors"
+        items = load_classifier_dataset(os.path.join(EVALUATION_DIR, "classifier", "Dataset"))
+        fp32, int8 = evaluate_classifier(items, quantize=False), evaluate_classifier(items, quantize=True)
+        lines, passed = compare_modes("DenseNet169 classifier", "Accuracy", fp32, int8, args.max_accuracy_drop)
+        report += lines + [""]
+        gate_passed = gate_passed and passed
+
+    report.append(f"Quantization gate: {'PASS' if gate_passed else 'FAIL'}")
+
+    results_dir = os.path.join(os.getcwd(), "Results")
+    os.makedirs(results_dir, exist_ok=True)
+    with open(os.path.join(results_dir, "quantization_gate_log.txt"), "w", encoding="utf-8") as log:
+        log.write("\n".join(report) + "\n")
+        log.write("\n# Similarity is the difflib ratio between the normalized LaTeX, as in evaluation/formulas.\n")
+        log.write("# Identical outputs is the share of elements where both modes give exactly the same LaTeX or class.\n")
+    # File is automatically closed after exiting the 'with' block
+
+    print("\n".join(report))
+    sys.exit(0 if gate_passed else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import os
+import re
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+# The application folder, from which the modules are imported, the same way as the launch scripts do.
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..", "app"))
+
+# The modules imported by the CLI (processing.py), by the API workers and by each model.
+DEFAULT_MODULES = [
+    "processing",
+    "backend.classifier",
+    "backend.grobidclient",
+    "backend.chunking",
+    "backend.modelregistry",
+    "backend.models.tableparser",
+    "backend.models.classifiermodel",
+    "backend.models.formulaparser",
+    "backend.models.chartparser",
+    "backend.models.figureparser",
+]
+
+# A line of the output of 'python -X importtime': "import time:       123 |        456 |   package.module"
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)')
+
+def measure_import(module):
+    """
+    Imports a module in a fresh Python process with '-X importtime'.
+
+    Args:
+        module (str): The name of the module, e.g. 'backend.classifier'.
+
+    Returns:
+        dict: The wall time of the process in seconds, and for every imported module its self and cumulative time
+              in microseconds and its depth in the import tree. None if the import failed.
+    """
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=APP_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    wall_time = time.perf_counter() - start
+
+    imports = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            imports.append({"self": int(match.group(1)), "cumulative": int(match.group(2)),
+                            "depth": (len(match.group(3)) - 1) // 2, "name": match.group(4)})
+
+    if result.returncode != 0:
+        print(f"Importing {module} failed:\n{result.stderr.strip().splitlines()[-1] if result.stderr.strip() else ''}")
+        return None
+    return {"wall_time": wall_time, "imports": imports}
+
+def breakdown(imports):
+    """
+    Adds up the self time of every imported module per top-level package, e.g. all of torch.*.
+
+    Args:
+        imports (list[dict]): The imported modules, as returned by measure_import().
+
+    Returns:
+        dict: The total self time in microseconds per top-level package.
+    """
+    packages = {}
+    for imported in imports:
+        package = imported["name"].split(".")[0]
+        packages[package] = packages.get(package, 0) + imported["self"]
+    return packages
+
+def main():
+    """
+    Measures how long it takes to import the modules of the application, so that the startup of the CLI and of
+    the API workers can be compared before and after a change. Every module is imported in a fresh process
+    'repeats' times, and the median is reported, together with the top-level packages that take the most time.
+    """
+    parser = argparse.ArgumentParser(description="Report the import time of the application modules.")
+    parser.add_argument('--modules', dest='modules', type=str, nargs='+', help='Modules to import. Defaults to the CLI, the backend and the model modules.', default=DEFAULT_MODULES)
+    parser.add_argument('--repeats', dest='repeats', type=int, help='Number of times each module is imported, in a fresh process each time.', default=3)
+    parser.add_argument('--top', dest='top', type=int, help='Number of top-level packages listed per module.', default=8)
+    args = parser.parse_args()
+
+    # The time to start Python without importing anything, which is subtracted from the wall time
+    baseline = statistics.median(measure_import("sys")["wall_time"] for _ in range(args.repeats))
+
+    summary = [f"Python {sys.version.split()[0]}, repeats: {args.repeats}, interpreter startup: {baseline:.3f} s", "",
+               f"{'Module':<34}{'Import s':>10}{'Wall s':>10}{'Modules':>9}"]
+    details = []
+    for module in args.modules:
+        runs = [measure_import(module) for _ in range(args.repeats)]
+        if any(run is None for run in runs):
+            summary.append(f"{module:<34}{'failed':>10}")
+            continue
+
+        # The import time of the module itself is the cumulative time of the entry with depth 0 and the module's name
+        import_times = [next((imported["cumulative"] for imported in run["imports"] if imported["name"] == module and imported["depth"] == 0), 0) for run in runs]
+        median_run = sorted(runs, key=lambda run: run["wall_time"])[len(runs) // 2]
+        summary.append(f"{module:<34}{statistics.median(import_times) / 1e6:>10.3f}{statistics.median(run['wall_time'] for run in runs) - baseline:>10.3f}"
+                       f"{len(median_run['imports']):>9}")
+
+        details.append("")
+        details.append(f"{module}: slowest top-level packages (self time of all their modules)")
+        packages = sorted(breakdown(median_run["imports"]).items(), key=lambda item: item[1], reverse=True)
+        for package, self_time in packages[:args.top]:
+            details.append(f"    {package:<30}{self_time / 1e6:>10.3f} s")
+
+    results_dir = os.path.join(os.getcwd(), "Results")
+    os.makedirs(results_dir, exist_ok=True)
+    log_file = os.path.join(results_dir, "import_time_report.txt")
+
+    with open(log_file, "w", encoding="utf-8") as log:
+        log.write("\n".join(summary + details) + "\n")
+        log.write("\n# Import s is the time spent importing the module, as measured by 'python -X importtime'.\n")
+        log.write("# Wall s is the time of the whole process minus the interpreter startup, including logging setup at import.\n")
+    # File is automatically closed after exiting the 'with' block
+
+    print("\n".join(summary + details))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import os
+import sys
+import time
+import re
+import argparse
+import statistics
+
+# Make the GROBID client from the application importable, so that the benchmark sends the exact same parameters as the pipeline.
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..", "app")))
+import backend.grobidclient as grobidclient
+
+def count_elements(xml_content):
+    """
+    Counts the elements in the GROBID XML which the rest of the pipeline depends on.
+
+    Args:
+        xml_content (str): The XML content returned from GROBID.
+
+    Returns:
+        dict: The number of tables, figures, formulas and coordinates of figures and formulas.
+    """
+    return {
+        "tables": len(re.findall(r'<figure[^>]*\s+type="table"[^>]*>', xml_content)),
+        "figures": len(re.findall(r'<figure(?![^>]*\s+type="table")[^>]*>', xml_content)),
+        "formulas": len(re.findall(r'<formula[^>]*>', xml_content)),
+        "coords": len(re.findall(r'<(?:figure|formula)[^>]*\scoords="', xml_content))
+    }
+
+def percentile(values, fraction):
+    """
+    Finds the value below which the given fraction of the values fall.
+
+    Args:
+        values (list[float]): The values.
+        fraction (float): The fraction, e.g. 0.95 for the 95th percentile.
+
+    Returns:
+        float: The percentile, or 0 if there are no values.
+    """
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def main():
+    """
+    Sends every PDF in the table evaluation dataset to GROBID once per profile, and reports the latency of each profile
+    together with the number of tables, figures and formulas found, so that the speedup of a profile can be weighed
+    against what it loses.
+    The GROBID cache is bypassed, so every request is processed by GROBID.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the GROBID processing profiles.")
+    parser.add_argument('--dataset', dest='dataset', type=str, help='Path to the dataset folder.', default="Dataset")
+    parser.add_argument('--grobid_url', dest='grobid_url', type=str, help='URL of the GROBID server.', default="http://localhost:8070")
+    parser.add_argument('--profiles', dest='profiles', type=str, nargs='+', help='Profiles to benchmark. Defaults to all profiles.', default=list(grobidclient.GROBID_PROFILES))
+    parser.add_argument('--repeats', dest='repeats', type=int, help='Number of times each PDF is processed with each profile.', default=1)
+    args = parser.parse_args()
+
+    pdf_paths = []
+    for i in range(1, 21):
+        folder = f"{i:03d}"
+        pdf_path = os.path.join(args.dataset, folder, f"{folder}.pdf")
+        if os.path.isfile(pdf_path):
+            pdf_paths.append(pdf_path)
+        # Skip missing PDFs gracefully
+
+    if not pdf_paths:
+        print(f"No PDFs found in {args.dataset}.")
+        return
+
+    # Warm up GROBID, as the first request after startup also loads the models
+    with open(pdf_paths[0], "rb") as f:
+        grobidclient.process_fulltext_document(f.read(), use_cache=False, grobid_url=args.grobid_url, profile=args.profiles[0])
+
+    latencies = {profile: [] for profile in args.profiles}
+    counts = {profile: {"tables": 0, "figures": 0, "formulas": 0, "coords": 0} for profile in args.profiles}
+    errors = {profile: 0 for profile in args.profiles}
+
+    for n, pdf_path in enumerate(pdf_paths):
+        with open(pdf_path, "rb") as f:
+            pdf_bytes = f.read()
+        # File is automatically closed after exiting the 'with' block
+
+        # Alternate the order of the profiles, so that none of them always runs on a warmer GROBID
+        profiles = args.profiles if n % 2 == 0 else list(reversed(args.profiles))
+        for repeat in range(args.repeats):
+            for profile in profiles:
+                start = time.perf_counter()
+                try:
+                    xml_content = grobidclient.process_fulltext_document(pdf_bytes, use_cache=False, grobid_url=args.grobid_url, profile=profile)
+                except Exception as e:
+                    print(f"{pdf_path} failed with profile {profile}: {e}")
+                    errors[profile] += 1
+                    continue
+                latencies[profile].append(time.perf_counter() - start)
+
+                # Only count the elements once per PDF
+                if repeat == 0:
+                    for name, count in count_elements(xml_content).items():
+                        counts[profile][name] += count
+
+    results_dir = os.path.join(os.getcwd(), "Results", "GrobidProfiles")
+    os.makedirs(results_dir, exist_ok=True)
+    log_file = os.path.join(results_dir, "grobid_profile_benchmark_log.txt")
+
+    header = f"{'Profile':<10}{'Mean s':>10}{'p50 s':>10}{'p95 s':>10}{'Errors':>8}{'Tables':>8}{'Figures':>9}{'Formulas':>10}{'Coords':>8}"
+    lines = [f"PDF-documents: {len(pdf_paths)}, repeats: {args.repeats}, GROBID: {grobidclient.get_grobid_version(args.grobid_url) or 'unknown'}", "", header]
+    for profile in args.profiles:
+        values = latencies[profile]
+        lines.append(f"{profile:<10}{statistics.mean(values) if values else 0:>10.3f}{percentile(values, 0.5):>10.3f}{percentile(values, 0.95):>10.3f}"
+                     f"{errors[profile]:>8}{counts[profile]['tables']:>8}{counts[profile]['figures']:>9}"
+                     f"{counts[profile]['formulas']:>10}{counts[profile]['coords']:>8}")
+
+    with open(log_file, "w", encoding="utf-8") as log:
+        log.write("\n".join(lines) + "\n")
+        log.write("\n# Latency is the time per PDF-document, including the upload to GROBID.\n")
+        log.write("# Coords is the number of figures and formulas with coordinates, which the classifier needs to crop them.\n")
+    # File is automatically closed after exiting the 'with' block
+
+    print("\n".join(lines))
+
+if __name__ == "__main__":
+    main()
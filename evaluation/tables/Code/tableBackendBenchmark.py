@@ -0,0 +1,214 @@
+import os
+import sys
+import time
+import re
+import argparse
+import resource
+import tracemalloc
+import multiprocessing as mp
+
+# Make the table parser from the application importable, so that the benchmark runs the exact same backends as the API.
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..", "app")))
+import backend.models.tableparser as tableparser
+
+def read_total_tables(file_path):
+    """
+    Reads the expected number of tables from a text file.
+
+    Args:
+        file_path (str): Path to the text file containing the line 'Number of tables in PDF file: N'.
+
+    Returns:
+        int or None: The number of tables if found, otherwise None.
+    """
+    try:
+        with open(file_path, "r", encoding="utf-8") as file:
+            match = re.search(r'Number of tables in PDF file: (\d+)', file.read())
+            return int(match.group(1)) if match else None
+        # File is automatically closed after exiting the 'with' block
+    except FileNotFoundError:
+        # If the file isn't found, return None to skip
+        return None
+
+def calculate_accuracy(extracted_tables, total_tables):
+    """
+    Computes accuracy of table extraction.
+
+    Args:
+        extracted_tables (int): Number of tables extracted by the backend.
+        total_tables (int): Actual number of tables in the PDF.
+
+    Returns:
+        float: Accuracy value between 0 and 1.
+    """
+    if not total_tables:
+        return 0
+    diff = abs(extracted_tables - total_tables)
+    if extracted_tables <= total_tables:
+        return max(0, 1 - diff / total_tables)
+    else:
+        return max(0, 1 - diff / extracted_tables)
+
+def run_backend(backend, dataset_path, max_margin, results_queue):
+    """
+    Runs one backend over the whole dataset. This runs in its own process, so that the peak memory
+    of one backend does not influence the numbers of the next one.
+
+    Args:
+        backend (str): Name of the backend in tableparser.TABLE_BACKENDS.
+        dataset_path (str): Path to the root dataset folder containing subfolders '001' to '020'.
+        max_margin (int): Maximum vertical margin (in points) to capture context text above and below tables.
+        results_queue (multiprocessing.Queue): Queue where the results for each PDF and the peak RSS are put.
+    """
+    extract = tableparser.TABLE_BACKENDS[backend]
+    documents = []
+
+    for i in range(1, 21):
+        folder = f"{i:03d}"
+        pdf_path = os.path.join(dataset_path, folder, f"{folder}.pdf")
+        total_file = os.path.join(dataset_path, folder, f"TotalTables{i}.txt")
+        if not os.path.isfile(pdf_path):
+            # Skip missing PDFs gracefully
+            continue
+
+        # Measure the time of extracting the tables and building the XML
+        start = time.perf_counter()
+        try:
+            tables = extract(pdf_path, max_margin)
+            tableparser.tables_to_xml(tables)
+            count = len(tables)
+            error = None
+        except Exception as e:
+            count = 0
+            error = str(e)
+        proc_time = time.perf_counter() - start
+
+        # Measure the peak Python memory in a separate run, as tracemalloc slows down the extraction a lot
+        tracemalloc.start()
+        try:
+            tableparser.tables_to_xml(extract(pdf_path, max_margin))
+        except Exception:
+            pass
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        documents.append({
+            "folder": folder,
+            "extracted": count,
+            "total": read_total_tables(total_file),
+            "time": proc_time,
+            "peak_memory": peak_memory,
+            "error": error
+        })
+
+    # ru_maxrss is reported in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    results_queue.put({"documents": documents, "peak_rss": peak_rss})
+
+def write_log(backend, results, results_dir):
+    """
+    Writes the per-document results and the summary for one backend to its log file.
+
+    Args:
+        backend (str): Name of the backend.
+        results (dict): The results from run_backend().
+        results_dir (str): Folder where the log file is written.
+
+    Returns:
+        dict: The summary metrics for the backend.
+    """
+    backend_dir = os.path.join(results_dir, backend)
+    os.makedirs(backend_dir, exist_ok=True)
+    log_file = os.path.join(backend_dir, f"{backend}_benchmark_log.txt")
+
+    documents = results["documents"]
+    total_tables_sum = sum(document["total"] or 0 for document in documents)
+    extracted_tables_sum = sum(document["extracted"] for document in documents)
+    total_processing_time = sum(document["time"] for document in documents)
+    accuracy_sum = 0
+
+    with open(log_file, "w", encoding="utf-8") as log:
+        for document in documents:
+            accuracy = calculate_accuracy(document["extracted"], document["total"]) * 100
+            accuracy_sum += accuracy
+            time_per_table = document["time"] / document["extracted"] if document["extracted"] > 0 else 0
+
+            # Log details for this PDF
+            log.write(f"Processing folder: {document['folder']}\n")
+            log.write(f"PDF {document['folder']}.pdf:\n")
+            if document["error"]:
+                log.write(f"Error: {document['error']}\n")
+            log.write(f"Extracted tables: {document['extracted']}\n")
+            log.write(f"Total tables: {document['total']}\n")
+            log.write(f"Accuracy = {accuracy:.2f}%\n")
+            log.write(f"Processing time: {document['time']:.4f} seconds\n")
+            log.write(f"Time per table: {time_per_table:.4f} seconds\n")
+            log.write(f"Peak Python memory: {document['peak_memory'] / 1024**2:.2f} MB\n")
+            log.write("\n" + "-"*50 + "\n")
+
+        # Compute final summary metrics
+        summary = {
+            "backend": backend,
+            "documents": len(documents),
+            "overall_accuracy": calculate_accuracy(extracted_tables_sum, total_tables_sum) * 100,
+            "average_accuracy": accuracy_sum / len(documents) if documents else 0,
+            "time_per_document": total_processing_time / len(documents) if documents else 0,
+            "time_per_table": total_processing_time / extracted_tables_sum if extracted_tables_sum > 0 else 0,
+            "peak_memory": max((document["peak_memory"] for document in documents), default=0),
+            "peak_rss": results["peak_rss"]
+        }
+
+        # Write summary to log
+        log.write("\nSummary:\n")
+        log.write(f"Total comparisons: {summary['documents']}\n")
+        log.write(f"Total tables in all PDFs: {total_tables_sum}\n")
+        log.write(f"Total tables found by {backend}: {extracted_tables_sum}\n")
+        log.write(f"Overall accuracy: {summary['overall_accuracy']:.2f}%\n")
+        log.write(f"Average accuracy per PDF-document: {summary['average_accuracy']:.2f}%\n")
+        log.write(f"Average processing time per PDF-document: {summary['time_per_document']:.4f} seconds\n")
+        log.write(f"Average processing time per table: {summary['time_per_table']:.4f} seconds\n")
+        log.write(f"Peak Python memory for a single PDF-document: {summary['peak_memory'] / 1024**2:.2f} MB\n")
+        log.write(f"Peak resident memory of the benchmark process: {summary['peak_rss'] / 1024**2:.2f} MB\n")
+        log.write("\n# Accuracy explanation:\n")
+        log.write("# Overall accuracy: Compares all tables found versus all actual tables in the dataset.\n")
+        log.write("# Average accuracy per PDF-document: Calculates accuracy for each PDF separately, then averages those results.\n")
+    # File is automatically closed after exiting the 'with' block
+
+    return summary
+
+def main():
+    """
+    Runs every selected table backend over the dataset and reports accuracy, time per table and peak memory,
+    so that the backend for a deployment can be chosen based on numbers.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the table extraction backends of the table parser.")
+    parser.add_argument('--dataset', dest='dataset', type=str, help='Path to the dataset folder.', default="Dataset")
+    parser.add_argument('--backends', dest='backends', type=str, nargs='+', help='Backends to benchmark. Defaults to all available backends.', default=list(tableparser.TABLE_BACKENDS))
+    parser.add_argument('--max_margin', dest='max_margin', type=int, help='Maximum margin for capturing text context near the table.', default=50)
+    args = parser.parse_args()
+
+    results_dir = os.path.join(os.getcwd(), "Results")
+    summaries = []
+
+    for backend in args.backends:
+        if backend not in tableparser.TABLE_BACKENDS:
+            print(f"Backend '{backend}' is not available, skipping it.")
+            continue
+
+        print(f"Benchmarking backend: {backend}")
+        results_queue = mp.Queue()
+        process = mp.Process(target=run_backend, args=(backend, args.dataset, args.max_margin, results_queue))
+        process.start()
+        results = results_queue.get()
+        process.join()
+        summaries.append(write_log(backend, results, results_dir))
+
+    # Print a comparison of all the backends
+    print(f"\n{'Backend':<12}{'Overall acc.':>14}{'Avg. acc.':>12}{'s/table':>10}{'s/PDF':>10}{'Peak MB':>10}{'RSS MB':>10}")
+    for summary in summaries:
+        print(f"{summary['backend']:<12}{summary['overall_accuracy']:>13.2f}%{summary['average_accuracy']:>11.2f}%"
+              f"{summary['time_per_table']:>10.4f}{summary['time_per_document']:>10.4f}"
+              f"{summary['peak_memory'] / 1024**2:>10.2f}{summary['peak_rss'] / 1024**2:>10.2f}")
+
+if __name__ == "__main__":
+    main()
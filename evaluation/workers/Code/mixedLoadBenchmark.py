@@ -0,0 +1,176 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import statistics
+import requests
+
+EVALUATION_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+# The endpoint of each kind of element, and the folder and file names of the images sent to it.
+ENDPOINTS = {
+    "formula": {"endpoint": "parse_formula", "images": os.path.join(EVALUATION_DIR, "formulas", "Dataset"), "pattern": r"\d+\.png$"},
+    "chart": {"endpoint": "parse_chart", "images": os.path.join(EVALUATION_DIR, "classifier", "Dataset"), "pattern": r"chart\d+\.png$"},
+    "figure": {"endpoint": "parse_figure", "images": os.path.join(EVALUATION_DIR, "classifier", "Dataset"), "pattern": r"figure\d+\.png$"},
+}
+
+def load_images(kind):
+    """
+    Reads the images sent for one kind of element.
+
+    Args:
+        kind (str): 'formula', 'chart' or 'figure'.
+
+    Returns:
+        list[bytes]: The PNG files.
+    """
+    images = []
+    for root, dirs, files in os.walk(ENDPOINTS[kind]["images"]):
+        for file in sorted(files):
+            if re.match(ENDPOINTS[kind]["pattern"], file):
+                with open(os.path.join(root, file), "rb") as image:
+                    images.append(image.read())
+                # File is automatically closed after exiting the 'with' block
+    return images
+
+def send(api_url, kind, image):
+    """
+    Sends one element to the API.
+
+    Args:
+        api_url (str): The URL of the API, ending with '/'.
+        kind (str): 'formula', 'chart' or 'figure'.
+        image (bytes): The PNG file.
+
+    Returns:
+        bool: True if the API answered with status 200.
+    """
+    files = {'image': image}
+    if kind != "formula":
+        files['prompt'] = ""
+    response = requests.post(api_url + ENDPOINTS[kind]["endpoint"], files=files)
+    return response.status_code == 200
+
+def run_load(api_url, mix, images, clients, duration, seed):
+    """
+    Sends a mixed load to the API: every client sends one element after another until the time is up, choosing the
+    kind of each element at random with the weights of the mix.
+
+    Args:
+        api_url (str): The URL of the API, ending with '/'.
+        mix (dict): The weight of each kind of element, e.g. {'formula': 6, 'chart': 2, 'figure': 2}.
+        images (dict): The images of each kind, as returned by load_images().
+        clients (int): The number of clients sending at the same time.
+        duration (float): The length of the benchmark in seconds.
+        seed (int): The seed of the random choices, so that runs against different setups send the same elements.
+
+    Returns:
+        list[dict]: For every request, the kind, the latency in seconds and whether it succeeded.
+    """
+    results = []
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def client(number):
+        rng = random.Random(seed + number)
+        kinds = list(mix)
+        while time.time() < deadline:
+            kind = rng.choices(kinds, weights=[mix[kind] for kind in kinds])[0]
+            image = rng.choice(images[kind])
+            start = time.perf_counter()
+            try:
+                success = send(api_url, kind, image)
+            except Exception:
+                success = False
+            with lock:
+                results.append({"kind": kind, "latency": time.perf_counter() - start, "success": success})
+
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def summarize(results, duration):
+    """
+    Summarizes the requests of one run.
+
+    Args:
+        results (list[dict]): The requests, as returned by run_load().
+        duration (float): The length of the run in seconds.
+
+    Returns:
+        dict: For every kind and in total, the number of successful requests per second, the latency percentiles and the errors.
+    """
+    summary = {}
+    for kind in sorted({result["kind"] for result in results}) + ["total"]:
+        selected = [result for result in results if kind == "total" or result["kind"] == kind]
+        latencies = sorted(result["latency"] for result in selected if result["success"])
+        summary[kind] = {
+            "requests": len(selected),
+            "throughput": len(latencies) / duration,
+            "p50": statistics.median(latencies) if latencies else 0.0,
+            "p95": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] if latencies else 0.0,
+            "errors": len(selected) - len(latencies),
+        }
+    return summary
+
+def main():
+    """
+    Throughput benchmark of the API under a mixed load of formulas, charts and figures, to compare the models running
+    in the process of the API with the models running in their own worker processes (--model_workers). Run it once
+    against an API launched in each setup, with a different label. The results of every label are kept in the same
+    file, and all of them are printed side by side.
+    """
+    parser = argparse.ArgumentParser(description="Measure the throughput of the API under a mixed load.")
+    parser.add_argument('--url', dest='url', type=str, help='URL of the API.', default="http://172.28.0.12:8000/")
+    parser.add_argument('--label', dest='label', type=str, help="Name of the setup, e.g. 'shared' or 'workers'.", required=True)
+    parser.add_argument('--clients', dest='clients', type=int, help='Number of clients sending requests at the same time.', default=8)
+    parser.add_argument('--duration', dest='duration', type=float, help='Length of the benchmark in seconds.', default=300)
+    parser.add_argument('--mix', dest='mix', type=str, help="Weight of each kind of element, e.g. 'formula=6,chart=2,figure=2'.", default="formula=6,chart=2,figure=2")
+    parser.add_argument('--seed', dest='seed', type=int, help='Seed of the random choice of elements.', default=0)
+    args = parser.parse_args()
+
+    api_url = args.url if args.url.endswith("/") else args.url + "/"
+    mix = {setting.split("=")[0].strip(): float(setting.split("=")[1]) for setting in args.mix.split(",")}
+    images = {kind: load_images(kind) for kind in mix}
+
+    # One element of each kind first, so that the first requests don't include loading the models
+    for kind in mix:
+        send(api_url, kind, images[kind][0])
+
+    results = run_load(api_url, mix, images, args.clients, args.duration, args.seed)
+
+    results_dir = os.path.join(os.getcwd(), "Results")
+    os.makedirs(results_dir, exist_ok=True)
+    results_file = os.path.join(results_dir, "mixed_load_benchmark.json")
+    runs = {}
+    if os.path.exists(results_file):
+        with open(results_file, "r", encoding="utf-8") as file:
+            runs = json.load(file)
+        # File is automatically closed after exiting the 'with' block
+    runs[args.label] = {"clients": args.clients, "duration": args.duration, "mix": args.mix, "summary": summarize(results, args.duration)}
+    with open(results_file, "w", encoding="utf-8") as file:
+        json.dump(runs, file, indent=2)
+    # File is automatically closed after exiting the 'with' block
+
+    lines = [f"{'Setup':<14}{'Kind':<10}{'Requests':>10}{'req/s':>10}{'p50 s':>10}{'p95 s':>10}{'Errors':>8}"]
+    for label, run in runs.items():
+        for kind, kind_summary in run["summary"].items():
+            lines.append(f"{label:<14}{kind:<10}{kind_summary['requests']:>10}{kind_summary['throughput']:>10.3f}"
+                         f"{kind_summary['p50']:>10.2f}{kind_summary['p95']:>10.2f}{kind_summary['errors']:>8}")
+        lines.append(f"{'':<14}({run['clients']} clients, {run['duration']:.0f} s, mix {run['mix']})")
+    with open(os.path.join(results_dir, "mixed_load_benchmark.txt"), "w", encoding="utf-8") as log:
+        log.write("\n".join(lines) + "\n")
+        log.write("\n# req/s counts the successful requests. The latencies are of the successful requests.\n")
+    # File is automatically closed after exiting the 'with' block
+
+    print("\n".join(lines))
+
+if __name__ == "__main__":
+    main()